@@ -1,18 +1,37 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_from_directory
-from flask_socketio import SocketIO, emit
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_file, abort, g, Response
+from flask_socketio import SocketIO, emit, join_room
 import os
 import datetime
-import json
-import paho.mqtt.client as mqtt
+import logging
+import math
 import threading
 import time
-import requests
-from bs4 import BeautifulSoup
-import urllib.parse
+import uuid
 from firebase_config import (
-    create_user, get_user_by_credentials, get_user_by_id, update_user_profile,
-    add_notification, get_user_notifications, add_irrigation_event, check_user_exists
+    create_user, authenticate, get_user_by_id, update_user_profile,
+    get_user_notifications, UserExistsError,
+    get_notifications_page, get_unread_notification_count, mark_all_notifications_read,
+    get_irrigation_events_page, IRRIGATION_EVENT_TYPES, apply_writes, update_user_thresholds,
+    configure_storage, get_user_cache_stats, fetch_concurrently, is_permanent_write_error
 )
+import request_scope
+from telemetry_store import TelemetryStore, METRICS
+from sensor_codec import decode_payload, PayloadError
+from downsample import lttb
+from device_registry import DeviceRegistry
+from mqtt_ingest import ShardedWorkerPool, parse_status, parse_topic, TOPIC_DATA_WILDCARD, TOPIC_STATUS_WILDCARD, TOPIC_ACK_WILDCARD
+from realtime import SensorBroadcaster, user_room, device_room
+from write_behind import WriteBehindQueue
+from auto_irrigation import AutoIrrigationEngine, MIN_BAND
+from command_dispatcher import CommandDispatcher, COMMAND_QOS, ACKED, FAILED, UNCONFIRMED
+from metrics import REGISTRY
+from app_logging import get_logger, configure_logging, logging_stats
+from image_index import ImageIndex
+from image_store import ImageStore, split_blob_name
+from image_retention import RetentionManager
+from passwords import PasswordHasherBusy, password_stats
+from cluster import LeaderLease, load_secret_key, socketio_options, CLUSTER_DB, SECRET_KEY_FILE
+from http_cache import HTTPCache, etag_for
 
 # Translation dictionary for Arabic and French
 translations = {
@@ -51,6 +70,9 @@ translations = {
         'humidity_chart': 'تطور الرطوبة',
         'weekdays': ['الإثنين', 'الثلاثاء', 'الأربعاء', 'الخميس', 'الجمعة', 'السبت', 'الأحد'],
         'humidity_label': 'الرطوبة (%)',
+        'unread': 'غير مقروءة',
+        'mark_all_read': 'تعليم الكل كمقروء',
+        'load_more': 'عرض المزيد',
     },
     'fr': {
         'login': 'Connexion',
@@ -87,22 +109,62 @@ translations = {
         'humidity_chart': "Évolution de l'humidité",
         'weekdays': ['Lun', 'Mar', 'Mer', 'Jeu', 'Ven', 'Sam', 'Dim'],
         'humidity_label': 'Humidité (%)',
+        'unread': 'Non lues',
+        'mark_all_read': 'Tout marquer comme lu',
+        'load_more': 'Voir plus',
     }
 }
 
+# Écritures Firestore différées hors du chemin des requêtes
+write_queue = WriteBehindQueue(apply_writes, is_permanent=is_permanent_write_error)
+
 # --- Uploads Configuration ---
 UPLOAD_FOLDER = 'static/uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
+log = get_logger('app')
+
+# --- Métriques exposées sur /metrics (compteurs en mémoire, coût négligeable) ---
+MQTT_MESSAGES_RECEIVED = REGISTRY.counter(
+    'mqtt_messages_received_total', 'MQTT messages received, by topic kind', ('kind',))
+MQTT_MESSAGES_PARSED = REGISTRY.counter(
+    'mqtt_messages_parsed_total', 'Sensor messages decoded')
+MQTT_SAMPLES_PARSED = REGISTRY.counter(
+    'mqtt_samples_parsed_total', 'Sensor samples decoded (a message may hold several)')
+MQTT_MESSAGES_FAILED = REGISTRY.counter(
+    'mqtt_messages_failed_total', 'MQTT messages not processed, by reason', ('reason',))
+MQTT_PROCESSING_SECONDS = REGISTRY.histogram(
+    'mqtt_message_processing_seconds', 'Time to process one MQTT message on an ingest worker', ('kind',))
+MQTT_CONNECTIONS = REGISTRY.counter(
+    'mqtt_connections_total', 'MQTT broker connection results', ('result',))
+MQTT_RECONNECTS = REGISTRY.counter(
+    'mqtt_reconnects_total', 'Reconnection attempts after the MQTT loop failed')
+SOCKETIO_CLIENTS = REGISTRY.gauge(
+    'socketio_connected_clients', 'Socket.IO clients currently connected')
+SOCKETIO_EMITS = REGISTRY.counter(
+    'socketio_emits_total', 'Socket.IO events emitted by the server', ('event',))
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'http_request_duration_seconds', 'HTTP request latency per route', ('endpoint', 'method'))
+HTTP_REQUESTS = REGISTRY.counter(
+    'http_requests_total', 'HTTP responses per route and status', ('endpoint', 'method', 'status'))
+STORAGE_READS_PER_REQUEST = REGISTRY.histogram(
+    'storage_reads_per_request', 'Backend reads (documents or queries) made by one request, per route',
+    ('endpoint',), buckets=(0, 1, 2, 3, 4, 6, 10, 20))
+
+class CountingSocketIO(SocketIO):
+    """SocketIO that counts server-side emits per event"""
+
+    def emit(self, event, *args, **kwargs):
+        SOCKETIO_EMITS.inc(event)
+        return super().emit(event, *args, **kwargs)
+
 # Explicitly set static and template folders for clarity
 app = Flask(__name__, static_folder='static', template_folder='templates')
-app.secret_key = os.urandom(24)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-socketio = SocketIO(app, cors_allowed_origins="*")
-
-# Create upload folder if it doesn't exist
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+# Camera frames are streamed to disk; reject anything larger than this
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+# Attached to the app by create_app(), with the message queue if one is configured
+socketio = CountingSocketIO(cors_allowed_origins="*")
 
 def allowed_file(filename):
     return '.' in filename and \
@@ -133,132 +195,508 @@ guides = {
 DATA_FILE = "data.json"
 
 # --- MQTT Configuration ---
-MQTT_BROKER_URL = "broker.hivemq.com"
-MQTT_BROKER_PORT = 1883
+MQTT_BROKER_URL = os.environ.get('MQTT_BROKER_URL', "broker.hivemq.com")
+MQTT_BROKER_PORT = int(os.environ.get('MQTT_BROKER_PORT', 1883))
 MQTT_TOPIC_DATA = "irrigateq/esp32/data"
 MQTT_TOPIC_STATUS = "irrigateq/esp32/status"
 MQTT_TOPIC_COMMAND = "irrigateq/flask/command"
 
-# Stockage des dernières données reçues via MQTT
-mqtt_data_cache = {
+# Device ID used for readings published on the legacy single-device topic
+DEFAULT_DEVICE_ID = "esp32"
+
+# Historique des mesures capteurs (SQLite + fenêtre récente en mémoire)
+telemetry = TelemetryStore()
+
+# Résolution des tokens de topic vers la table devices
+device_registry = DeviceRegistry(legacy_tokens={
+    # DEFAULT_DEVICE_OWNER lets one user's thresholds drive the legacy ESP32
+    "esp32": {'device_id': DEFAULT_DEVICE_ID, 'user_id': os.environ.get('DEFAULT_DEVICE_OWNER'),
+              'token': "esp32", 'plant_name': None}
+})
+
+# Dernières images par utilisateur et par appareil, sans parcourir le dossier
+image_index = ImageIndex(upload_folder=UPLOAD_FOLDER)
+# Images adressées par contenu et miniatures WebP générées en arrière-plan
+image_store = ImageStore(root=UPLOAD_FOLDER)
+
+# Quotas par utilisateur/appareil appliquées en arrière-plan
+image_retention = RetentionManager(image_index, image_store)
+
+# Validateurs HTTP (304), Cache-Control par type de route et compression gzip/brotli
+http_cache = HTTPCache()
+
+# --- Déploiement multi-processus (voir cluster.py) ---
+# Bail du processus qui consomme les mesures MQTT; None avec un seul processus
+cluster_lease = None
+
+# Seconds between two reloads of the thresholds by the leader, since a
+# profile update only reaches the worker that served it
+RULES_REFRESH_INTERVAL = 60
+
+# Followers check the `images` table for other workers' uploads this often
+IMAGE_INDEX_REFRESH_INTERVAL = 2
+
+def is_leader():
+    """True unless another worker holds the MQTT ingest lease"""
+    return cluster_lease is None or cluster_lease.is_leader
+
+# Blob URLs never change, so browsers and proxies may keep them for a year
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# État de la connexion de ce processus au broker MQTT
+broker_status = {"mqtt_backend_status": "Connecting..."}
+
+# Dernières valeurs par appareil. Chaque mise à jour remplace l'instantané
+# d'un bloc, pour qu'un lecteur ne mélange jamais deux mesures
+EMPTY_DEVICE_DATA = {
     "temperature": None,
     "humidite": None,
     "sol": None,
+    "sol_state": None,
     "last_update": None,
-    "mqtt_backend_status": "Connecting...",
     "esp32_mqtt_status": "Unknown"
 }
+latest_by_device = {}
+_latest_lock = threading.Lock()
+
+def set_device_data(device_id, **fields):
+    """Replace a device's snapshot with one carrying the new fields"""
+    with _latest_lock:
+        latest_by_device[device_id] = dict(latest_by_device.get(device_id, EMPTY_DEVICE_DATA), **fields)
 
 # --- Fonctions Callbacks MQTT ---
 def on_connect(client, userdata, flags, rc):
+    MQTT_CONNECTIONS.inc('success' if rc == 0 else 'refused')
     if rc == 0:
-        print("Connecté au broker MQTT!")
-        client.subscribe(MQTT_TOPIC_DATA)
-        client.subscribe(MQTT_TOPIC_STATUS)
-        mqtt_data_cache["mqtt_backend_status"] = "Connecté au broker"
+        log.info("Connecté au broker MQTT")
+        # Every worker sends commands and follows acks/status; only the leader ingests data
+        if is_leader():
+            client.subscribe(TOPIC_DATA_WILDCARD)
+        client.subscribe(TOPIC_STATUS_WILDCARD)
+        client.subscribe(TOPIC_ACK_WILDCARD, qos=COMMAND_QOS)
+        broker_status["mqtt_backend_status"] = "Connecté au broker"
         # Emit connection status to all clients
-        socketio.emit('mqtt_status', {'status': 'connected'})
+        if is_leader():
+            socketio.emit('mqtt_status', {'status': 'connected'})
     else:
-        print(f"Échec de la connexion MQTT, code: {rc}")
-        mqtt_data_cache["mqtt_backend_status"] = f"Échec connexion broker ({rc})"
-        socketio.emit('mqtt_status', {'status': 'disconnected', 'error': rc})
+        log.warning("Échec de la connexion MQTT, code: %s", rc, extra={'rc': rc})
+        broker_status["mqtt_backend_status"] = f"Échec connexion broker ({rc})"
+        if is_leader():
+            socketio.emit('mqtt_status', {'status': 'disconnected', 'error': rc})
 
 def on_message(client, userdata, msg):
-    try:
-        payload = msg.payload.decode()
-        if msg.topic == MQTT_TOPIC_DATA:
-            data = json.loads(payload)
-            mqtt_data_cache["temperature"] = data.get("temperature")
-            mqtt_data_cache["humidite"] = data.get("humidite")
-            mqtt_data_cache["sol"] = data.get("sol")
-            mqtt_data_cache["last_update"] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            print("Données capteurs mises à jour:", mqtt_data_cache)
-            
-            # Emit sensor data to all connected clients via WebSocket
-            socketio.emit('sensor_update', {
-                'temperature': data.get("temperature"),
-                'humidite': data.get("humidite"),
-                'sol': data.get("sol"),
-                'timestamp': mqtt_data_cache["last_update"]
-            })
-
-        elif msg.topic == MQTT_TOPIC_STATUS:
-            mqtt_data_cache["esp32_mqtt_status"] = payload
-            print("Statut ESP32 reçu:", payload)
-            # Emit ESP32 status to all clients
-            socketio.emit('esp32_status', {'status': payload})
-
-    except Exception as e:
-        print(f"Erreur lors du traitement du message MQTT: {e}")
+    # Runs on paho's network thread: only route the message to its device's worker
+    token, kind = parse_topic(msg.topic)
+    if token is None:
+        MQTT_MESSAGES_FAILED.inc('bad_topic')
+        return
+    MQTT_MESSAGES_RECEIVED.inc(kind)
+    if not ingest_pool.submit(token, token, kind, msg.payload):
+        MQTT_MESSAGES_FAILED.inc('queue_full')
+
+def process_message(token, kind, raw_payload):
+    """Handle one MQTT message on an ingest worker thread"""
+    with MQTT_PROCESSING_SECONDS.time(kind):
+        try:
+            handle_device_message(token, kind, raw_payload)
+        except Exception:
+            MQTT_MESSAGES_FAILED.inc('error')
+            raise
+
+def handle_device_message(token, kind, raw_payload):
+    device = device_registry.resolve(token)
+    if device is None:
+        MQTT_MESSAGES_FAILED.inc('unknown_device')
+        log.warning("Message ignoré pour un appareil inconnu", extra={'token': token})
+        return
+    if kind == "data":
+        # JSON or binary frames, one or several samples per message; parsed once
+        # here so everything downstream gets numbers in °C and %
+        try:
+            readings = decode_payload(raw_payload)
+        except PayloadError as e:
+            MQTT_MESSAGES_FAILED.inc('invalid_payload')
+            log.warning("Message capteur invalide: %s", e, extra={'device_id': device['device_id']})
+            return
+        MQTT_MESSAGES_PARSED.inc()
+        MQTT_SAMPLES_PARSED.inc(amount=len(readings))
+        if not readings:
+            return
+        last_update = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        for reading in readings:
+            telemetry.add(device['device_id'], reading)
+            auto_irrigation.evaluate(device['device_id'], reading.sol)
+
+            # Coalesced, rate-limited push to the browsers watching this device
+            update = reading.as_dict()
+            update['device_id'] = device['device_id']
+            update['timestamp'] = last_update
+            sensor_broadcaster.publish(device_room(device['device_id']), update)
+
+        reading = readings[-1]
+        set_device_data(device['device_id'], temperature=reading.temperature, humidite=reading.humidite,
+                        sol=reading.sol, sol_state=reading.sol_state, last_update=last_update)
+        # Une ligne par message capteur: uniquement en DEBUG, sans rien construire sinon
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Données capteurs mises à jour", extra={
+                'device_id': device['device_id'], 'samples': len(readings),
+                'temperature': reading.temperature, 'humidite': reading.humidite, 'sol': reading.sol})
+
+    elif kind == "ack":
+        command_dispatcher.handle_ack(device['device_id'], raw_payload)
+
+    elif kind == "status":
+        payload, pump_on = parse_status(raw_payload)
+        # Commands for an offline device wait for its "online" status
+        command_dispatcher.set_online(device['device_id'], payload != "offline")
+        if pump_on is not None:
+            auto_irrigation.note_reported_state(device['device_id'], pump_on)
+        if not is_leader():
+            # The leader reports the status to the browsers of every worker
+            return
+        set_device_data(device['device_id'], esp32_mqtt_status=payload)
+        log.info("Statut appareil reçu: %s", payload, extra={
+            'device_id': device['device_id'], 'rate_key': ('status', device['device_id'])})
+        # Emit ESP32 status to the clients watching this device
+        socketio.emit('esp32_status', {'device_id': device['device_id'], 'status': payload},
+                      to=device_room(device['device_id']))
+
+def command_topic(device):
+    """MQTT topic a device listens on for pump commands"""
+    if device['device_id'] == DEFAULT_DEVICE_ID:
+        return MQTT_TOPIC_COMMAND
+    return f"irrigateq/{device['token']}/command"
+
+def send_pump_command(device, command, user_id=None, source=None):
+    """Send START/STOP to a device through the command dispatcher"""
+    return command_dispatcher.send(device['device_id'], command_topic(device), command,
+                                   user_id=user_id if user_id is not None else device['user_id'],
+                                   legacy=device['device_id'] == DEFAULT_DEVICE_ID, source=source)
+
+def on_command_result(cmd):
+    """Tell the user whether the device confirmed a command"""
+    if cmd.status != UNCONFIRMED:
+        # No answer leaves the pump state unknown; a rejected or expired command changed nothing
+        auto_irrigation.note_command_outcome(cmd.device_id, cmd.command,
+                                             None if cmd.status == FAILED else cmd.status == ACKED)
+    if cmd.status == UNCONFIRMED:
+        # Firmware without acks: silence is not a failure
+        log.debug("Commande %s sans accusé de réception", cmd.id, extra={'device_id': cmd.device_id})
+        return
+    if cmd.status == ACKED:
+        message = f"Commande {cmd.command} confirmée par l'appareil ({cmd.as_dict()['latency_ms']} ms)"
+    else:
+        message = f"Commande {cmd.command} non confirmée par l'appareil ({cmd.status})"
+    log.info("Commande %s", cmd.status, extra={'command_id': cmd.id, 'device_id': cmd.device_id,
+                                               'command': cmd.command, 'attempts': cmd.attempts})
+    update = dict(cmd.as_dict(), message=message)
+    if cmd.user_id:
+        socketio.emit('command_status', update, to=user_room(cmd.user_id))
+    else:
+        socketio.emit('command_status', update, to=device_room(cmd.device_id))
+
+def publish_auto_command(rule, command, moisture):
+    """Send an automatic START/STOP decided by the rule engine and log it"""
+    send_pump_command(rule.device, command, user_id=rule.user_id, source='auto')
+    event_type = 'auto_start' if command == "START" else 'auto_stop'
+    log.info("Irrigation automatique: %s", command, extra={'device_id': rule.device_id, 'sol': moisture})
+    if rule.user_id:
+        now = datetime.datetime.now()
+        write_queue.enqueue('add_irrigation_event', user_id=rule.user_id, event_type=event_type, details={
+            'device_id': rule.device_id,
+            'moisture_level': moisture,
+            'threshold': rule.start_below if command == "START" else rule.stop_above
+        }, timestamp=now)
+        message = ("Irrigation démarrée automatiquement" if command == "START"
+                   else "Irrigation arrêtée automatiquement") + f" (sol {moisture}%)"
+        write_queue.enqueue('add_notification', user_id=rule.user_id, text=message, timestamp=now)
+        socketio.emit('irrigation_command', {'command': event_type, 'message': message},
+                      to=user_room(rule.user_id))
+
+# Règles d'irrigation automatique évaluées à chaque mesure, sans lecture Firestore
+auto_irrigation = AutoIrrigationEngine(publish_auto_command)
+
+def load_user_thresholds(user_id, thresholds):
+    """Install a user's thresholds on every device they own"""
+    for device in device_registry.devices_for_user(user_id):
+        auto_irrigation.set_thresholds(device, thresholds)
+
+def load_auto_irrigation_rules():
+    """Build the threshold table: one user read per device owner at startup"""
+    owners = {str(d['user_id']) for d in device_registry.devices() if d['user_id']}
+    for user_id in owners:
+        try:
+            user = get_user_by_id(user_id)
+        except Exception as e:
+            log.warning("Seuils non chargés pour %s: %s", user_id, e)
+            continue
+        if user:
+            load_user_thresholds(user_id, user.get('thresholds'))
+    log.info("Irrigation automatique: %d appareils surveillés", len(auto_irrigation.rules()))
+
+# Workers sharded by device token: one slow device never stalls the MQTT socket
+ingest_pool = ShardedWorkerPool(process_message)
 
 # --- Configuration Client MQTT ---
-mqtt_client = mqtt.Client()
-mqtt_client.on_connect = on_connect
-mqtt_client.on_message = on_message
-mqtt_client.on_disconnect = lambda client, userdata, rc: print("Client MQTT déconnecté avec code:", rc)
+# Created by start_mqtt(): importing the app never opens a broker connection
+mqtt_client = None
+
+def publish_command(topic, payload, qos=0):
+    """Publish a pump command; False if the MQTT client is not running or connected"""
+    if mqtt_client is None:
+        return False
+    return mqtt_client.publish(topic, payload, qos=qos).rc == 0
+
+# Commandes de pompe: QoS 1, accusé de réception de l'appareil, relances et file hors ligne
+command_dispatcher = CommandDispatcher(publish_command, on_result=on_command_result)
 
 # --- Fonction pour faire tourner le client MQTT dans un thread séparé ---
 def mqtt_client_thread():
     while True:
         try:
-            print(f"Tentative de connexion au broker MQTT {MQTT_BROKER_URL}:{MQTT_BROKER_PORT}")
+            log.info("Tentative de connexion au broker MQTT %s:%s", MQTT_BROKER_URL, MQTT_BROKER_PORT)
             mqtt_client.connect(MQTT_BROKER_URL, MQTT_BROKER_PORT, 60)
             mqtt_client.loop_forever()
         except Exception as e:
-            print(f"Erreur de connexion MQTT: {e}. Reconexion dans 5 secondes...")
-            mqtt_data_cache["mqtt_backend_status"] = f"Déconnecté, reconnexion... ({e})"
-            socketio.emit('mqtt_status', {'status': 'reconnecting', 'error': str(e)})
+            MQTT_RECONNECTS.inc()
+            log.warning("Erreur de connexion MQTT: %s. Reconnexion dans 5 secondes...", e)
+            broker_status["mqtt_backend_status"] = f"Déconnecté, reconnexion... ({e})"
+            if is_leader():
+                socketio.emit('mqtt_status', {'status': 'reconnecting', 'error': str(e)})
             time.sleep(5)
 
-mqtt_thread = threading.Thread(target=mqtt_client_thread, daemon=True)
-mqtt_thread.start()
+def start_mqtt():
+    """Create the MQTT client and connect it in a background thread"""
+    global mqtt_client
+    if mqtt_client is not None:
+        return mqtt_client
+    import paho.mqtt.client as mqtt
+    client = mqtt.Client()
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.on_disconnect = lambda client, userdata, rc: log.warning("Client MQTT déconnecté avec code: %s", rc)
+    mqtt_client = client
+    threading.Thread(target=mqtt_client_thread, daemon=True).start()
+    return client
+
+def on_elected():
+    """This worker won the lease: ingest sensor data and run the once-per-cluster jobs"""
+    telemetry.set_read_through(False)
+    if mqtt_client is not None:
+        mqtt_client.subscribe(TOPIC_DATA_WILDCARD)
+    image_retention.start()
+    threading.Thread(target=load_auto_irrigation_rules, daemon=True).start()
+
+def on_lost():
+    """Another worker took the lease over: serve readings from the database"""
+    if mqtt_client is not None:
+        mqtt_client.unsubscribe(TOPIC_DATA_WILDCARD)
+    image_retention.close()
+    telemetry.set_read_through(True)
+
+def refresh_rules_thread():
+    while True:
+        time.sleep(RULES_REFRESH_INTERVAL)
+        if is_leader():
+            load_auto_irrigation_rules()
+
+# Regroupe les mesures et limite le nombre d'envois par room
+sensor_broadcaster = SensorBroadcaster(socketio)
+
+def device_ids_for_user(user_id):
+    """Devices whose data a logged-in user may see"""
+    devices = device_registry.devices_for_user(user_id)
+    # Users without registered devices follow the legacy shared ESP32
+    return [d['device_id'] for d in devices] or [DEFAULT_DEVICE_ID]
+
+def device_for_user(user_id, device_id=None):
+    """Device a user's pump command targets: `device_id` if the user may
+    drive it, else None; without `device_id`, the one their dashboard shows"""
+    device_ids = device_ids_for_user(user_id)
+    if device_id is None:
+        device_id = device_ids[0]
+    elif str(device_id) not in device_ids:
+        return None
+    if str(device_id) == DEFAULT_DEVICE_ID:
+        return device_registry.resolve(DEFAULT_DEVICE_ID)
+    return next(d for d in device_registry.devices_for_user(user_id) if d['device_id'] == str(device_id))
+
+def device_data(device_id):
+    """Latest values of one device: the leader's snapshot, else what it stored"""
+    data = latest_by_device.get(device_id)
+    if data is not None and is_leader():
+        return data
+    # Followers receive no sensor data, and the leader none yet since its start
+    data = dict(data or EMPTY_DEVICE_DATA)
+    latest = telemetry.latest(device_id)
+    if latest:
+        data.update(temperature=latest['temperature'], humidite=latest['humidite'], sol=latest['sol'],
+                    last_update=datetime.datetime.fromtimestamp(latest['ts']).strftime('%Y-%m-%d %H:%M:%S'))
+    return data
+
+def current_data(user_id):
+    """Latest values for 'current_data' and /get_data: the user's first device
+    at the top level (what the dashboard shows), all of theirs under 'devices'"""
+    devices = {device_id: device_data(device_id) for device_id in device_ids_for_user(user_id)}
+    device_id, data = next(iter(devices.items()))
+    return dict(data, device_id=device_id, devices=devices, **broker_status)
+
+def rooms_for_user(user_id):
+    """Socket.IO rooms a logged-in user receives live events from"""
+    return [user_room(user_id)] + [device_room(device_id) for device_id in device_ids_for_user(user_id)]
 
 # --- WebSocket Event Handlers ---
+# Session IDs of accepted Socket.IO clients (rejected ones never count)
+connected_clients = set()
+
 @socketio.on('connect')
 def handle_connect():
-    print('Client connected')
+    if 'user_id' not in session:
+        log.debug("Client Socket.IO refusé: pas de session")
+        return False
+    connected_clients.add(request.sid)
+    log.debug("Client Socket.IO connecté", extra={'user_id': session['user_id']})
+    SOCKETIO_CLIENTS.set(len(connected_clients))
+    for room in rooms_for_user(session['user_id']):
+        join_room(room)
     # Send current data to newly connected client
-    emit('current_data', mqtt_data_cache)
+    SOCKETIO_EMITS.inc('current_data')
+    emit('current_data', current_data(session['user_id']))
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    print('Client disconnected')
+    log.debug("Client Socket.IO déconnecté")
+    connected_clients.discard(request.sid)
+    SOCKETIO_CLIENTS.set(len(connected_clients))
 
 @socketio.on('request_data')
 def handle_request_data():
-    emit('current_data', mqtt_data_cache)
+    if 'user_id' not in session:
+        return
+    SOCKETIO_EMITS.inc('current_data')
+    emit('current_data', current_data(session['user_id']))
+
+# --- HTTP request metrics ---
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    # Storage reads of this request are memoized and counted
+    g.storage_scope = request_scope.begin()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.endpoint or 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint, request.method)
+        HTTP_REQUESTS.inc(endpoint, request.method, response.status_code)
+    scope = g.get('storage_scope')
+    if scope is not None:
+        STORAGE_READS_PER_REQUEST.observe(scope.total_reads, request.endpoint or 'unmatched')
+        if app.config.get('STORAGE_READS_HEADER'):
+            response.headers['X-Storage-Reads'] = str(scope.total_reads)
+    return response
+
+@app.teardown_request
+def end_storage_scope(exc):
+    request_scope.end()
+
+# Registered last so it runs first: the metrics above include compression time
+app.after_request(http_cache.finalize)
+
+# Stats kept by the workers themselves, read at scrape time
+REGISTRY.stats_gauge('ingest_pool', 'MQTT ingest worker pool counters and queue depth',
+                     lambda: dict(ingest_pool.stats, queue_depth=ingest_pool.depth()))
+REGISTRY.stats_gauge('realtime_broadcaster', 'Sensor broadcast counters', lambda: sensor_broadcaster.stats)
+REGISTRY.stats_gauge('write_behind', 'Write-behind queue depth and counters', lambda: write_queue.stats())
+REGISTRY.stats_gauge('user_cache', 'User document cache counters', get_user_cache_stats)
+REGISTRY.stats_gauge('password_hashing', 'Password hash pool counters', password_stats)
+REGISTRY.stats_gauge('auto_irrigation', 'Automatic irrigation rule engine counters', lambda: auto_irrigation.stats)
+REGISTRY.stats_gauge('commands', 'Pump command delivery counters', lambda: command_dispatcher.stats())
+REGISTRY.stats_gauge('image_store', 'Image store counters', lambda: image_store.stats())
+REGISTRY.stats_gauge('image_retention', 'Image retention counters', lambda: image_retention.stats())
+REGISTRY.stats_gauge('http_cache', 'Not-modified answers and response compression counters', http_cache.stats)
+REGISTRY.stats_gauge('cluster', 'Leader election of this worker (leader is 1 on the ingest leader)',
+                     lambda: cluster_lease.stats() if cluster_lease is not None else {'leader': 1})
+REGISTRY.stats_gauge('log_queue', 'Log records waiting for the writer thread, and dropped', logging_stats)
+
+def command_latency_lines():
+    lines = ["# HELP command_ack_latency_seconds Pump command ack round trip, recent window per device",
+             "# TYPE command_ack_latency_seconds gauge"]
+    for device_id, latency in sorted(command_dispatcher.latency_stats().items()):
+        for quantile, key in (('0.5', 'p50_ms'), ('0.9', 'p90_ms'), ('0.99', 'p99_ms')):
+            lines.append(f'command_ack_latency_seconds{{device="{device_id}",quantile="{quantile}"}} '
+                         f'{latency[key] / 1000}')
+    return lines
+
+REGISTRY.collector(command_latency_lines)
+
+# Clients allowed to scrape /metrics when METRICS_TOKEN is not set
+LOOPBACK_ADDRESSES = {'127.0.0.1', '::1'}
+
+@app.route('/metrics')
+def metrics():
+    # Bearer token for scrapers on other hosts; without one, only local scrapers are served
+    token = app.config.get('METRICS_TOKEN')
+    if token:
+        if request.headers.get('Authorization') != f"Bearer {token}":
+            return Response("Unauthorized\n", status=401, mimetype='text/plain')
+    elif request.remote_addr not in LOOPBACK_ADDRESSES:
+        return Response("Forbidden\n", status=403, mimetype='text/plain')
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+def last_update_time(data):
+    """Newest 'last_update' (server local time) of the devices, as an aware datetime, for Last-Modified"""
+    times = []
+    for device in data['devices'].values():
+        try:
+            times.append(datetime.datetime.strptime(device['last_update'], '%Y-%m-%d %H:%M:%S').astimezone())
+        except (TypeError, ValueError):
+            continue
+    return max(times, default=None)
 
 @app.route('/get_data')
 def get_data():
-    return jsonify(mqtt_data_cache)
+    if 'user_id' not in session:
+        return jsonify({"status": "error", "message": "Not authenticated"}), 401
+    data = current_data(session['user_id'])
+    # last_update has second resolution and the statuses change on their own: hash every field
+    return http_cache.conditional(etag_for(*sorted(data.items())), lambda: jsonify(data),
+                                  last_modified=last_update_time(data))
 
 @app.route('/')
 def home():
     if 'user_id' not in session:
-        print("[DEBUG] No user_id in session")
         return redirect(url_for('login'))
-    print("[DEBUG] Session user_id:", session['user_id'])
-    user = get_user_by_id(session['user_id'])
-    print("[DEBUG] Fetched user:", user)
+    # Independent reads: fetched together when the backend is remote
+    user, notifications = fetch_concurrently((get_user_by_id, session['user_id']),
+                                             (get_user_notifications, session['user_id'], 10))
     if not user:
+        log.debug("Utilisateur introuvable, retour à la connexion", extra={'user_id': session['user_id']})
         session.pop('user_id', None)
-        print("[DEBUG] User not found, redirecting to login")
         return redirect(url_for('login'))
-    notifications = get_user_notifications(session['user_id'], limit=10)
     notification_texts = [n['text'] for n in notifications]
     plant_name = user.get('plante', 'default')
     lang = session.get('lang', 'ar')
     t = translations[lang]
-    return render_template('dashboard.html', t=t, user=user, notifications=notification_texts, plant_name=plant_name, lang=lang)
+    device_id = device_ids_for_user(session['user_id'])[0]
+    recent_readings = telemetry.recent(device_id, limit=15)
+    return render_template('dashboard.html', t=t, user=user, notifications=notification_texts, plant_name=plant_name, lang=lang, recent_readings=recent_readings, device_id=device_id)
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         email_or_phone = request.form['email_or_phone']
         password = request.form['password']
-        user = get_user_by_credentials(email_or_phone, password)
-        if user:
-            session['user_id'] = user['user_id']
+        try:
+            session_fields = authenticate(email_or_phone, password)
+        except PasswordHasherBusy:
+            # Login storm: turn the request away rather than queue it
+            flash('Serveur occupé, veuillez réessayer dans un instant')
+            lang = session.get('lang', 'ar')
+            return render_template('login.html', lang=lang, t=translations[lang]), 503
+        if session_fields:
+            session.update(session_fields)
             return redirect(url_for('dashboard'))
         else:
             flash('Identifiants invalides')
@@ -275,23 +713,25 @@ def register():
         plante = request.form['plante']
         email_or_phone = request.form['email_or_phone']
         password = request.form['password']
-        if check_user_exists(email_or_phone):
+        user_data = {
+            'nom': nom,
+            'prenom': prenom,
+            'superficie': superficie,
+            'plante': plante,
+            'email_or_phone': email_or_phone,
+            'password': password
+        }
+        try:
+            # A single create: the storage refuses a login that already exists
+            create_user(user_data)
+            flash('Compte créé, veuillez vous connecter')
+            return redirect(url_for('login'))
+        except UserExistsError:
             flash('Utilisateur déjà existant')
-        else:
-            user_data = {
-                'nom': nom,
-                'prenom': prenom,
-                'superficie': superficie,
-                'plante': plante,
-                'email_or_phone': email_or_phone,
-                'password': password
-            }
-            try:
-                create_user(user_data)
-                flash('Compte créé, veuillez vous connecter')
-                return redirect(url_for('login'))
-            except Exception as e:
-                flash(f'Erreur lors de la création du compte: {str(e)}')
+        except PasswordHasherBusy:
+            flash('Serveur occupé, veuillez réessayer dans un instant')
+        except Exception as e:
+            flash(f'Erreur lors de la création du compte: {str(e)}')
     lang = session.get('lang', 'ar')
     t = translations[lang]
     return render_template('register.html', lang=lang, t=t)
@@ -300,19 +740,18 @@ def register():
 def dashboard():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = get_user_by_id(session['user_id'])
+    user, notifications = fetch_concurrently((get_user_by_id, session['user_id']),
+                                             (get_user_notifications, session['user_id'], 10))
     if not user:
         session.pop('user_id', None)
         return redirect(url_for('login'))
-    notifications = get_user_notifications(session['user_id'], limit=10)
     notification_texts = [n['text'] for n in notifications]
     plant_name = user.get('plante', 'default')
     lang = session.get('lang', 'ar')
     t = translations[lang]
-    print('Current language:', lang)
-    print('DEBUG t:', t)
-    print('DEBUG t[weekdays]:', t.get('weekdays'))
-    return render_template('dashboard.html', t=t, user=user, notifications=notification_texts, plant_name=plant_name, lang=lang)
+    device_id = device_ids_for_user(session['user_id'])[0]
+    recent_readings = telemetry.recent(device_id, limit=15)
+    return render_template('dashboard.html', t=t, user=user, notifications=notification_texts, plant_name=plant_name, lang=lang, recent_readings=recent_readings, device_id=device_id)
 
 @app.route('/profile', methods=['GET', 'POST'])
 def profile():
@@ -342,11 +781,21 @@ def profile():
 def notifications_page():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    notifications = get_user_notifications(session['user_id'], limit=50)
+    (notifications, next_cursor), unread_count = fetch_concurrently(
+        (get_notifications_page, session['user_id'], 50, request.args.get('cursor')),
+        (get_unread_notification_count, session['user_id']))
     notification_texts = [n['text'] for n in notifications]
     lang = session.get('lang', 'ar')
     t = translations[lang]
-    return render_template('notifications.html', notifications=notification_texts, lang=lang, t=t)
+    return render_template('notifications.html', notifications=notification_texts, next_cursor=next_cursor,
+                           unread_count=unread_count, lang=lang, t=t)
+
+@app.route('/notifications/read', methods=['POST'])
+def notifications_mark_read():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    mark_all_notifications_read(session['user_id'])
+    return redirect(url_for('notifications_page'))
 
 @app.route('/guide')
 def guide():
@@ -369,39 +818,179 @@ def voice_command():
 
     command = request.json.get('command')
     response_message = "Commande non reconnue"
+    pump_command = None
+
+    if command in ("start irrigation", "stop irrigation"):
+        # The user's own device (the displayed one unless `device_id` is given)
+        device = device_for_user(session['user_id'], request.json.get('device_id'))
+        if device is None:
+            return jsonify({"status": "error", "message": "Unknown device"}), 404
 
     if command == "start irrigation":
-        mqtt_client.publish(MQTT_TOPIC_COMMAND, "START")
+        pump_command = send_pump_command(device, "START", user_id=session['user_id'], source='manual')
+        auto_irrigation.note_pump_state(device['device_id'], True)
         response_message = "Ok, démarrage de l'irrigation."
         
-        # Log irrigation event to Firebase
-        add_irrigation_event(session['user_id'], 'start', {
+        # Log irrigation event to Firebase (written in the background)
+        write_queue.enqueue('add_irrigation_event', user_id=session['user_id'], event_type='start', details={
             'command': 'manual',
+            'device_id': device['device_id'],
             'moisture_level': 25,
             'temperature': 22.5
-        })
+        }, timestamp=datetime.datetime.now())
         
-        # Emit irrigation command to all clients
-        socketio.emit('irrigation_command', {'command': 'start', 'message': response_message})
+        # Emit irrigation command to the user's clients
+        socketio.emit('irrigation_command', {'command': 'start', 'message': response_message},
+                      to=user_room(session['user_id']))
         
     elif command == "stop irrigation":
-        mqtt_client.publish(MQTT_TOPIC_COMMAND, "STOP")
+        pump_command = send_pump_command(device, "STOP", user_id=session['user_id'], source='manual')
+        auto_irrigation.note_pump_state(device['device_id'], False)
         response_message = "Ok, arrêt de l'irrigation."
         
-        # Log irrigation event to Firebase
-        add_irrigation_event(session['user_id'], 'stop', {'command': 'voice'})
+        # Log irrigation event to Firebase (written in the background)
+        write_queue.enqueue('add_irrigation_event', user_id=session['user_id'], event_type='stop',
+                            details={'command': 'voice', 'device_id': device['device_id']},
+                            timestamp=datetime.datetime.now())
         
-        # Emit irrigation command to all clients
-        socketio.emit('irrigation_command', {'command': 'stop', 'message': response_message})
+        # Emit irrigation command to the user's clients
+        socketio.emit('irrigation_command', {'command': 'stop', 'message': response_message},
+                      to=user_room(session['user_id']))
         
     elif command == "check status":
+        data = current_data(session['user_id'])
         return jsonify({
             "status": "success",
-            "message": f"Voici le dernier état : Température {mqtt_data_cache.get('temperature')}, Humidité du sol {mqtt_data_cache.get('sol')}, Humidité de l'air {mqtt_data_cache.get('humidite')}.",
-            "data": mqtt_data_cache
+            "message": f"Voici le dernier état : Température {data.get('temperature')}, Humidité du sol {data.get('sol')}, Humidité de l'air {data.get('humidite')}.",
+            "data": data
         })
 
-    return jsonify({"status": "success", "message": response_message})
+    return jsonify({"status": "success", "message": response_message,
+                    "command_id": pump_command.id if pump_command else None})
+
+@app.route('/api/commands/<command_id>')
+def command_status(command_id):
+    if 'user_id' not in session:
+        return jsonify({"status": "error", "message": "Not authenticated"}), 401
+    cmd = command_dispatcher.get(command_id)
+    if cmd is None or (cmd.user_id and str(cmd.user_id) != str(session['user_id'])):
+        return jsonify({"status": "error", "message": "Unknown command"}), 404
+    return jsonify({"status": "success", "command": cmd.as_dict()})
+
+@app.route('/api/commands')
+def commands_overview():
+    if 'user_id' not in session:
+        return jsonify({"status": "error", "message": "Not authenticated"}), 401
+    return jsonify({"status": "success", "stats": command_dispatcher.stats(),
+                    "latency": command_dispatcher.latency_stats()})
+
+@app.route('/api/irrigation-events')
+def irrigation_events_api():
+    if 'user_id' not in session:
+        return jsonify({"status": "error", "message": "Not authenticated"}), 401
+
+    try:
+        start = datetime.datetime.fromisoformat(request.args['start']) if request.args.get('start') else None
+        end = datetime.datetime.fromisoformat(request.args['end']) if request.args.get('end') else None
+        limit = min(int(request.args.get('limit', 100)), 500)
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid start, end or limit"}), 400
+    event_types = request.args.getlist('type')
+    if any(t not in IRRIGATION_EVENT_TYPES for t in event_types):
+        return jsonify({"status": "error", "message": f"Allowed types are -> {', '.join(IRRIGATION_EVENT_TYPES)}"}), 400
+
+    events, next_cursor = get_irrigation_events_page(
+        session['user_id'], limit=limit, cursor=request.args.get('cursor'),
+        start=start, end=end, event_types=event_types)
+    for event in events:
+        event['timestamp'] = event['timestamp'].isoformat()
+    return jsonify({"status": "success", "events": events, "next_cursor": next_cursor})
+
+# Default and maximum number of points returned by /api/history
+HISTORY_POINTS = 500
+MAX_HISTORY_POINTS = 5000
+
+def parse_time_arg(value):
+    """Epoch seconds or an ISO 8601 date/time; ValueError otherwise"""
+    try:
+        seconds = float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    # float() also accepts "nan" and "inf"
+    if not math.isfinite(seconds):
+        raise ValueError(f"Not a finite time: {value}")
+    return seconds
+
+@app.route('/api/history')
+def history_api():
+    if 'user_id' not in session:
+        return jsonify({"status": "error", "message": "Not authenticated"}), 401
+
+    device_ids = device_ids_for_user(session['user_id'])
+    device_id = request.args.get('device', device_ids[0])
+    if device_id not in device_ids:
+        return jsonify({"status": "error", "message": "Unknown device"}), 404
+    metric = request.args.get('metric', 'humidite')
+    if metric not in METRICS:
+        return jsonify({"status": "error", "message": f"Allowed metrics are -> {', '.join(METRICS)}"}), 400
+    try:
+        end = parse_time_arg(request.args['to']) if request.args.get('to') else time.time()
+        start = parse_time_arg(request.args['from']) if request.args.get('from') else end - 24 * 3600
+        points = min(int(request.args.get('points', HISTORY_POINTS)), MAX_HISTORY_POINTS)
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid from, to or points"}), 400
+    if start >= end or points < 3:
+        return jsonify({"status": "error", "message": "from must be before to and points at least 3"}), 400
+
+    # Rollups bound the rows read; LTTB then keeps the visually significant points
+    resolution = telemetry.pick_resolution(end - start, max_points=max(points * 4, 2000))
+    rows = telemetry.query_range(device_id, metric, start, end, resolution=resolution)
+    series = lttb([(ts, value) for ts, value, _, _ in rows], points)
+    return jsonify({
+        "status": "success",
+        "device": device_id,
+        "metric": metric,
+        "resolution": resolution,
+        "source_points": len(rows),
+        "points": [[ts, round(value, 2)] for ts, value in series],
+    })
+
+@app.route('/api/thresholds', methods=['POST'])
+def thresholds_api():
+    if 'user_id' not in session:
+        return jsonify({"status": "error", "message": "Not authenticated"}), 401
+
+    data = request.json or {}
+    try:
+        thresholds = {
+            'enabled': bool(data.get('enabled', False)),
+            'min_moisture': float(data['min_moisture']),
+            'max_moisture': float(data['max_moisture'])
+        }
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"status": "error", "message": "min_moisture and max_moisture are required numbers"}), 400
+    if not all(math.isfinite(thresholds[key]) for key in ('min_moisture', 'max_moisture')):
+        return jsonify({"status": "error", "message": "min_moisture and max_moisture are required numbers"}), 400
+    # The engine needs the band for its hysteresis: narrower ones are refused, not widened
+    if thresholds['max_moisture'] - thresholds['min_moisture'] < MIN_BAND:
+        return jsonify({"status": "error",
+                        "message": f"max_moisture must be at least {MIN_BAND:g} above min_moisture"}), 400
+
+    update_user_thresholds(session['user_id'], thresholds)
+    load_user_thresholds(session['user_id'], thresholds)
+    return jsonify({"status": "success", "thresholds": thresholds})
+
+@app.route('/api/write-queue')
+def write_queue_status():
+    if 'user_id' not in session:
+        return jsonify({"status": "error", "message": "Not authenticated"}), 401
+    return jsonify({"status": "success", "write_queue": write_queue.stats()})
+
+@app.route('/api/storage')
+def storage_status():
+    if 'user_id' not in session:
+        return jsonify({"status": "error", "message": "Not authenticated"}), 401
+    return jsonify({"status": "success", "images": image_store.stats(), "retention": image_retention.stats()})
 
 @app.route('/upload-image', methods=['POST'])
 def upload_image():
@@ -411,36 +1000,110 @@ def upload_image():
     if file.filename == '':
         return jsonify({"status": "error", "message": "No image selected for uploading"}), 400
     if file and allowed_file(file.filename):
-        filename = datetime.datetime.now().strftime('%Y%m%d%H%M%S') + '_' + file.filename
-        file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+        # Browser uploads belong to the session user; device uploads to the device owner
+        user_id = session.get('user_id')
+        device_id = None
+        if user_id is None:
+            token = request.form.get('device_token') or request.headers.get('X-Device-Token') or DEFAULT_DEVICE_ID
+            device = device_registry.resolve(token)
+            if device is None:
+                return jsonify({"status": "error", "message": "Unknown device"}), 403
+            user_id, device_id = device['user_id'], device['device_id']
+
+        # The record key must be unique: two uploads of "image.jpg" in the same second are two records
+        filename = f"{datetime.datetime.now():%Y%m%d%H%M%S}_{uuid.uuid4().hex[:8]}_{file.filename}"
+        # Hash while streaming to disk; an identical frame reuses the stored blob.
+        # Reusing and recording it is one write transaction, so retention (here
+        # or in another worker) cannot delete the blob before it is recorded.
+        staged = image_store.stage(file.stream, file.filename.rsplit('.', 1)[1])
+        with image_store.lock, image_index.write_transaction() as conn:
+            blob, size, created = image_store.commit(staged)
+            image_index.add(filename, user_id=user_id, device_id=device_id, blob=blob, size=size, conn=conn)
+        if created:
+            image_store.make_thumbnail_async(blob)
         
-        # Add notification to Firebase if user is logged in
-        if 'user_id' in session:
-            add_notification(session['user_id'], f"Nouvelle image téléchargée: {filename}")
+        # Add notification to Firebase if the image has an owner
+        if user_id is not None:
+            write_queue.enqueue('add_notification', user_id=user_id,
+                                text=f"Nouvelle image téléchargée: {filename}", timestamp=datetime.datetime.now())
         
-        # Emit new image notification to all clients
-        socketio.emit('new_image', {'filename': filename})
+        # Emit new image notification to the owner's clients (unowned uploads go to everyone)
+        payload = {'filename': filename, 'device_id': device_id}
+        if user_id is not None:
+            socketio.emit('new_image', payload, to=user_room(user_id))
+        else:
+            socketio.emit('new_image', payload)
         return jsonify({"status": "success", "message": "Image successfully uploaded"}), 201
     else:
         return jsonify({"status": "error", "message": "Allowed image types are -> png, jpg, jpeg, gif"}), 400
 
+def image_url(image):
+    if image['blob'] is None:
+        # Uploaded before content addressing
+        return url_for('static', filename='uploads/' + image['filename'])
+    return url_for('serve_image', name=image['blob'])
+
+def thumbnail_url(image):
+    if image['blob'] is None:
+        return image_url(image)
+    return url_for('serve_thumbnail', name=image['blob'])
+
+def immutable_file(path, etag, mimetype=None):
+    """Send a content-addressed file with a strong ETag and a one-year immutable lifetime"""
+    response = send_file(path, mimetype=mimetype, etag=etag, conditional=True, max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/images/<name>')
+def serve_image(name):
+    parts = split_blob_name(name)
+    if parts is None or not allowed_file(name) or not os.path.exists(image_store.path(name)):
+        abort(404)
+    return immutable_file(os.path.abspath(image_store.path(name)), etag=parts[0])
+
+@app.route('/images/thumbs/<name>')
+def serve_thumbnail(name):
+    parts = split_blob_name(name)
+    if parts is None or not allowed_file(name):
+        abort(404)
+    path = image_store.thumbnail_path(parts[0])
+    if not os.path.exists(path):
+        # Not generated yet (or Pillow unavailable): point at the full image, uncached
+        response = redirect(url_for('serve_image', name=name))
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    return immutable_file(os.path.abspath(path), etag=parts[0] + '-thumb', mimetype='image/webp')
+
 @app.route('/get_latest_image')
 def get_latest_image():
     if 'user_id' not in session:
         return jsonify({"status": "error", "message": "Not authenticated"}), 401
 
-    latest_image_url = None
-    if os.path.exists(app.config['UPLOAD_FOLDER']):
-        image_files = [f for f in os.listdir(app.config['UPLOAD_FOLDER']) if allowed_file(f)]
-        if image_files:
-            latest_file = sorted(
-                image_files,
-                key=lambda f: os.path.getmtime(os.path.join(app.config['UPLOAD_FOLDER'], f)),
-                reverse=True
-            )[0]
-            latest_image_url = url_for('static', filename='uploads/' + latest_file)
+    user_id = session['user_id']
+    device_id = request.args.get('device_id')
+    if device_id is not None and device_id not in {d['device_id'] for d in device_registry.devices_for_user(user_id)}:
+        return jsonify({"status": "error", "message": "Unknown device"}), 404
+    limit = min(max(request.args.get('limit', 1, type=int), 1), image_index.recent_images)
 
-    return jsonify({"status": "success", "latest_image_url": latest_image_url})
+    images = image_index.recent(user_id=user_id, device_id=device_id, limit=limit)
+    if not images and device_id is None:
+        # Uploads from devices without a registered owner are shown to everyone
+        images = image_index.recent(unowned=True, limit=limit)
+
+    def build():
+        return jsonify({
+            "status": "success",
+            "latest_image_url": thumbnail_url(images[0]) if images else None,
+            "latest_image_full_url": image_url(images[0]) if images else None,
+            "images": [{'url': image_url(image), 'thumbnail_url': thumbnail_url(image),
+                        'device_id': image['device_id'], 'uploaded_at': image['uploaded_at']}
+                       for image in images],
+        })
+
+    etag = etag_for(*[(image['blob'], image['filename'], image['device_id'], image['uploaded_at'])
+                      for image in images])
+    return http_cache.conditional(etag, build)
 
 @app.route('/logout')
 def logout():
@@ -455,17 +1118,107 @@ def set_language(lang):
 
 @app.route('/manifest.json')
 def manifest():
-    return send_from_directory(os.path.join(app.static_folder), 'manifest.json')
+    return http_cache.send_static(app.static_folder, 'manifest.json', 'manifest')
 
 @app.route('/static/icons/icon-192x192.png')
 def icon_192():
-    return send_from_directory(os.path.join(app.static_folder, 'icons'), 'icon-192x192.png')
+    return http_cache.send_static(os.path.join(app.static_folder, 'icons'), 'icon-192x192.png', 'icon')
 
 @app.route('/static/icons/icon-512x512.png')
 def icon_512():
-    return send_from_directory(os.path.join(app.static_folder, 'icons'), 'icon-512x512.png')
+    return http_cache.send_static(os.path.join(app.static_folder, 'icons'), 'icon-512x512.png', 'icon')
+
+def serve_static(filename):
+    """Flask's static view, with content ETags and the service worker always revalidated"""
+    if filename == 'service-worker.js':
+        return http_cache.send_static(app.static_folder, filename, 'service_worker')
+    if filename == 'manifest.json':
+        return http_cache.send_static(app.static_folder, filename, 'manifest')
+    return http_cache.send_static(app.static_folder, filename)
+
+app.view_functions['static'] = serve_static
+
+# --- Application factory ---
+_services_lock = threading.Lock()
+_services_started = False
+
+def start_services():
+    """Start background workers, load device state and, if enabled, connect to MQTT.
+    Safe to call more than once."""
+    global _services_started
+    with _services_lock:
+        if _services_started:
+            return
+        _services_started = True
+        telemetry.start()
+        device_registry.load()
+        image_index.load()
+        command_dispatcher.start()
+        write_queue.start()
+        ingest_pool.start()
+        sensor_broadcaster.start()
+        if cluster_lease is None:
+            image_retention.start()
+            # Thresholds need storage reads (and Firebase init): keep them off the boot path
+            threading.Thread(target=load_auto_irrigation_rules, daemon=True).start()
+        else:
+            # Followers until elected: retention and rules start in on_elected()
+            telemetry.set_read_through(True)
+            threading.Thread(target=refresh_rules_thread, daemon=True).start()
+        if app.config['MQTT_ENABLED']:
+            start_mqtt()
+        if cluster_lease is not None:
+            cluster_lease.start()
+
+def create_app(config=None):
+    """Configure the application and return it.
+
+    Importing this module only defines routes; storage, Firebase and MQTT are
+    touched here or on first use. Set START_SERVICES=False (e.g. in tests or
+    benchmarks) to get a working app without background threads, and
+    MQTT_ENABLED=False for web workers that must not connect to the broker.
+
+    Several processes on one host can serve the app together when
+    SOCKETIO_MESSAGE_QUEUE is set (sqlite:///cluster.db or redis://..., see
+    cluster.py): they then share events through the queue and elect one of
+    them to ingest MQTT data.
+    """
+    global cluster_lease
+    app.config.setdefault('START_SERVICES', True)
+    app.config.setdefault('MQTT_ENABLED', os.environ.get('MQTT_ENABLED', '1') != '0')
+    app.config.setdefault('SOCKETIO_MESSAGE_QUEUE', os.environ.get('SOCKETIO_MESSAGE_QUEUE'))
+    app.config.setdefault('CLUSTER_DB', os.environ.get('CLUSTER_DB', CLUSTER_DB))
+    app.config.setdefault('WORKER_ID', os.environ.get('WORKER_ID', str(os.getpid())))
+    app.config.setdefault('METRICS_TOKEN', os.environ.get('METRICS_TOKEN'))
+    if config:
+        app.config.update(config)
+    # Journaux écrits par un thread dédié; LOG_LEVEL=DEBUG pour le détail par message
+    configure_logging(app.config.get('LOG_LEVEL'), app.config.get('LOG_FORMAT'))
+    if not app.config['METRICS_TOKEN']:
+        log.warning("METRICS_TOKEN non défini: /metrics n'est servi qu'aux clients locaux")
+    # Même clé pour tous les workers et après un redémarrage: les sessions restent valides
+    if not app.secret_key:
+        app.secret_key = load_secret_key(app.config.get('SECRET_KEY_FILE', SECRET_KEY_FILE))
+    if socketio.server is None:
+        socketio_config = {}
+        if app.config['SOCKETIO_MESSAGE_QUEUE']:
+            socketio_config = socketio_options(app.config['SOCKETIO_MESSAGE_QUEUE'])
+            # Set WORKER_ID to a stable value so a restarted worker replays its own spool
+            write_queue.set_spool_path(f"write_behind.{app.config['WORKER_ID']}.spool")
+            image_index.refresh_interval = IMAGE_INDEX_REFRESH_INTERVAL
+            cluster_lease = LeaderLease(app.config['CLUSTER_DB'], on_elected=on_elected, on_lost=on_lost)
+        socketio.init_app(app, **socketio_config)
+    if app.config.get('STORAGE_BACKEND'):
+        configure_storage(app.config['STORAGE_BACKEND'])
+
+    # Create upload folder if it doesn't exist
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    image_index.upload_folder = image_store.root = app.config['UPLOAD_FOLDER']
+
+    if app.config['START_SERVICES']:
+        start_services()
+    return app
 
 if __name__ == '__main__':
-    import os
     port = int(os.environ.get('PORT', 5000))
-    socketio.run(app, debug=True, use_reloader=False, host='0.0.0.0', port=port) 
\ No newline at end of file
+    socketio.run(create_app(), debug=True, use_reloader=False, host='0.0.0.0', port=port) 
\ No newline at end of file
@@ -0,0 +1,174 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+# Root of the application's loggers; modules log under "irrigateq.<module>"
+ROOT_LOGGER = 'irrigateq'
+
+# Records waiting for the writer thread; beyond this they are dropped, not blocked on
+QUEUE_SIZE = 10000
+
+# Default rate limit per message template: at most RATE_LIMIT_BURST records every RATE_LIMIT_WINDOW seconds
+RATE_LIMIT_WINDOW = 10.0
+RATE_LIMIT_BURST = 20
+
+# Attributes every LogRecord has; anything else came in through `extra=`
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'rate_key'}
+
+
+def get_logger(name):
+    """Logger for an application module"""
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the fields passed through `extra=`"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """Human readable lines, with the `extra=` fields appended as key=value"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)-7s %(name)s: %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = [f"{key}={value}" for key, value in vars(record).items()
+                  if key not in _RECORD_ATTRS and not key.startswith('_')]
+        return f"{line} {' '.join(fields)}" if fields else line
+
+
+class RateLimitFilter(logging.Filter):
+    """Let at most `burst` records per message template through every `window`
+    seconds. The next record let through reports how many were suppressed.
+    A record can name its own key with `extra={'rate_key': ...}`; records at
+    WARNING and above are limited too, so a broken device cannot flood the log.
+    """
+
+    def __init__(self, window=RATE_LIMIT_WINDOW, burst=RATE_LIMIT_BURST, clock=time.monotonic):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self.clock = clock
+        # key -> [window start, records let through, records suppressed]
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, 'rate_key', None) or (record.name, record.msg)
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None or now - bucket[0] >= self.window:
+                suppressed = bucket[2] if bucket else 0
+                bucket = self._buckets[key] = [now, 0, 0]
+            else:
+                suppressed = 0
+            if bucket[1] >= self.burst:
+                bucket[2] += 1
+                return False
+            bucket[1] += 1
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records when the queue is full instead of raising.
+
+    Unlike QueueHandler, it does not format records before queueing them:
+    only the message arguments are merged, and `exc_info` is kept, so the
+    listener's formatter renders the traceback (the JSON `exc` field).
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Merged now, so arguments changed after the call are not what gets logged
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener = None
+_handler = None
+
+
+def configure_logging(level=None, fmt=None, stream=None, rate_limit=True):
+    """Send application logs through a bounded queue to a writer thread.
+
+    `level` defaults to $LOG_LEVEL (INFO) and `fmt` to $LOG_FORMAT ("text"
+    or "json"). Callers only pay for building the record, merging its
+    message arguments and a queue put; formatting, tracebacks included, and
+    the write to stdout happen on the listener thread.
+    Calling it again replaces the previous configuration.
+    """
+    global _listener, _handler
+    level = level or os.environ.get('LOG_LEVEL', 'INFO')
+    fmt = fmt or os.environ.get('LOG_FORMAT', 'text')
+
+    shutdown_logging()
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+
+    _handler = DroppingQueueHandler(queue.Queue(QUEUE_SIZE))
+    if rate_limit:
+        _handler.addFilter(RateLimitFilter())
+    _listener = logging.handlers.QueueListener(_handler.queue, output, respect_handler_level=True)
+    _listener.start()
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.handlers = [_handler]
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    root.propagate = False
+    return root
+
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener, _handler
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _handler is not None:
+        logging.getLogger(ROOT_LOGGER).removeHandler(_handler)
+        _handler = None
+
+
+def logging_stats():
+    if _handler is None:
+        return {'queued': 0, 'dropped': 0}
+    return {'queued': _handler.queue.qsize(), 'dropped': _handler.dropped}
+
+
+atexit.register(shutdown_logging)
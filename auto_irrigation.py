@@ -0,0 +1,144 @@
+import threading
+import time
+
+# Minimum pump run time and rest time, in seconds
+MIN_ON_TIME = 60
+MIN_OFF_TIME = 300
+
+# Smallest allowed gap between min_moisture and max_moisture (percentage points);
+# /api/thresholds refuses narrower bands, older saved ones are widened to it
+MIN_BAND = 5.0
+
+START = "START"
+STOP = "STOP"
+
+
+class DeviceRule:
+    """Precomputed thresholds and pump state of one device; `pump_on` is
+    None while the state is unknown"""
+
+    __slots__ = ('device', 'device_id', 'user_id', 'start_below', 'stop_above', 'pump_on', 'changed_at')
+
+    def __init__(self, device, start_below, stop_above, pump_on=None, changed_at=None):
+        self.device = device
+        self.device_id = device['device_id']
+        self.user_id = device['user_id']
+        self.start_below = start_below
+        self.stop_above = stop_above
+        self.pump_on = pump_on
+        self.changed_at = changed_at
+
+
+class AutoIrrigationEngine:
+    """Evaluates soil moisture readings against per-device thresholds.
+
+    Rules are kept in a dict keyed by device ID, so `evaluate` is a lookup and
+    two comparisons: no Firestore access on the ingest path. The [min, max]
+    moisture band acts as a Schmitt trigger: the pump starts below
+    `min_moisture` and only stops once `max_moisture` is reached, and
+    `min_on_time`/`min_off_time` keep it from short-cycling.
+
+    The pump state is assumed from the commands sent. It is unknown after a
+    start, until the device reports it in its status, and after a command
+    that got no answer. While it is unknown, either edge of the band sends
+    its command, so a pump left running is still stopped.
+
+    `publish(rule, command, moisture)` is called for every automatic START/STOP.
+    Readings for one device must come from a single thread (the ingest pool
+    shards by device), which keeps per-device state lock-free.
+    """
+
+    def __init__(self, publish, min_on_time=MIN_ON_TIME, min_off_time=MIN_OFF_TIME, clock=time.monotonic):
+        self.publish = publish
+        self.min_on_time = min_on_time
+        self.min_off_time = min_off_time
+        self.clock = clock
+        self._rules = {}
+        self._lock = threading.Lock()
+        self.stats = {'evaluated': 0, 'started': 0, 'stopped': 0}
+
+    def set_thresholds(self, device, thresholds):
+        """Install or replace the rule of a device (a DeviceRegistry entry) from
+        its owner's `thresholds` dict"""
+        device_id = device['device_id']
+        if not thresholds or not thresholds.get('enabled'):
+            self.remove(device_id)
+            return None
+        start_below = float(thresholds.get('min_moisture', 30))
+        stop_above = max(float(thresholds.get('max_moisture', 60)), start_below + MIN_BAND)
+        with self._lock:
+            previous = self._rules.get(device_id)
+            rule = DeviceRule(device, start_below, stop_above)
+            if previous is not None:
+                # Keep the pump state across threshold changes
+                rule.pump_on, rule.changed_at = previous.pump_on, previous.changed_at
+            self._rules[device_id] = rule
+        return rule
+
+    def remove(self, device_id):
+        """Disable automatic irrigation for a device"""
+        with self._lock:
+            self._rules.pop(device_id, None)
+
+    def note_pump_state(self, device_id, pump_on):
+        """Record a manual START/STOP so the rule does not immediately undo it"""
+        rule = self._rules.get(device_id)
+        if rule is not None and rule.pump_on != pump_on:
+            rule.pump_on = pump_on
+            rule.changed_at = self.clock()
+
+    def note_reported_state(self, device_id, pump_on):
+        """Take the pump state a device reported in its status"""
+        rule = self._rules.get(device_id)
+        if rule is not None:
+            rule.pump_on = pump_on
+
+    def note_command_outcome(self, device_id, command, applied):
+        """Correct the assumed state once a START/STOP is settled. `applied`
+        is True if the device acked it, False if it rejected it or never got
+        it, and None if it did not answer. Another decision is only made
+        after `min_on_time`, so a device that does not answer is not flooded."""
+        rule = self._rules.get(device_id)
+        # Unless a later command already replaced the state this one set
+        if rule is None or applied or rule.pump_on != (command == START):
+            return
+        rule.pump_on = None if applied is None else command != START
+        rule.changed_at = self.clock()
+
+    def evaluate(self, device_id, moisture):
+        """Check one soil moisture reading; returns the command sent, if any"""
+        rule = self._rules.get(device_id)
+        if rule is None or moisture is None:
+            return None
+        self.stats['evaluated'] += 1
+
+        now = self.clock()
+        elapsed = now - rule.changed_at if rule.changed_at is not None else float('inf')
+        if rule.pump_on is None:
+            if elapsed < self.min_on_time:
+                return None
+            if moisture < rule.start_below:
+                command = START
+            elif moisture >= rule.stop_above:
+                command = STOP
+            else:
+                return None
+        elif not rule.pump_on:
+            if moisture >= rule.start_below or elapsed < self.min_off_time:
+                return None
+            command = START
+        else:
+            if moisture < rule.stop_above or elapsed < self.min_on_time:
+                return None
+            command = STOP
+
+        rule.pump_on = command == START
+        rule.changed_at = now
+        self.stats['started' if rule.pump_on else 'stopped'] += 1
+        self.publish(rule, command, moisture)
+        return command
+
+    def rules(self):
+        """Snapshot of the installed rules"""
+        with self._lock:
+            return list(self._rules.values())
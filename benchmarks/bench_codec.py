@@ -0,0 +1,69 @@
+"""Compare decode throughput of JSON and binary sensor payloads.
+
+Decodes the same readings as the JSON the ESP32 firmware sends today, as a
+JSON batch and as binary frames (one sample and a batch per message).
+Results are appended to benchmarks/results/codec.jsonl.
+
+    python benchmarks/bench_codec.py --messages 20000
+"""
+import argparse
+import json
+import time
+
+from common import result_header, write_result
+from sensor_codec import decode_payload, encode_frame
+from sensor_reading import SensorReading
+
+
+def sample_readings(count, start=1_760_000_000):
+    return [SensorReading(start + i * 10, 22.5 + (i % 10) * 0.1, 45.0 + (i % 20) * 0.2,
+                          30 + (i % 35), None) for i in range(count)]
+
+
+def legacy_json(reading):
+    # Same shape as esp32_test_harness.py: numbers, with soil as a "%" string
+    return json.dumps({'temperature': reading.temperature, 'humidite': reading.humidite,
+                       'sol': f"{reading.sol}%"}).encode()
+
+
+def measure(payloads, samples_per_message, repeat):
+    """Best of `repeat` passes over the payloads"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for payload in payloads:
+            decode_payload(payload)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return {
+        'bytes_per_sample': round(sum(map(len, payloads)) / (len(payloads) * samples_per_message), 1),
+        'messages_per_second': round(len(payloads) / best),
+        'samples_per_second': round(len(payloads) * samples_per_message / best),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=10, help="samples per batched message")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="JSON lines file (default: benchmarks/results/codec.jsonl)")
+    args = parser.parse_args()
+
+    readings = sample_readings(args.messages)
+    batches = [readings[i:i + args.batch] for i in range(0, len(readings), args.batch)]
+    formats = {
+        'json': ([legacy_json(r) for r in readings], 1),
+        'json_batch': ([json.dumps([r.as_dict() for r in batch]).encode() for batch in batches], args.batch),
+        'binary': ([encode_frame([r]) for r in readings], 1),
+        'binary_batch': ([encode_frame(batch) for batch in batches], args.batch),
+    }
+    results = {name: measure(payloads, per_message, args.repeat)
+               for name, (payloads, per_message) in formats.items()}
+
+    write_result(result_header('codec', messages=args.messages, batch=args.batch, formats=results),
+                 args.output)
+
+
+if __name__ == "__main__":
+    main()
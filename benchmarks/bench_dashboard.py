@@ -0,0 +1,72 @@
+"""Measure full dashboard render latency.
+
+Requests /dashboard through the Flask test client for a logged-in user
+with a given number of notifications and recent sensor readings: every
+storage read, the template render and the response. "cold" drops the
+cached user document before each request, as after a profile update;
+"warm" is the steady state. Results are appended to
+benchmarks/results/dashboard.jsonl.
+
+    python benchmarks/bench_dashboard.py --requests 300
+"""
+import argparse
+import datetime
+import time
+
+from bench_codec import legacy_json, sample_readings
+from bench_history import fill
+from common import latency_summary, result_header, scratch_dir, write_result
+
+
+def render_times(client, requests, before=None):
+    samples = []
+    for _ in range(requests):
+        if before is not None:
+            before()
+        started = time.perf_counter()
+        response = client.get('/dashboard')
+        samples.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            raise RuntimeError(f"/dashboard returned {response.status_code}")
+    return latency_summary(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--notifications", type=int, default=1000, help="history size of the user")
+    parser.add_argument("--backends", default="memory,sqlite")
+    parser.add_argument("--output", help="JSON lines file (default: benchmarks/results/dashboard.jsonl)")
+    args = parser.parse_args()
+
+    results = {}
+    for backend in args.backends.split(','):
+        with scratch_dir():
+            import app as app_module
+            import firebase_config
+            app = app_module.create_app({'STORAGE_BACKEND': backend, 'START_SERVICES': False,
+                                         'LOG_LEVEL': 'CRITICAL'})
+            user_id = app_module.create_user({
+                'nom': 'Bench', 'prenom': 'Dashboard', 'superficie': '1', 'plante': 'Tomate',
+                'email_or_phone': f"dashboard-{backend}@example.com", 'password': 'bench'})
+            fill(app_module.apply_writes, user_id, 0, args.notifications, datetime.datetime.now())
+            for reading in sample_readings(50):
+                app_module.process_message('esp32', 'data', legacy_json(reading))
+
+            client = app.test_client()
+            with client.session_transaction() as session:
+                session['user_id'] = user_id
+            client.get('/dashboard')
+            results[backend] = {
+                'warm': render_times(client, args.requests),
+                'cold': render_times(client, args.requests,
+                                     before=lambda: firebase_config.invalidate_user_cache(user_id)),
+            }
+            app_module.configure_storage('memory')
+
+    write_result(result_header('dashboard', requests=args.requests, notifications=args.notifications,
+                               render=results), args.output)
+
+
+if __name__ == "__main__":
+    main()
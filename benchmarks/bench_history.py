@@ -0,0 +1,82 @@
+"""Measure notification and irrigation event reads as a user's history grows.
+
+For each offline storage backend (memory, sqlite) one user is filled up to
+each history size in turn (10 to 100k entries) through apply_writes, the
+path the write-behind queue uses, and the reads the pages do are timed:
+the latest notifications, a second page through the cursor, the latest
+irrigation events, and events filtered by type and time range. Results
+are appended to benchmarks/results/history.jsonl.
+
+    python benchmarks/bench_history.py --sizes 10,1000,100000
+"""
+import argparse
+import datetime
+import uuid
+
+from common import best_of, result_header, scratch_dir, write_result
+
+EVENT_TYPES = ('start', 'stop', 'auto_start', 'auto_stop')
+
+
+def fill(apply_writes, user_id, start, stop, now):
+    """Add entries start..stop-1 of both logs, one per minute going back from `now`"""
+    writes = []
+    for i in range(start, stop):
+        timestamp = (now - datetime.timedelta(minutes=i)).isoformat()
+        writes.append({'id': uuid.uuid4().hex, 'op': 'add_notification',
+                       'args': {'user_id': user_id, 'text': f"Notification {i}", 'timestamp': timestamp}})
+        writes.append({'id': uuid.uuid4().hex, 'op': 'add_irrigation_event',
+                       'args': {'user_id': user_id, 'event_type': EVENT_TYPES[i % len(EVENT_TYPES)],
+                                'details': {'moisture_level': 40 + i % 20}, 'timestamp': timestamp}})
+        if len(writes) >= 2000:
+            apply_writes(writes)
+            writes = []
+    if writes:
+        apply_writes(writes)
+
+
+def measure(fc, user_id, now, repeat):
+    _, cursor = fc.get_notifications_page(user_id, limit=10)
+    week_ago = now - datetime.timedelta(days=7)
+    reads = {
+        'notifications_latest_10': lambda: fc.get_user_notifications(user_id, limit=10),
+        'notifications_page_2': lambda: fc.get_notifications_page(user_id, limit=10, cursor=cursor),
+        'events_latest_100': lambda: fc.get_irrigation_events(user_id, limit=100),
+        'events_auto_last_week': lambda: fc.get_irrigation_events(
+            user_id, limit=100, start=week_ago, end=now, event_types=['auto_start', 'auto_stop']),
+    }
+    return {name: round(best_of(read, repeat=repeat, number=5) * 1000, 3) for name, read in reads.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10,100,1000,10000,100000",
+                        help="comma-separated history sizes (entries per log)")
+    parser.add_argument("--backends", default="memory,sqlite")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="JSON lines file (default: benchmarks/results/history.jsonl)")
+    args = parser.parse_args()
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+
+    import firebase_config as fc
+    now = datetime.datetime.now()
+    results = {}
+    for backend in args.backends.split(','):
+        with scratch_dir():
+            fc.configure_storage(backend)
+            user_id = fc.create_user({'nom': 'Bench', 'prenom': 'History', 'superficie': '1', 'plante': 'Tomate',
+                                      'email_or_phone': f"history-{backend}@example.com", 'password': 'bench'})
+            results[backend] = {}
+            filled = 0
+            for size in sizes:
+                fill(fc.apply_writes, user_id, filled, size, now)
+                filled = size
+                # Milliseconds per call, best of `repeat`
+                results[backend][str(size)] = measure(fc, user_id, now, args.repeat)
+            fc.configure_storage('memory')
+
+    write_result(result_header('history', sizes=sizes, read_ms=results), args.output)
+
+
+if __name__ == "__main__":
+    main()
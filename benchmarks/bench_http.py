@@ -0,0 +1,79 @@
+"""Measure bytes on the wire and revalidation cost of cached routes.
+
+Requests each route through the Flask test client for a logged-in user:
+once without Accept-Encoding ("identity_bytes"), once accepting gzip and
+brotli ("compressed_bytes"), then repeatedly as a full fetch and as a
+revalidation sending the ETag it got back, which should be a 304 with no
+body. Results are appended to benchmarks/results/http.jsonl.
+
+    python benchmarks/bench_http.py --requests 300
+"""
+import argparse
+import time
+
+from common import latency_summary, result_header, scratch_dir, write_result
+
+ROUTES = ['/get_data', '/get_latest_image', '/manifest.json', '/static/css/style.css',
+          '/static/js/dashboard.js', '/static/service-worker.js', '/login']
+
+ACCEPT_ENCODING = 'gzip, deflate, br'
+
+
+def timings(client, path, requests, headers):
+    samples, statuses = [], set()
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = client.get(path, headers=headers)
+        response.get_data()
+        samples.append(time.perf_counter() - started)
+        statuses.add(response.status_code)
+        response.close()
+    summary = latency_summary(samples)
+    summary['statuses'] = sorted(statuses)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--output", help="JSON lines file (default: benchmarks/results/http.jsonl)")
+    args = parser.parse_args()
+
+    with scratch_dir():
+        import app as app_module
+        import http_cache
+        app = app_module.create_app({'STORAGE_BACKEND': 'memory', 'START_SERVICES': False, 'LOG_LEVEL': 'CRITICAL'})
+        user_id = app_module.create_user({'nom': 'Bench', 'prenom': 'HTTP', 'superficie': '1', 'plante': 'Tomate',
+                                          'email_or_phone': 'http@example.com', 'password': 'bench'})
+        app_module.set_device_data(app_module.DEFAULT_DEVICE_ID, temperature=22.5, humidite=48, sol=512,
+                                   sol_state='Humide', last_update='2026-01-01 12:00:00')
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = user_id
+
+        results = {}
+        for path in ROUTES:
+            identity = client.get(path)
+            compressed = client.get(path, headers={'Accept-Encoding': ACCEPT_ENCODING})
+            if compressed.status_code != 200:
+                raise RuntimeError(f"{path} returned {compressed.status_code}")
+            etag = compressed.headers.get('ETag')
+            results[path] = {
+                'identity_bytes': len(identity.get_data()),
+                'compressed_bytes': len(compressed.get_data()),
+                'encoding': compressed.headers.get('Content-Encoding', 'identity'),
+                'cache_control': compressed.headers.get('Cache-Control'),
+                'full': timings(client, path, args.requests, {'Accept-Encoding': ACCEPT_ENCODING}),
+            }
+            if etag:
+                results[path]['revalidate'] = timings(
+                    client, path, args.requests, {'Accept-Encoding': ACCEPT_ENCODING, 'If-None-Match': etag})
+            identity.close()
+            compressed.close()
+
+    write_result(result_header('http', requests=args.requests, brotli=http_cache.brotli is not None,
+                               routes=results), args.output)
+
+
+if __name__ == "__main__":
+    main()
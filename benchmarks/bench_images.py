@@ -0,0 +1,87 @@
+"""Measure /get_latest_image as the upload folder grows.
+
+Fills a scratch upload folder through the same save + index path as
+/upload-image, then times, at each size: loading the image index from the
+`images` table (once per process), the first-start backfill of a folder of
+loose files with an empty table, and warm /get_latest_image requests for
+the newest image and for a page of 20. Results are appended to
+benchmarks/results/images.jsonl.
+
+    python benchmarks/bench_images.py --sizes 100,1000,10000
+"""
+import argparse
+import io
+import os
+import time
+
+from common import best_of, result_header, scratch_dir, write_result
+
+# Smallest valid PNG; a counter appended to it makes every upload a new blob
+PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000100e221bc330000000049454e44ae426082")
+
+
+def upload(app_module, user_id, n):
+    blob, size, _ = app_module.image_store.save_stream(io.BytesIO(PNG + n.to_bytes(8, 'big')), 'png')
+    app_module.image_index.add(f"bench_{n:08d}.png", user_id=user_id, blob=blob, size=size,
+                               uploaded_at=time.time() - 1e6 + n)
+
+
+def time_backfill(count):
+    """Load an index over `count` loose files and an empty `images` table"""
+    from image_index import ImageIndex
+    with scratch_dir() as workdir:
+        folder = os.path.join(workdir, 'uploads')
+        os.makedirs(folder)
+        for n in range(count):
+            with open(os.path.join(folder, f"legacy_{n:08d}.png"), 'wb') as f:
+                f.write(PNG)
+        started = time.perf_counter()
+        ImageIndex(os.path.join(workdir, 'images.db'), folder).load()
+        return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="100,1000,10000", help="comma-separated image counts")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="JSON lines file (default: benchmarks/results/images.jsonl)")
+    args = parser.parse_args()
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+
+    results = {}
+    with scratch_dir():
+        import app as app_module
+        from image_index import ImageIndex
+        app = app_module.create_app({'STORAGE_BACKEND': 'memory', 'START_SERVICES': False, 'LOG_LEVEL': 'CRITICAL'})
+        user_id = app_module.create_user({'nom': 'Bench', 'prenom': 'Images', 'superficie': '1', 'plante': 'Tomate',
+                                          'email_or_phone': 'images@example.com', 'password': 'bench'})
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = user_id
+
+        uploaded = 0
+        for size in sizes:
+            for n in range(uploaded, size):
+                upload(app_module, user_id, n)
+            uploaded = size
+            index = app_module.image_index
+            started = time.perf_counter()
+            ImageIndex(index.db_path, index.upload_folder).load()
+            load_seconds = time.perf_counter() - started
+
+            results[str(size)] = {
+                'index_load_ms': round(load_seconds * 1000, 2),
+                'legacy_backfill_ms': round(time_backfill(size) * 1000, 2),
+                'latest_ms': round(best_of(lambda: client.get('/get_latest_image'),
+                                           repeat=args.repeat, number=20) * 1000, 3),
+                'latest_20_ms': round(best_of(lambda: client.get('/get_latest_image?limit=20'),
+                                              repeat=args.repeat, number=20) * 1000, 3),
+            }
+
+    write_result(result_header('images', sizes=sizes, results=results), args.output)
+
+
+if __name__ == "__main__":
+    main()
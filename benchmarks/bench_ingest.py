@@ -0,0 +1,86 @@
+"""Measure MQTT ingest throughput per payload type.
+
+Runs the app in a scratch directory with the memory storage backend and no
+broker. Each payload type is timed twice: `process_message` alone (the work
+an ingest worker does per message: decode, telemetry, rules, broadcast) and
+through `on_message`, which also routes every message to the sharded worker
+pool and waits for the pool to drain. Results are appended to
+benchmarks/results/ingest.jsonl.
+
+    python benchmarks/bench_ingest.py --messages 5000
+"""
+import argparse
+import json
+import time
+from types import SimpleNamespace
+
+from bench_codec import legacy_json, sample_readings
+from common import best_of, result_header, scratch_dir, write_result
+from sensor_codec import encode_frame
+
+# Legacy single-device topics, accepted without a `devices` row
+TOPIC = "irrigateq/esp32/{}"
+
+
+def payload_types(batch):
+    readings = sample_readings(batch)
+    return {
+        'json': ('data', legacy_json(readings[0]), 1),
+        'json_batch': ('data', json.dumps([r.as_dict() for r in readings]).encode(), batch),
+        'binary': ('data', encode_frame(readings[:1]), 1),
+        'binary_batch': ('data', encode_frame(readings), batch),
+        'status': ('status', b'online', 0),
+        'ack_unmatched': ('ack', b'{"id": "0", "command": "START", "status": "ok"}', 0),
+        'invalid_json': ('data', b'{"temperature": ', 0),
+    }
+
+
+def time_worker(app_module, kind, payload, messages, repeat):
+    """Seconds per message spent in process_message"""
+    return best_of(lambda: app_module.process_message('esp32', kind, payload), repeat=repeat, number=messages)
+
+
+def time_pool(app_module, kind, payload, messages):
+    """Seconds per message from on_message until the worker pool has handled it"""
+    message = SimpleNamespace(topic=TOPIC.format(kind), payload=payload)
+    pool = app_module.ingest_pool
+    done_before = pool.stats['processed'] + pool.stats['failed'] + pool.stats['dropped']
+    started = time.perf_counter()
+    for _ in range(messages):
+        app_module.on_message(None, None, message)
+    while pool.stats['processed'] + pool.stats['failed'] + pool.stats['dropped'] - done_before < messages:
+        time.sleep(0.0005)
+    return (time.perf_counter() - started) / messages, pool.stats['dropped']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--batch", type=int, default=10, help="samples per batched message")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="JSON lines file (default: benchmarks/results/ingest.jsonl)")
+    args = parser.parse_args()
+
+    with scratch_dir():
+        import app as app_module
+        app_module.create_app({'STORAGE_BACKEND': 'memory', 'MQTT_ENABLED': False, 'LOG_LEVEL': 'CRITICAL'})
+
+        results = {}
+        for name, (kind, payload, samples) in payload_types(args.batch).items():
+            per_message = time_worker(app_module, kind, payload, args.messages, args.repeat)
+            pool_per_message, dropped = time_pool(app_module, kind, payload, args.messages)
+            results[name] = {
+                'bytes': len(payload),
+                'worker_us_per_message': round(per_message * 1e6, 2),
+                'worker_messages_per_second': round(1 / per_message),
+                'worker_samples_per_second': round(samples / per_message) if samples else None,
+                'pool_messages_per_second': round(1 / pool_per_message),
+                'pool_dropped': dropped,
+            }
+
+    write_result(result_header('ingest', messages=args.messages, batch=args.batch, payloads=results),
+                 args.output)
+
+
+if __name__ == "__main__":
+    main()
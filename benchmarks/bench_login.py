@@ -0,0 +1,94 @@
+"""Measure login latency, alone and under a storm of concurrent logins.
+
+POSTs /login through the Flask test client for users registered with
+hashed passwords, with a valid password, a wrong one and an unknown
+login. "sequential" is one login at a time; "storm" sends them from
+--concurrency threads at once, which is where the bounded hash pool
+matters: the 503s it returns past its wait list are counted. Storage
+reads per login are counted on a cold user cache. Results are appended
+to benchmarks/results/login.jsonl.
+
+    python benchmarks/bench_login.py --logins 200 --concurrency 32
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import latency_summary, result_header, scratch_dir, write_result
+
+PASSWORD = "bench-password"
+
+
+def timed_login(client, email, password):
+    started = time.perf_counter()
+    response = client.post('/login', data={'email_or_phone': email, 'password': password})
+    return time.perf_counter() - started, response.status_code
+
+
+def run_logins(app, attempts, concurrency):
+    def login(attempt):
+        return timed_login(app.test_client(), *attempt)
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(login, attempts))
+    summary = latency_summary([seconds for seconds, status in results if status != 503])
+    summary['busy'] = sum(1 for _, status in results if status == 503)
+    return summary
+
+
+def count_reads(backend, fn):
+    """Storage reads (users and credentials) made by fn()"""
+    calls = []
+    originals = {name: getattr(backend, name) for name in ('get_user', 'get_credentials')}
+    for name, method in originals.items():
+        setattr(backend, name, lambda *args, _method=method, _name=name: calls.append(_name) or _method(*args))
+    try:
+        fn()
+    finally:
+        for name, method in originals.items():
+            setattr(backend, name, method)
+    return len(calls)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--logins", type=int, default=200, help="logins per case")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--output", help="JSON lines file (default: benchmarks/results/login.jsonl)")
+    args = parser.parse_args()
+
+    with scratch_dir():
+        import app as app_module
+        import firebase_config
+        import passwords
+        app = app_module.create_app({'STORAGE_BACKEND': 'memory', 'START_SERVICES': False, 'LOG_LEVEL': 'CRITICAL'})
+        emails = [f"login-{i}@example.com" for i in range(args.users)]
+        for email in emails:
+            app_module.create_user({'nom': 'Bench', 'prenom': 'Login', 'superficie': '1', 'plante': 'Tomate',
+                                    'email_or_phone': email, 'password': PASSWORD})
+
+        cases = {
+            'valid': [(emails[i % len(emails)], PASSWORD) for i in range(args.logins)],
+            'wrong_password': [(emails[i % len(emails)], "wrong") for i in range(args.logins)],
+            'unknown_login': [(f"nobody-{i}@example.com", PASSWORD) for i in range(args.logins)],
+        }
+        results = {'sequential': {}, 'storm': {}}
+        for name, attempts in cases.items():
+            results['sequential'][name] = run_logins(app, attempts, 1)
+            results['storm'][name] = run_logins(app, attempts, args.concurrency)
+
+        backend = firebase_config.get_backend()
+
+        def cold_login():
+            firebase_config.configure_storage(backend)
+            timed_login(app.test_client(), emails[0], PASSWORD)
+
+        results['storage_reads_per_login'] = count_reads(backend, cold_login)
+
+    write_result(result_header('login', users=args.users, logins=args.logins, concurrency=args.concurrency,
+                               hash_workers=passwords.HASH_WORKERS, results=results), args.output)
+
+
+if __name__ == "__main__":
+    main()
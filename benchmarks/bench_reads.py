@@ -0,0 +1,76 @@
+"""Count the storage reads each page makes, against its minimum.
+
+Requests every user-facing route once with an empty user cache ("cold",
+as after a restart or a profile update) and once more with it filled
+("warm"), and reads the per-request count from the X-Storage-Reads
+header. A route making more cold reads than its budget (one per distinct
+document or query it needs) fails the run with status 1. Results are
+appended to benchmarks/results/reads.jsonl.
+
+    python benchmarks/bench_reads.py
+"""
+import argparse
+import datetime
+import sys
+
+from bench_history import fill
+from common import result_header, scratch_dir, write_result
+
+# (method, path, form data) -> most backend reads allowed on a cold cache
+ROUTES = {
+    'home': (('GET', '/', None), 2),
+    'dashboard': (('GET', '/dashboard', None), 2),
+    'profile': (('GET', '/profile', None), 1),
+    'notifications': (('GET', '/notifications', None), 2),
+    'guide': (('GET', '/guide', None), 1),
+    'irrigation_events': (('GET', '/api/irrigation-events', None), 1),
+    'history': (('GET', '/api/history', None), 0),
+    'latest_image': (('GET', '/get_latest_image', None), 0),
+    'login': (('POST', '/login', {'email_or_phone': 'reads@example.com', 'password': 'bench'}), 1),
+}
+
+
+def reads(client, method, path, data):
+    response = client.open(path, method=method, data=data)
+    if response.status_code >= 400:
+        raise RuntimeError(f"{method} {path} returned {response.status_code}")
+    return int(response.headers['X-Storage-Reads'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", default="memory")
+    parser.add_argument("--output", help="JSON lines file (default: benchmarks/results/reads.jsonl)")
+    args = parser.parse_args()
+
+    with scratch_dir():
+        import app as app_module
+        import firebase_config
+        app = app_module.create_app({'STORAGE_BACKEND': args.backend, 'START_SERVICES': False,
+                                     'LOG_LEVEL': 'CRITICAL', 'STORAGE_READS_HEADER': True})
+        user_id = app_module.create_user({'nom': 'Bench', 'prenom': 'Reads', 'superficie': '1', 'plante': 'Tomate',
+                                          'email_or_phone': 'reads@example.com', 'password': 'bench'})
+        fill(app_module.apply_writes, user_id, 0, 100, datetime.datetime.now())
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = user_id
+
+        backend = firebase_config.get_backend()
+        results, over_budget = {}, []
+        for name, ((method, path, data), budget) in ROUTES.items():
+            # Same backend and data, empty user cache
+            firebase_config.configure_storage(backend)
+            cold = reads(client, method, path, data)
+            results[name] = {'cold_reads': cold, 'warm_reads': reads(client, method, path, data), 'budget': budget}
+            if cold > budget:
+                over_budget.append(f"{name}: {cold} reads (budget {budget})")
+            with client.session_transaction() as session:
+                session['user_id'] = user_id
+
+    write_result(result_header('reads', backend=args.backend, routes=results), args.output)
+    if over_budget:
+        sys.exit("Over read budget: " + "; ".join(over_budget))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Measure how long it takes to import the app and to build it with create_app().
+
+Each sample runs in a fresh interpreter so module caches do not hide the cost.
+Results are appended as JSON lines to benchmarks/results/startup.jsonl so the
+numbers can be compared across commits.
+
+    python benchmarks/bench_startup.py --runs 10
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from common import ROOT, result_header, write_result
+
+# Code timed in the child interpreter; prints elapsed seconds
+IMPORT_SNIPPET = """
+import time
+t0 = time.perf_counter()
+import app
+print(time.perf_counter() - t0)
+"""
+
+CREATE_APP_SNIPPET = """
+import time
+t0 = time.perf_counter()
+import app
+app.create_app({'START_SERVICES': False, 'STORAGE_BACKEND': 'memory'})
+print(time.perf_counter() - t0)
+"""
+
+
+def _env():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    env['STORAGE_BACKEND'] = 'memory'
+    env['MQTT_ENABLED'] = '0'
+    return env
+
+
+def time_snippet(snippet, runs, workdir):
+    """Median, min and max seconds of `snippet` over `runs` fresh interpreters"""
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", snippet], cwd=workdir, env=_env(),
+                             capture_output=True, text=True, check=True)
+        samples.append(float(out.stdout.strip().splitlines()[-1]))
+    return {
+        'median_ms': round(statistics.median(samples) * 1000, 2),
+        'min_ms': round(min(samples) * 1000, 2),
+        'max_ms': round(max(samples) * 1000, 2),
+    }
+
+
+def top_imports(workdir, limit=10):
+    """Modules with the highest cumulative import time, from `python -X importtime`"""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"],
+                         cwd=workdir, env=_env(), capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # "import time:  self [us] | cumulative | imported package"
+        _, cumulative_us, name = line.split("|", 2)
+        rows.append({'module': name.strip(), 'cumulative_ms': int(cumulative_us) / 1000})
+    # Only top-level packages, so a heavy import is not listed once per submodule
+    rows = [row for row in rows if '.' not in row['module']]
+    rows.sort(key=lambda row: row['cumulative_ms'], reverse=True)
+    return rows[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="JSON lines file (default: benchmarks/results/startup.jsonl)")
+    args = parser.parse_args()
+
+    # Run from a scratch directory: create_app() writes the upload folder there
+    with tempfile.TemporaryDirectory() as workdir:
+        result = result_header(
+            'startup',
+            runs=args.runs,
+            import_app=time_snippet(IMPORT_SNIPPET, args.runs, workdir),
+            create_app=time_snippet(CREATE_APP_SNIPPET, args.runs, workdir),
+            top_imports=top_imports(workdir),
+        )
+    write_result(result, args.output)
+
+
+if __name__ == "__main__":
+    main()
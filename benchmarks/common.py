@@ -0,0 +1,85 @@
+"""Helpers shared by the benchmark scripts."""
+import contextlib
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+# Let the scripts import the app modules when run as `python benchmarks/<name>.py`
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_header(benchmark, **fields):
+    """Fields every result line starts with"""
+    header = {
+        'benchmark': benchmark,
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'git': git_revision(),
+        'python': sys.version.split()[0],
+    }
+    header.update(fields)
+    return header
+
+
+def write_result(result, output=None):
+    """Append a result as one JSON line (benchmarks/results/<benchmark>.jsonl by default) and print it"""
+    output = output or os.path.join(RESULTS_DIR, f"{result['benchmark']}.jsonl")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "a", encoding="utf-8") as f:
+        f.write(json.dumps(result) + "\n")
+    print(json.dumps(result, indent=2))
+
+
+@contextlib.contextmanager
+def scratch_dir():
+    """Work in a temporary directory so the app's relative paths
+    (database.db, static/uploads, the write-behind spool) never touch the checkout"""
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            yield workdir
+        finally:
+            os.chdir(previous)
+
+
+def best_of(fn, repeat=5, number=1):
+    """Fastest time per call, in seconds, over `repeat` rounds of `number` calls"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = (time.perf_counter() - started) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def latency_summary(samples):
+    """Percentiles of a list of durations in seconds, in milliseconds"""
+    from command_dispatcher import percentile
+    values = sorted(samples)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+        'p90_ms': round(percentile(values, 0.90) * 1000, 3),
+        'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+        'max_ms': round(values[-1] * 1000, 3),
+    }
@@ -0,0 +1,86 @@
+"""Compare the last two results of every benchmark in benchmarks/results/.
+
+Numeric fields are matched by their path in the result. Durations (names
+ending in _ms or _us_per_message), read counts (_reads) and response
+sizes (_bytes) should go down and rates (names ending in _per_second) up;
+a change beyond --threshold in the wrong direction is reported as a
+regression. Exits with status 1 when there is one.
+
+    python benchmarks/compare.py --threshold 0.15
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+
+from common import RESULTS_DIR
+
+LOWER_IS_BETTER = ('_ms', '_us_per_message', '_reads', '_bytes')
+HIGHER_IS_BETTER = ('_per_second',)
+
+
+def flatten(value, prefix=''):
+    """{'a': {'b_ms': 1}} -> {'a.b_ms': 1}, numbers only"""
+    if isinstance(value, dict):
+        flat = {}
+        for key, item in value.items():
+            flat.update(flatten(item, f"{prefix}.{key}" if prefix else str(key)))
+        return flat
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: value}
+    return {}
+
+
+def direction(path):
+    name = path.rsplit('.', 1)[-1]
+    if name.endswith(LOWER_IS_BETTER):
+        return -1
+    if name.endswith(HIGHER_IS_BETTER):
+        return 1
+    return 0
+
+
+def compare(previous, current, threshold):
+    """(regressions, improvements) as lists of (path, before, after, change)"""
+    before, after = flatten(previous), flatten(current)
+    regressions, improvements = [], []
+    for path, new in after.items():
+        old = before.get(path)
+        sign = direction(path)
+        if not sign or not old:
+            continue
+        change = (new - old) / old
+        if change * sign < -threshold:
+            regressions.append((path, old, new, change))
+        elif change * sign > threshold:
+            improvements.append((path, old, new, change))
+    return regressions, improvements
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threshold", type=float, default=0.15, help="relative change to report")
+    args = parser.parse_args()
+
+    any_regression = False
+    for path in sorted(glob.glob(os.path.join(RESULTS_DIR, "*.jsonl"))):
+        with open(path, encoding="utf-8") as f:
+            results = [json.loads(line) for line in f if line.strip()]
+        name = os.path.basename(path)[:-len(".jsonl")]
+        if len(results) < 2:
+            print(f"{name}: first result, nothing to compare")
+            continue
+        previous, current = results[-2], results[-1]
+        regressions, improvements = compare(previous, current, args.threshold)
+        print(f"{name}: {previous.get('git')} -> {current.get('git')}, "
+              f"{len(regressions)} regressions, {len(improvements)} improvements")
+        for label, rows in (("slower", regressions), ("faster", improvements)):
+            for metric, old, new, change in rows:
+                print(f"  {label:6} {metric}: {old} -> {new} ({change:+.0%})")
+        any_regression = any_regression or bool(regressions)
+    sys.exit(1 if any_regression else 0)
+
+
+if __name__ == "__main__":
+    main()
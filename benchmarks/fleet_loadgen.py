@@ -0,0 +1,373 @@
+"""Simulate a fleet of ESP32 devices, browsers and camera uploads against a running app.
+
+Scales esp32_test_harness.py from one device to thousands: every device
+has its own MQTT connection and publishes sensor data at a configurable
+interval with jitter, as legacy JSON, binary frames or a mix, and acks
+pump commands. Browsers log in and listen for `sensor_batch` over
+Socket.IO; the time from a device publish to a browser receiving that
+reading is the end-to-end latency reported at the end. Results are
+appended to benchmarks/results/fleet.jsonl.
+
+Devices and their owners are registered directly in the app's SQLite file
+and storage backend, so the app must share them. By default that file is
+database.db in a scratch directory under the system temp dir, never the
+checkout's: run the app from that directory, e.g. for a local run
+
+    mkdir -p /tmp/irrigateq-fleet && cd /tmp/irrigateq-fleet
+    STORAGE_BACKEND=sqlite MQTT_BROKER_URL=127.0.0.1 python /path/to/app.py
+    python /path/to/benchmarks/fleet_loadgen.py --embedded-broker --storage sqlite \\
+        --devices 2000 --interval 5 --browsers 20 --uploads-per-second 2
+
+--embedded-broker runs benchmarks/mini_broker.py in this process; start the
+load generator first (or point --broker at mosquitto). Each device holds a
+socket, so raise the file limit (`ulimit -n 65536`) for large fleets.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import ROOT, latency_summary, result_header, write_result
+from mqtt_wire import AsyncClient, ProtocolError
+from sensor_codec import encode_frame
+from sensor_reading import SensorReading
+from telemetry_store import connect
+
+TOPIC_PREFIX = "irrigateq"
+TEST_IMAGE_PATH = os.path.join(ROOT, "static", "icons", "icon-192x192.png")
+LOAD_PASSWORD = "load-test-password"
+
+# Working directory of the app under test: synthetic devices and readings
+# stay out of the checked-in database.db
+FLEET_DIR = os.path.join(tempfile.gettempdir(), "irrigateq-fleet")
+
+# The checked-in database.db's `devices` table, created in a fresh --db file
+DEVICES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    token TEXT UNIQUE NOT NULL,
+    plant_name TEXT NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES users (id)
+);
+"""
+
+# Soil moisture carries a per-device sequence number (10.00 .. 89.99 %), so a
+# reading seen by a browser can be matched to its publish in any format
+SEQUENCE_SPAN = 8000
+
+
+def sequence_moisture(seq):
+    return round(10 + (seq % SEQUENCE_SPAN) / 100, 2)
+
+
+# --- Setup ---
+def register_fleet(args):
+    """Create the owner accounts and device rows; returns (users, devices)"""
+    from firebase_config import configure_storage, create_user, authenticate, UserExistsError
+    if args.storage == 'sqlite':
+        from storage import create_backend
+        configure_storage(create_backend('sqlite', db_path=args.db))
+    elif args.storage:
+        configure_storage(args.storage)
+
+    users = []
+    for i in range(args.users):
+        email = f"load-{args.prefix}-{i}@example.com"
+        try:
+            user_id = create_user({
+                'nom': 'Load', 'prenom': f'User {i}', 'superficie': '1', 'plante': 'Tomate',
+                'email_or_phone': email, 'password': LOAD_PASSWORD,
+            })
+        except UserExistsError:
+            user_id = authenticate(email, LOAD_PASSWORD)['user_id']
+        users.append({'user_id': user_id, 'email': email})
+
+    conn = connect(args.db)
+    try:
+        conn.executescript(DEVICES_SCHEMA)
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO devices (user_id, token, plant_name) VALUES (?, ?, 'Tomate')",
+                [(users[i % len(users)]['user_id'], f"load-{args.prefix}-{i}") for i in range(args.devices)])
+        rows = conn.execute("SELECT id, user_id, token FROM devices WHERE token LIKE ?",
+                            (f"load-{args.prefix}-%",)).fetchall()
+    finally:
+        conn.close()
+    by_token = {token: (str(device_id), user_id) for device_id, user_id, token in rows}
+    devices = []
+    for i in range(args.devices):
+        device_id, user_id = by_token[f"load-{args.prefix}-{i}"]
+        devices.append({'token': f"load-{args.prefix}-{i}", 'device_id': device_id, 'user_id': user_id})
+    return users, devices
+
+
+# --- Devices ---
+class Fleet:
+    """Simulated devices, all on one asyncio loop"""
+
+    def __init__(self, args, devices, watched=()):
+        self.args = args
+        self.devices = devices
+        # Devices owned by a user with a browser open, and when measuring starts
+        self.watched = set(watched)
+        self.measure_from = None
+        self.host, self.port = args.broker.rsplit(':', 1)
+        self.port = int(self.port)
+        # (device_id, moisture) -> publish time, read by the browser threads
+        self.sent = {}
+        self.stats = {'connected': 0, 'connect_failed': 0, 'messages': 0, 'samples': 0,
+                      'watched_samples': 0, 'publish_failed': 0, 'commands': 0}
+        self.stopping = None
+        self.warmed_up = threading.Event()
+
+    def payload(self, seq, fmt):
+        now = time.time()
+        readings = [SensorReading(now, round(20 + random.random() * 10, 2), round(40 + random.random() * 20, 2),
+                                  sequence_moisture(seq + i)) for i in range(self.args.batch)]
+        if fmt == 'binary':
+            return encode_frame(readings)
+        if self.args.batch == 1:
+            # Same shape as the firmware: soil as a "%" string, no timestamp
+            r = readings[0]
+            return json.dumps({'temperature': r.temperature, 'humidite': r.humidite, 'sol': f"{r.sol}%"})
+        return json.dumps([r.as_dict() for r in readings])
+
+    async def run_device(self, device, index, limiter):
+        fmt = self.args.format
+        if fmt == 'mixed':
+            fmt = 'binary' if index % 2 else 'json'
+        token = device['token']
+
+        def on_command(topic, payload):
+            command = payload.decode(errors='replace')
+            ack = {'command': command, 'status': 'ok'}
+            if command.startswith('{'):
+                message = json.loads(command)
+                ack = {'id': message.get('id'), 'command': message.get('command'), 'status': 'ok'}
+            self.stats['commands'] += 1
+            asyncio.ensure_future(client.publish(f"{TOPIC_PREFIX}/{token}/ack", json.dumps(ack), qos=1))
+
+        client = AsyncClient(f"load-{token}", on_message=on_command)
+        async with limiter:
+            try:
+                await client.connect(self.host, self.port)
+            except (OSError, asyncio.TimeoutError, ProtocolError):
+                self.stats['connect_failed'] += 1
+                return
+        self.stats['connected'] += 1
+        data_topic = f"{TOPIC_PREFIX}/{token}/data"
+        try:
+            await client.subscribe(f"{TOPIC_PREFIX}/{token}/command", qos=1)
+            await client.publish(f"{TOPIC_PREFIX}/{token}/status", "online", retain=True)
+            # Spread the first publishes over one interval
+            await asyncio.sleep(random.random() * self.args.interval)
+            seq = index * 7
+            while not self.stopping.is_set():
+                published = time.perf_counter()
+                payload = self.payload(seq, fmt)
+                for i in range(self.args.batch):
+                    self.sent[(device['device_id'], sequence_moisture(seq + i))] = published
+                try:
+                    await client.publish(data_topic, payload)
+                except ConnectionError:
+                    self.stats['publish_failed'] += 1
+                    return
+                self.stats['messages'] += 1
+                self.stats['samples'] += self.args.batch
+                if self.measure_from is not None and device['device_id'] in self.watched:
+                    self.stats['watched_samples'] += self.args.batch
+                seq += self.args.batch
+                jitter = 1 + random.uniform(-self.args.jitter, self.args.jitter)
+                try:
+                    await asyncio.wait_for(self.stopping.wait(), self.args.interval * jitter)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await client.close()
+
+    async def run(self, duration):
+        self.stopping = asyncio.Event()
+        broker = None
+        if self.args.embedded_broker:
+            from mini_broker import Broker
+            broker = Broker()
+            await broker.start(self.host, self.port)
+            print(f"Broker embarqué sur {self.host}:{self.port}, en attente de l'application...")
+            deadline = time.monotonic() + self.args.broker_wait
+            while not broker.has_subscriber(f"{TOPIC_PREFIX}/+/data") and time.monotonic() < deadline:
+                await asyncio.sleep(0.2)
+
+        limiter = asyncio.Semaphore(200)
+        tasks = [asyncio.ensure_future(self.run_device(device, i, limiter)) for i, device in enumerate(self.devices)]
+        # Every device has published once: the app now knows all tokens
+        await asyncio.sleep(self.args.interval + 1)
+        self.measure_from = time.perf_counter()
+        self.warmed_up.set()
+        await asyncio.sleep(duration)
+        self.stopping.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if broker is not None:
+            self.stats['broker'] = dict(broker.stats)
+            await broker.close()
+
+
+# --- Browsers ---
+def login(app_url, email):
+    import requests
+    http = requests.Session()
+    response = http.post(f"{app_url}/login", data={'email_or_phone': email, 'password': LOAD_PASSWORD},
+                         allow_redirects=False)
+    if response.status_code != 302:
+        raise RuntimeError(f"Login failed for {email} ({response.status_code})")
+    return http
+
+
+def transports(requested):
+    if requested:
+        return requested.split(',')
+    try:
+        import websocket  # noqa: F401 (websocket-client, used by python-socketio)
+        return ['websocket']
+    except ImportError:
+        return ['polling']
+
+
+def run_browser(args, user, fleet, latencies, seen, stop):
+    import engineio
+    import socketio
+    # A browser watching many devices gets one event per device room per
+    # flush; the Python client rejects polls carrying more than 16 packets
+    engineio.payload.Payload.max_decode_packets = 100000
+    http = login(args.app_url, user['email'])
+    client = socketio.Client(http_session=http, reconnection=False)
+    received = []
+
+    @client.on('sensor_batch')
+    def on_batch(data):
+        now = time.perf_counter()
+        for reading in data.get('readings', ()):
+            key = (reading.get('device_id'), round(reading.get('sol') or 0, 2))
+            published = fleet.sent.get(key)
+            if published is not None and published >= fleet.measure_from:
+                received.append(now - published)
+                seen.add(key)
+
+    client.connect(args.app_url, transports=transports(args.transports))
+    stop.wait()
+    client.disconnect()
+    latencies.extend(received)
+
+
+# --- Uploads ---
+def run_uploads(args, devices, stop):
+    """POST camera frames at a fixed rate; returns (latencies, status counts)"""
+    import requests
+    with open(args.image, 'rb') as f:
+        image = f.read()
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+
+    def upload(n):
+        device = random.choice(devices)
+        # A few trailing bytes make every frame a distinct blob, like a real camera
+        body = image + n.to_bytes(8, 'big')
+        started = time.perf_counter()
+        try:
+            response = requests.post(f"{args.app_url}/upload-image", headers={'X-Device-Token': device['token']},
+                                     files={'image': (f"load_{n}.png", body, 'image/png')}, timeout=30)
+            status = response.status_code
+        except requests.RequestException:
+            status = 'error'
+        with lock:
+            latencies.append(time.perf_counter() - started)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        n = 0
+        while not stop.wait(1 / args.uploads_per_second):
+            pool.submit(upload, n)
+            n += 1
+    return latencies, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--interval", type=float, default=10.0, help="seconds between publishes per device")
+    parser.add_argument("--jitter", type=float, default=0.1, help="relative jitter on the interval")
+    parser.add_argument("--format", choices=('json', 'binary', 'mixed'), default='json')
+    parser.add_argument("--batch", type=int, default=1, help="samples per message")
+    parser.add_argument("--duration", type=float, default=60.0, help="measured seconds after warm-up")
+    parser.add_argument("--broker", default="127.0.0.1:1883")
+    parser.add_argument("--embedded-broker", action="store_true", help="run mini_broker.py in this process")
+    parser.add_argument("--broker-wait", type=float, default=60.0,
+                        help="seconds to wait for the app to subscribe on the embedded broker")
+    parser.add_argument("--app-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--db", default=os.path.join(FLEET_DIR, "database.db"),
+                        help="the app's SQLite file (default: %(default)s)")
+    parser.add_argument("--storage", help="storage backend shared with the app (memory cannot be shared)")
+    parser.add_argument("--users", type=int, default=10, help="device owners; devices are spread evenly")
+    parser.add_argument("--browsers", type=int, default=10, help="Socket.IO clients, one per user in turn")
+    parser.add_argument("--transports", help="Socket.IO transports (default: websocket if websocket-client is installed)")
+    parser.add_argument("--uploads-per-second", type=float, default=0.0)
+    parser.add_argument("--image", default=TEST_IMAGE_PATH)
+    parser.add_argument("--prefix", default="fleet", help="token prefix, to keep runs apart")
+    parser.add_argument("--output", help="JSON lines file (default: benchmarks/results/fleet.jsonl)")
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    users, devices = register_fleet(args)
+    watched_users = {user['user_id'] for user in users[:args.browsers]}
+    fleet = Fleet(args, devices, [device['device_id'] for device in devices if device['user_id'] in watched_users])
+    fleet_thread = threading.Thread(target=lambda: asyncio.run(fleet.run(args.duration)), name="fleet")
+    fleet_thread.start()
+    fleet.warmed_up.wait()
+
+    stop = threading.Event()
+    latencies, seen, threads = [], set(), []
+    for i in range(args.browsers):
+        thread = threading.Thread(target=run_browser, args=(args, users[i % len(users)], fleet, latencies, seen, stop))
+        thread.start()
+        threads.append(thread)
+    uploads = {}
+    if args.uploads_per_second > 0:
+        def uploader():
+            uploads['latencies'], uploads['statuses'] = run_uploads(args, devices, stop)
+        threads.append(threading.Thread(target=uploader))
+        threads[-1].start()
+
+    baseline = dict(fleet.stats)
+    started = time.perf_counter()
+    fleet_thread.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    messages = fleet.stats['messages'] - baseline['messages']
+    samples = fleet.stats['samples'] - baseline['samples']
+    result = result_header(
+        'fleet', devices=args.devices, interval=args.interval, format=args.format, batch=args.batch,
+        browsers=args.browsers, duration=round(elapsed, 1),
+        devices_connected=fleet.stats['connected'], connect_failed=fleet.stats['connect_failed'],
+        publish_failed=fleet.stats['publish_failed'], commands_acked=fleet.stats['commands'],
+        messages_per_second=round(messages / elapsed, 1), samples_per_second=round(samples / elapsed, 1),
+        # Share of the samples from devices watched by a browser that reached one
+        delivered_ratio=round(len(seen) / max(1, fleet.stats['watched_samples']), 3),
+        end_to_end=latency_summary(latencies),
+    )
+    if uploads:
+        result['uploads'] = dict(latency_summary(uploads['latencies']), statuses=uploads['statuses'])
+    if 'broker' in fleet.stats:
+        result['broker'] = fleet.stats['broker']
+    write_result(result, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Small asyncio MQTT 3.1.1 broker for local load tests.
+
+Stands in for mosquitto when none is installed: QoS 0 and 1, '+'/'#'
+wildcards, retained messages, keepalive pings. Sessions are always clean
+and QoS 1 messages are not redelivered after a reconnect, so use a real
+broker for anything but benchmarking on one machine.
+
+    python benchmarks/mini_broker.py --port 1883
+"""
+import argparse
+import asyncio
+import struct
+
+from mqtt_wire import (
+    CONNACK, CONNECT, DISCONNECT, PINGREQ, PINGRESP, PUBACK, PUBLISH, SUBACK, SUBSCRIBE,
+    UNSUBACK, UNSUBSCRIBE, ProtocolError, packet, packet_id_packet, parse_connect,
+    parse_publish, parse_subscribe, publish_packet, read_packet, topic_matches,
+)
+
+
+class _Session:
+    __slots__ = ('client_id', 'writer', 'filters', 'next_id')
+
+    def __init__(self, client_id, writer):
+        self.client_id = client_id
+        self.writer = writer
+        self.filters = {}
+        self.next_id = 0
+
+    def deliver(self, topic, payload, qos, retain=False):
+        packet_id = None
+        if qos:
+            self.next_id = self.next_id % 0xFFFF + 1
+            packet_id = self.next_id
+        self.writer.write(publish_packet(topic, payload, qos=qos, packet_id=packet_id, retain=retain))
+
+
+class Broker:
+    """Routes PUBLISH packets to matching subscriptions.
+
+    Exact topic filters are kept in a dict so a fleet of devices each
+    subscribed to its own command topic costs one lookup per message;
+    wildcard filters (the app's `irrigateq/+/data`) are scanned.
+    """
+
+    def __init__(self):
+        self._exact = {}
+        self._wildcard = {}
+        self._retained = {}
+        self._server = None
+        self._handlers = set()
+        self.stats = {'connections': 0, 'connected': 0, 'received': 0, 'delivered': 0}
+
+    async def start(self, host='127.0.0.1', port=1883):
+        self._server = await asyncio.start_server(self._handle, host, port, backlog=4096)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            for task in self._handlers:
+                task.cancel()
+            await asyncio.gather(*self._handlers, return_exceptions=True)
+            await self._server.wait_closed()
+
+    def has_subscriber(self, topic_filter):
+        """True once some client subscribed to exactly this filter"""
+        return (topic_filter in self._exact
+                or any(topic_filter in filters for filters in self._wildcard.values()))
+
+    def route(self, topic, payload, qos, retain=False):
+        if retain:
+            if payload:
+                self._retained[topic] = (payload, qos)
+            else:
+                self._retained.pop(topic, None)
+        targets = dict.fromkeys(self._exact.get(topic, ()), None)
+        for session, filters in self._wildcard.items():
+            for topic_filter, granted in filters.items():
+                if topic_matches(topic_filter, topic):
+                    targets[session] = max(granted, targets.get(session) or 0)
+                    break
+        for session, granted in targets.items():
+            if granted is None:
+                granted = session.filters[topic]
+            session.deliver(topic, payload, min(qos, granted))
+            self.stats['delivered'] += 1
+
+    def _subscribe(self, session, topic_filter, qos):
+        session.filters[topic_filter] = qos
+        if '+' in topic_filter or '#' in topic_filter:
+            self._wildcard.setdefault(session, {})[topic_filter] = qos
+        else:
+            self._exact.setdefault(topic_filter, set()).add(session)
+        for topic, (payload, retained_qos) in self._retained.items():
+            if topic_matches(topic_filter, topic):
+                session.deliver(topic, payload, min(qos, retained_qos), retain=True)
+
+    def _unsubscribe(self, session, topic_filter):
+        session.filters.pop(topic_filter, None)
+        self._wildcard.get(session, {}).pop(topic_filter, None)
+        subscribers = self._exact.get(topic_filter)
+        if subscribers is not None:
+            subscribers.discard(session)
+            if not subscribers:
+                del self._exact[topic_filter]
+
+    def _drop(self, session):
+        for topic_filter in list(session.filters):
+            self._unsubscribe(session, topic_filter)
+        self._wildcard.pop(session, None)
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        session = None
+        try:
+            kind, _, body = await read_packet(reader)
+            if kind != CONNECT:
+                raise ProtocolError("First packet must be CONNECT")
+            connect = parse_connect(body)
+            session = _Session(connect['client_id'], writer)
+            writer.write(packet(CONNACK, bytes([0, 0])))
+            self.stats['connections'] += 1
+            self.stats['connected'] += 1
+            # Drop clients silent for 1.5x their keepalive
+            timeout = connect['keepalive'] * 1.5 or None
+
+            while True:
+                kind, flags, body = await asyncio.wait_for(read_packet(reader), timeout)
+                if kind == PUBLISH:
+                    topic, payload, qos, packet_id, retain = parse_publish(flags, body)
+                    self.stats['received'] += 1
+                    if qos:
+                        writer.write(packet_id_packet(PUBACK, packet_id))
+                    self.route(topic, payload, qos, retain)
+                elif kind == SUBSCRIBE:
+                    packet_id, filters = parse_subscribe(body)
+                    granted = [min(qos, 1) for _, qos in filters]
+                    writer.write(packet(SUBACK, struct.pack('>H', packet_id) + bytes(granted)))
+                    for (topic_filter, _), qos in zip(filters, granted):
+                        self._subscribe(session, topic_filter, qos)
+                elif kind == UNSUBSCRIBE:
+                    (packet_id,) = struct.unpack_from('>H', body)
+                    offset = 2
+                    while offset < len(body):
+                        (length,) = struct.unpack_from('>H', body, offset)
+                        self._unsubscribe(session, body[offset + 2:offset + 2 + length].decode())
+                        offset += 2 + length
+                    writer.write(packet_id_packet(UNSUBACK, packet_id))
+                elif kind == PINGREQ:
+                    writer.write(packet(PINGRESP))
+                elif kind == DISCONNECT:
+                    break
+                # PUBACKs from subscribers need no bookkeeping: nothing is redelivered
+                if writer.transport.get_write_buffer_size() > 1 << 20:
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, ProtocolError,
+                asyncio.CancelledError):
+            pass
+        finally:
+            if session is not None:
+                self._drop(session)
+                self.stats['connected'] -= 1
+            self._handlers.discard(task)
+            writer.close()
+
+
+async def serve(host, port):
+    broker = Broker()
+    port = await broker.start(host, port)
+    print(f"Broker MQTT de test sur {host}:{port}")
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
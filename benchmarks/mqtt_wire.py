@@ -0,0 +1,213 @@
+"""Just enough MQTT 3.1.1 for load testing: packet encoding, an asyncio
+client for simulated devices and topic filter matching for the broker.
+
+QoS 0 and 1 only, clean sessions only, no will messages or authentication.
+"""
+import asyncio
+import struct
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+
+class ProtocolError(Exception):
+    """Malformed or unsupported MQTT packet"""
+
+
+def _string(value):
+    data = value.encode() if isinstance(value, str) else value
+    return struct.pack('>H', len(data)) + data
+
+
+def _read_string(data, offset):
+    (length,) = struct.unpack_from('>H', data, offset)
+    start = offset + 2
+    return data[start:start + length].decode(), start + length
+
+
+def packet(kind, body=b'', flags=0):
+    """Fixed header (type, flags, remaining length) followed by `body`"""
+    length = len(body)
+    header = bytearray([kind << 4 | flags])
+    while True:
+        byte, length = length % 128, length // 128
+        header.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(header) + body
+
+
+async def read_packet(reader):
+    """Read one packet; returns (type, flags, body)"""
+    first = (await reader.readexactly(1))[0]
+    length, multiplier = 0, 1
+    for _ in range(4):
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            break
+        multiplier *= 128
+    else:
+        raise ProtocolError("Remaining length longer than 4 bytes")
+    body = await reader.readexactly(length) if length else b''
+    return first >> 4, first & 0x0F, body
+
+
+def connect_packet(client_id, keepalive=60):
+    flags = 0x02  # clean session
+    return packet(CONNECT, _string("MQTT") + bytes([4, flags]) + struct.pack('>H', keepalive) + _string(client_id))
+
+
+def parse_connect(body):
+    protocol, offset = _read_string(body, 0)
+    level, flags = body[offset], body[offset + 1]
+    (keepalive,) = struct.unpack_from('>H', body, offset + 2)
+    client_id, _ = _read_string(body, offset + 4)
+    if protocol not in ("MQTT", "MQIsdp"):
+        raise ProtocolError(f"Unknown protocol {protocol!r}")
+    return {'client_id': client_id, 'level': level, 'flags': flags, 'keepalive': keepalive}
+
+
+def publish_packet(topic, payload, qos=0, packet_id=None, retain=False):
+    body = _string(topic)
+    if qos:
+        body += struct.pack('>H', packet_id)
+    if isinstance(payload, str):
+        payload = payload.encode()
+    return packet(PUBLISH, body + payload, flags=qos << 1 | int(retain))
+
+
+def parse_publish(flags, body):
+    """Returns (topic, payload, qos, packet_id, retain)"""
+    qos = (flags >> 1) & 0x03
+    topic, offset = _read_string(body, 0)
+    packet_id = None
+    if qos:
+        (packet_id,) = struct.unpack_from('>H', body, offset)
+        offset += 2
+    return topic, body[offset:], qos, packet_id, bool(flags & 0x01)
+
+
+def subscribe_packet(packet_id, filters):
+    body = struct.pack('>H', packet_id)
+    for topic_filter, qos in filters:
+        body += _string(topic_filter) + bytes([qos])
+    return packet(SUBSCRIBE, body, flags=0x02)
+
+
+def parse_subscribe(body):
+    """Returns (packet_id, [(filter, qos), ...])"""
+    (packet_id,) = struct.unpack_from('>H', body, 0)
+    offset, filters = 2, []
+    while offset < len(body):
+        topic_filter, offset = _read_string(body, offset)
+        filters.append((topic_filter, body[offset] & 0x03))
+        offset += 1
+    return packet_id, filters
+
+
+def packet_id_packet(kind, packet_id, flags=0):
+    """PUBACK, UNSUBACK: a packet carrying only a packet identifier"""
+    return packet(kind, struct.pack('>H', packet_id), flags)
+
+
+def topic_matches(topic_filter, topic):
+    """MQTT filter matching with '+' (one level) and '#' (rest of the topic)"""
+    filter_levels = topic_filter.split('/')
+    topic_levels = topic.split('/')
+    for i, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if i >= len(topic_levels) or (level != '+' and level != topic_levels[i]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+class AsyncClient:
+    """Minimal asyncio MQTT client, one per simulated device.
+
+    `on_message(topic, payload)` is called for every PUBLISH received;
+    QoS 1 deliveries are acknowledged before the callback runs.
+    """
+
+    def __init__(self, client_id, on_message=None, keepalive=60):
+        self.client_id = client_id
+        self.on_message = on_message
+        self.keepalive = keepalive
+        self._reader = None
+        self._writer = None
+        self._next_id = 0
+        self._pending_acks = {}
+        self._tasks = []
+
+    async def connect(self, host, port, timeout=10):
+        self._reader, self._writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        self._writer.write(connect_packet(self.client_id, self.keepalive))
+        kind, _, body = await asyncio.wait_for(read_packet(self._reader), timeout)
+        if kind != CONNACK or body[1] != 0:
+            raise ProtocolError(f"Connection refused ({body[1] if len(body) > 1 else '?'})")
+        self._tasks = [asyncio.ensure_future(self._read_loop()), asyncio.ensure_future(self._ping_loop())]
+
+    def _packet_id(self):
+        self._next_id = self._next_id % 0xFFFF + 1
+        return self._next_id
+
+    async def subscribe(self, topic_filter, qos=0):
+        self._writer.write(subscribe_packet(self._packet_id(), [(topic_filter, qos)]))
+        await self._writer.drain()
+
+    async def publish(self, topic, payload, qos=0, retain=False):
+        """Publish; with QoS 1 wait for the broker's PUBACK"""
+        if not qos:
+            self._writer.write(publish_packet(topic, payload, retain=retain))
+            await self._writer.drain()
+            return
+        packet_id = self._packet_id()
+        acked = self._pending_acks[packet_id] = asyncio.get_running_loop().create_future()
+        self._writer.write(publish_packet(topic, payload, qos=1, packet_id=packet_id, retain=retain))
+        await self._writer.drain()
+        await acked
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        if self._writer is not None:
+            try:
+                self._writer.write(packet(DISCONNECT))
+                await self._writer.drain()
+            except ConnectionError:
+                pass
+            self._writer.close()
+
+    async def _read_loop(self):
+        try:
+            while True:
+                kind, flags, body = await read_packet(self._reader)
+                if kind == PUBLISH:
+                    topic, payload, qos, packet_id, _ = parse_publish(flags, body)
+                    if qos:
+                        self._writer.write(packet_id_packet(PUBACK, packet_id))
+                    if self.on_message is not None:
+                        self.on_message(topic, payload)
+                elif kind == PUBACK:
+                    (packet_id,) = struct.unpack('>H', body)
+                    acked = self._pending_acks.pop(packet_id, None)
+                    if acked is not None and not acked.done():
+                        acked.set_result(True)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            for acked in self._pending_acks.values():
+                if not acked.done():
+                    acked.set_exception(ConnectionError("Connection lost"))
+
+    async def _ping_loop(self):
+        while True:
+            await asyncio.sleep(self.keepalive / 2)
+            self._writer.write(packet(PINGREQ))
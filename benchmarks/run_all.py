@@ -0,0 +1,56 @@
+"""Run the offline benchmark suite and compare it with the previous run.
+
+Each bench_*.py runs in its own interpreter (so one benchmark's caches and
+threads do not skew the next) and appends to benchmarks/results/; then
+compare.py reports what moved since the previous result of each benchmark.
+fleet_loadgen.py needs a running app and is not part of the suite.
+
+    python benchmarks/run_all.py
+    python benchmarks/run_all.py --quick
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+from common import ROOT
+
+BENCHMARK_DIR = os.path.join(ROOT, "benchmarks")
+
+# Script -> arguments of a --quick run (smoke test of the suite itself)
+SUITE = {
+    'bench_startup.py': ['--runs', '2'],
+    'bench_codec.py': ['--messages', '2000'],
+    'bench_ingest.py': ['--messages', '500'],
+    'bench_history.py': ['--sizes', '10,1000'],
+    'bench_images.py': ['--sizes', '100,1000'],
+    'bench_dashboard.py': ['--requests', '50'],
+    'bench_login.py': ['--users', '4', '--logins', '20'],
+    'bench_reads.py': [],
+    'bench_http.py': ['--requests', '20'],
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="small sizes, for checking the suite runs")
+    parser.add_argument("--only", help="comma-separated script names to run")
+    args = parser.parse_args()
+
+    only = set(args.only.split(',')) if args.only else None
+    failed = []
+    for script, quick_args in SUITE.items():
+        if only and script not in only and script[:-3] not in only:
+            continue
+        print(f"== {script}", flush=True)
+        command = [sys.executable, os.path.join(BENCHMARK_DIR, script)] + (quick_args if args.quick else [])
+        if subprocess.run(command, stdout=subprocess.DEVNULL).returncode != 0:
+            failed.append(script)
+
+    subprocess.run([sys.executable, os.path.join(BENCHMARK_DIR, "compare.py")])
+    if failed:
+        sys.exit(f"Failed: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
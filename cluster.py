@@ -0,0 +1,347 @@
+"""Multi-process deployment on one host: shared secret, Socket.IO message queue, MQTT leader.
+
+Several app processes on the same host can serve the same users when they
+share three things:
+
+* the Flask secret key (sessions are signed cookies, so any worker can read
+  a session another one created): `load_secret_key()`;
+* a Socket.IO message queue, so an event emitted by one worker reaches the
+  browsers connected to the others: `SOCKETIO_MESSAGE_QUEUE=sqlite:///cluster.db`,
+  or `redis://...` (or any URL Flask-SocketIO supports);
+* a leader: one process holds a `LeaderLease`, consumes sensor data from
+  MQTT and runs the other once-per-deployment jobs; the rest only serve
+  HTTP and Socket.IO. If the leader dies, another worker takes over once
+  the lease expires.
+
+Only one host is supported, whatever the message queue: the lease lives in
+the host's `cluster.db`, and telemetry, devices and the image index in its
+`database.db`. Workers on a second host would elect their own leader (a
+second MQTT consumer) and see none of the first host's readings or uploads.
+
+Run four workers on ports 5001-5004:
+
+    python cluster.py --workers 4 --port 5001
+
+Each worker runs under gunicorn (one process, many threads) when it is
+installed (`pip install gunicorn simple-websocket`). Without it, set
+ALLOW_UNSAFE_WERKZEUG=1 to use Werkzeug's development server, for local
+tests only. Put the workers behind a proxy with sticky sessions (Socket.IO
+long-polling needs every request of a client on the same worker), e.g. nginx:
+
+    upstream irrigateq { ip_hash; server 127.0.0.1:5001; ... server 127.0.0.1:5004; }
+"""
+import argparse
+import importlib.util
+import os
+import secrets
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import socketio
+
+from app_logging import configure_logging, get_logger
+from telemetry_store import connect
+
+log = get_logger('cluster')
+
+# Flask secret key file, created on first start unless SECRET_KEY is set
+SECRET_KEY_FILE = "secret_key"
+
+# Message queue and leases of one host's workers
+CLUSTER_DB = "cluster.db"
+
+# Delay between two reads of the message table when it is empty
+POLL_INTERVAL = 0.05
+
+# Queued Socket.IO messages are kept this long, then deleted
+MESSAGE_RETENTION = 60
+
+# A leader that stops renewing is replaced after this many seconds
+LEASE_TTL = 15
+
+# Request threads of one gunicorn worker (Socket.IO connections hold one each)
+WORKER_THREADS = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS socketio_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    created REAL NOT NULL,
+    payload BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+"""
+
+# Take the lease if it is free, expired or already ours
+ACQUIRE_LEASE = """
+INSERT INTO leases (name, holder, expires) VALUES (?, ?, ?)
+ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires = excluded.expires
+WHERE leases.holder = excluded.holder OR leases.expires < ?
+"""
+
+
+def load_secret_key(path=SECRET_KEY_FILE):
+    """Secret key shared by all workers and kept across restarts: SECRET_KEY
+    from the environment, else the contents of `path` (created with mode
+    0600 by whichever worker starts first)"""
+    key = os.environ.get('SECRET_KEY')
+    if key:
+        return key
+    if not os.path.exists(path):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+        try:
+            # link() fails if another worker created the file first: keep theirs
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(tmp_path)
+    with open(path, encoding='utf-8') as f:
+        return f.read().strip()
+
+
+def sqlite_path(url):
+    """'sqlite:///cluster.db' -> 'cluster.db'"""
+    return url[len('sqlite:///'):] if url.startswith('sqlite:///') else None
+
+
+def socketio_options(url, channel='flask-socketio'):
+    """SocketIO.init_app() arguments for a message queue URL"""
+    path = sqlite_path(url)
+    if path is None:
+        return {'message_queue': url, 'channel': channel}
+    return {'client_manager': SQLiteManager(path, channel=channel)}
+
+
+class SQLiteManager(socketio.PubSubManager):
+    """Socket.IO client manager passing events between processes through a
+    SQLite table.
+
+    The local stand-in for Redis: every process appends what it emits and
+    polls the table for what the others emitted (at most `poll_interval`
+    late). Only for workers sharing one filesystem. Messages are stored as
+    JSON, like the other Socket.IO pub/sub managers, so a row written to
+    the table is never executed as code.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, db_path=CLUSTER_DB, channel='flask-socketio', write_only=False, logger=None,
+                 poll_interval=POLL_INTERVAL, retention=MESSAGE_RETENTION, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = connect(self.db_path)
+        conn.executescript(SCHEMA)
+        return conn
+
+    def _publish(self, data):
+        payload = self.json.dumps(data)
+        with self._lock:
+            if self._conn is None:
+                self._conn = self._connect()
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO socketio_messages (channel, created, payload) VALUES (?, ?, ?)",
+                    (self.channel, time.time(), payload))
+
+    def _listen(self):
+        conn = self._connect()
+        # Only what is published from now on
+        last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM socketio_messages").fetchone()[0]
+        next_prune = 0
+        while True:
+            rows = conn.execute(
+                "SELECT id, payload FROM socketio_messages WHERE id > ? AND channel = ? ORDER BY id",
+                (last_id, self.channel)).fetchall()
+            for last_id, payload in rows:
+                # Decoded by PubSubManager, which skips what is not valid JSON
+                yield payload
+            now = time.time()
+            if now >= next_prune:
+                next_prune = now + self.retention
+                with conn:
+                    conn.execute("DELETE FROM socketio_messages WHERE created < ?", (now - self.retention,))
+            if not rows:
+                self.server.sleep(self.poll_interval)
+
+
+class LeaderLease:
+    """Leader election between the processes sharing a SQLite file.
+
+    At most one holder has an unexpired lease `name`; it renews the lease
+    every ttl/3 seconds from a background thread, and the other processes
+    try to take it over at the same pace. `on_elected()` and `on_lost()`
+    are called on that thread when this process gains or loses it.
+    """
+
+    def __init__(self, db_path=CLUSTER_DB, name='mqtt-ingest', ttl=LEASE_TTL,
+                 on_elected=None, on_lost=None, holder=None, clock=time.time):
+        self.db_path = db_path
+        self.name = name
+        self.ttl = ttl
+        self.on_elected = on_elected
+        self.on_lost = on_lost
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.clock = clock
+
+        self._leader = False
+        self._expires = 0
+        self._conn = None
+        self._stopped = threading.Event()
+        self._thread = None
+        self.stats_counters = {'elected': 0, 'lost': 0, 'errors': 0}
+
+    @property
+    def is_leader(self):
+        # A lease we could not renew is not trusted past its expiry
+        return self._leader and self.clock() < self._expires
+
+    def try_acquire(self):
+        """Take or renew the lease; True if this process holds it"""
+        if self._conn is None:
+            self._conn = connect(self.db_path)
+            self._conn.executescript(SCHEMA)
+        now = self.clock()
+        with self._conn:
+            self._conn.execute(ACQUIRE_LEASE, (self.name, self.holder, now + self.ttl, now))
+            holder = self._conn.execute("SELECT holder FROM leases WHERE name = ?", (self.name,)).fetchone()[0]
+        if holder == self.holder:
+            self._expires = now + self.ttl
+            return True
+        return False
+
+    def step(self):
+        """One election round: acquire or renew, then run the callbacks"""
+        try:
+            held = self.try_acquire()
+        except sqlite3.Error as e:
+            self.stats_counters['errors'] += 1
+            log.warning("Bail %s non renouvelé: %s", self.name, e)
+            held = self.is_leader
+        if held and not self._leader:
+            self._leader = True
+            self.stats_counters['elected'] += 1
+            log.info("Processus élu leader (%s)", self.name, extra={'holder': self.holder})
+            self._call(self.on_elected)
+        elif not held and self._leader:
+            self._leader = False
+            self.stats_counters['lost'] += 1
+            log.warning("Bail %s perdu", self.name, extra={'holder': self.holder})
+            self._call(self.on_lost)
+        return held
+
+    def _call(self, callback):
+        if callback is None:
+            return
+        try:
+            callback()
+        except Exception as e:
+            log.exception("Callback d'élection en échec: %s", e)
+
+    def stats(self):
+        return dict(self.stats_counters, leader=int(self.is_leader))
+
+    # --- Background thread ---
+    def start(self):
+        """Run elections in a background thread"""
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="leader-lease", daemon=True)
+            self._thread.start()
+
+    def close(self, timeout=5):
+        """Stop renewing and release the lease so another process takes over at once"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+        if self._leader and self._conn is not None:
+            with self._conn:
+                self._conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (self.name, self.holder))
+        self._leader = False
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self.step()
+            self._stopped.wait(self.ttl / 3)
+
+
+def allow_unsafe_werkzeug():
+    """Whether the development server was explicitly allowed (ALLOW_UNSAFE_WERKZEUG=1)"""
+    return os.environ.get('ALLOW_UNSAFE_WERKZEUG') == '1'
+
+
+def worker_command(port, host):
+    """Command line of the worker serving `port`"""
+    if importlib.util.find_spec('gunicorn') is not None:
+        # One process per port: a client's polling requests all reach the process holding its session
+        return [sys.executable, '-m', 'gunicorn', '--workers', '1', '--threads', str(WORKER_THREADS),
+                '--bind', f"{host}:{port}", '--chdir', os.path.dirname(os.path.abspath(__file__)),
+                'app:create_app()']
+    if not allow_unsafe_werkzeug():
+        raise SystemExit("gunicorn n'est pas installé: pip install gunicorn simple-websocket, "
+                         "ou ALLOW_UNSAFE_WERKZEUG=1 pour le serveur de développement (tests locaux)")
+    return [sys.executable, os.path.abspath(__file__), "--worker", "--port", str(port)]
+
+
+def serve_worker(port):
+    """Run one app worker on Werkzeug's development server (a child of main(),
+    only with ALLOW_UNSAFE_WERKZEUG=1)"""
+    import app as app_module
+    app_module.socketio.run(app_module.create_app(), host=os.environ.get('HOST', '0.0.0.0'), port=port,
+                            allow_unsafe_werkzeug=allow_unsafe_werkzeug())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--port", type=int, default=5001, help="port of the first worker")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        serve_worker(args.port)
+        return
+
+    configure_logging()
+    host = os.environ.get('HOST', '0.0.0.0')
+    # Fails here, before any worker starts, if there is no server to run them
+    worker_command(args.port, host)
+    # Create the key file once, before the workers race to do it
+    load_secret_key()
+    children = []
+    for n in range(args.workers):
+        env = dict(os.environ, WORKER_ID=os.environ.get('WORKER_ID', '') + str(n))
+        env.setdefault('SOCKETIO_MESSAGE_QUEUE', f"sqlite:///{CLUSTER_DB}")
+        children.append(subprocess.Popen(worker_command(args.port + n, host), env=env))
+        log.info("Worker %d démarré sur le port %d", n, args.port + n)
+    try:
+        for child in children:
+            child.wait()
+    except KeyboardInterrupt:
+        for child in children:
+            child.terminate()
+        for child in children:
+            child.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+import json
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from app_logging import get_logger
+
+log = get_logger('command_dispatcher')
+
+# Seconds to wait for a device ack before publishing the command again
+ACK_TIMEOUT = 5.0
+MAX_ATTEMPTS = 3
+
+# Commands for an offline device wait this long before expiring
+QUEUE_TTL = 600.0
+
+# Finished commands kept for status lookups, and round trips kept per device
+HISTORY_SIZE = 1000
+LATENCY_WINDOW = 500
+
+# MQTT QoS used for commands: at-least-once delivery to the broker
+COMMAND_QOS = 1
+
+# Command states
+QUEUED = 'queued'
+SENT = 'sent'
+ACKED = 'acked'
+REJECTED = 'rejected'
+FAILED = 'failed'
+EXPIRED = 'expired'
+# Sent once to a device never seen acking: its firmware may not send acks
+UNCONFIRMED = 'unconfirmed'
+FINAL_STATES = (ACKED, REJECTED, FAILED, EXPIRED, UNCONFIRMED)
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Command:
+    """One pump command and its delivery state"""
+
+    __slots__ = ('id', 'device_id', 'user_id', 'topic', 'command', 'legacy', 'source',
+                 'status', 'attempts', 'created_at', 'first_sent_at', 'last_sent_at',
+                 'finished_at', 'latency', 'error', 'done')
+
+    def __init__(self, device_id, user_id, topic, command, legacy=False, source=None, created_at=None):
+        self.id = uuid.uuid4().hex
+        self.device_id = device_id
+        self.user_id = user_id
+        self.topic = topic
+        self.command = command
+        self.legacy = legacy
+        self.source = source
+        self.status = QUEUED
+        self.attempts = 0
+        self.created_at = created_at
+        self.first_sent_at = None
+        self.last_sent_at = None
+        self.finished_at = None
+        self.latency = None
+        self.error = None
+        self.done = threading.Event()
+
+    def payload(self):
+        # Legacy firmware compares the payload with "START"/"STOP" and cannot see the ID
+        if self.legacy:
+            return self.command
+        return json.dumps({'id': self.id, 'command': self.command})
+
+    def wait(self, timeout=None):
+        """Block until the command is acked, rejected, failed or expired"""
+        self.done.wait(timeout)
+        return self.status
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'device_id': self.device_id,
+            'command': self.command,
+            'source': self.source,
+            'status': self.status,
+            'attempts': self.attempts,
+            'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+            'error': self.error,
+        }
+
+
+class CommandDispatcher:
+    """Delivers pump commands with acks, retries and an offline queue.
+
+    Commands are published with QoS 1 and carry an ID that the device echoes
+    on `irrigateq/<token>/ack`. Without an ack within `ack_timeout` the
+    command is published again, up to `max_attempts` times. Commands for a
+    device whose status is "offline" are held, in order, until it comes back
+    or `queue_ttl` passes. Acks without an ID (legacy firmware) settle the
+    oldest outstanding command with the same name.
+
+    Retries and failures only apply to devices that have sent an ack since
+    the dispatcher started. For any other device, a command becomes
+    "unconfirmed" after its first `ack_timeout`. Firmware without ack
+    support is then neither sent the command again nor reported as failing.
+
+    `publish(topic, payload, qos)` returns False when the broker is not
+    reachable; the command then stays queued. `on_result(command)` is called
+    once a command reaches a final state.
+    """
+
+    def __init__(self, publish, on_result=None, ack_timeout=ACK_TIMEOUT, max_attempts=MAX_ATTEMPTS,
+                 queue_ttl=QUEUE_TTL, clock=time.monotonic):
+        self.publish = publish
+        self.on_result = on_result
+        self.ack_timeout = ack_timeout
+        self.max_attempts = max_attempts
+        self.queue_ttl = queue_ttl
+        self.clock = clock
+
+        # device_id -> deque of unfinished commands, oldest first
+        self._outstanding = {}
+        self._offline = set()
+        # Devices that have sent at least one ack
+        self._acking = set()
+        self._history = OrderedDict()
+        self._latencies = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.stats_counters = {
+            'sent': 0, 'retries': 0, 'acked': 0, 'rejected': 0, 'failed': 0,
+            'expired': 0, 'unconfirmed': 0, 'queued_offline': 0, 'unmatched_acks': 0,
+        }
+
+    # --- Sending ---
+    def send(self, device_id, topic, command, user_id=None, legacy=False, source=None):
+        """Queue a command for a device and publish it unless the device is offline"""
+        cmd = Command(device_id, user_id, topic, command, legacy=legacy, source=source,
+                      created_at=self.clock())
+        with self._lock:
+            self._outstanding.setdefault(device_id, deque()).append(cmd)
+            self._remember(cmd)
+            offline = device_id in self._offline
+            if offline:
+                self.stats_counters['queued_offline'] += 1
+        if not offline:
+            self._transmit(cmd)
+        return cmd
+
+    def _transmit(self, cmd):
+        now = self.clock()
+        with self._lock:
+            if cmd.status in FINAL_STATES:
+                return
+            cmd.attempts += 1
+            retry = cmd.attempts > 1
+        published = self.publish(cmd.topic, cmd.payload(), COMMAND_QOS)
+        with self._lock:
+            if not published:
+                # Broker unreachable: not an attempt, try again on the next tick
+                cmd.attempts -= 1
+                return
+            cmd.status = SENT if cmd.status == QUEUED else cmd.status
+            cmd.first_sent_at = cmd.first_sent_at or now
+            cmd.last_sent_at = now
+            self.stats_counters['retries' if retry else 'sent'] += 1
+
+    # --- Device feedback ---
+    def handle_ack(self, device_id, raw_payload):
+        """Settle the command a device acknowledged; returns it, or None"""
+        try:
+            ack = json.loads(raw_payload)
+        except ValueError:
+            ack = None
+        if not isinstance(ack, dict):
+            # Bare "START"/"STOP" from minimal firmware
+            ack = {'command': bytes(raw_payload).decode(errors='replace').strip()}
+
+        now = self.clock()
+        with self._lock:
+            self._acking.add(device_id)
+            cmd = self._match(device_id, ack)
+            if cmd is None:
+                self.stats_counters['unmatched_acks'] += 1
+                return None
+            if ack.get('status', 'ok') == 'ok':
+                cmd.latency = now - (cmd.first_sent_at or cmd.created_at)
+                self._latencies.setdefault(device_id, deque(maxlen=LATENCY_WINDOW)).append(cmd.latency)
+                self._finish(cmd, ACKED, now)
+            else:
+                cmd.error = str(ack.get('error') or ack.get('status'))
+                self._finish(cmd, REJECTED, now)
+        self._notify(cmd)
+        return cmd
+
+    def _match(self, device_id, ack):
+        pending = self._outstanding.get(device_id)
+        if not pending:
+            return None
+        command_id = ack.get('id')
+        for cmd in pending:
+            if command_id is not None:
+                if cmd.id == command_id:
+                    return cmd
+            elif cmd.command == ack.get('command') and cmd.status == SENT:
+                return cmd
+        return None
+
+    def set_online(self, device_id, online):
+        """Track a device's status topic; going online flushes its queued commands"""
+        with self._lock:
+            if not online:
+                self._offline.add(device_id)
+                return
+            self._offline.discard(device_id)
+            queued = [cmd for cmd in self._outstanding.get(device_id, ()) if cmd.status == QUEUED]
+        for cmd in queued:
+            self._transmit(cmd)
+
+    # --- Timeouts ---
+    def tick(self):
+        """Retry, fail or expire overdue commands; returns the commands finished"""
+        now = self.clock()
+        to_send, finished = [], []
+        with self._lock:
+            for device_id, pending in list(self._outstanding.items()):
+                offline = device_id in self._offline
+                for cmd in list(pending):
+                    if cmd.status == QUEUED:
+                        if now - cmd.created_at >= self.queue_ttl:
+                            self._finish(cmd, EXPIRED, now)
+                            finished.append(cmd)
+                        elif not offline:
+                            to_send.append(cmd)
+                    elif now - cmd.last_sent_at >= self.ack_timeout:
+                        if device_id not in self._acking:
+                            self._finish(cmd, UNCONFIRMED, now)
+                            finished.append(cmd)
+                        elif cmd.attempts >= self.max_attempts:
+                            cmd.error = f"No ack after {cmd.attempts} attempts"
+                            self._finish(cmd, FAILED, now)
+                            finished.append(cmd)
+                        elif offline:
+                            # Sent just before the device dropped: resend when it is back
+                            cmd.status = QUEUED
+                        else:
+                            to_send.append(cmd)
+        for cmd in to_send:
+            self._transmit(cmd)
+        for cmd in finished:
+            self._notify(cmd)
+        return finished
+
+    def _finish(self, cmd, status, now):
+        """Move a command to a final state (caller holds the lock)"""
+        cmd.status = status
+        cmd.finished_at = now
+        self.stats_counters[status] += 1
+        pending = self._outstanding.get(cmd.device_id)
+        if pending is not None:
+            pending.remove(cmd)
+            if not pending:
+                del self._outstanding[cmd.device_id]
+        cmd.done.set()
+
+    def _notify(self, cmd):
+        if self.on_result is not None:
+            try:
+                self.on_result(cmd)
+            except Exception as e:
+                log.exception("Commande %s: échec du rappel (%s)", cmd.id, e)
+
+    def _remember(self, cmd):
+        self._history[cmd.id] = cmd
+        while len(self._history) > HISTORY_SIZE:
+            oldest_id, oldest = next(iter(self._history.items()))
+            if oldest.status not in FINAL_STATES:
+                break
+            del self._history[oldest_id]
+
+    # --- Lookups ---
+    def get(self, command_id):
+        with self._lock:
+            return self._history.get(command_id)
+
+    def latency_stats(self):
+        """Ack round-trip percentiles per device, in milliseconds"""
+        with self._lock:
+            samples = {device_id: sorted(values) for device_id, values in self._latencies.items()}
+        return {
+            device_id: {
+                'count': len(values),
+                'p50_ms': round(percentile(values, 0.50) * 1000, 1),
+                'p90_ms': round(percentile(values, 0.90) * 1000, 1),
+                'p99_ms': round(percentile(values, 0.99) * 1000, 1),
+                'max_ms': round(values[-1] * 1000, 1),
+            }
+            for device_id, values in samples.items() if values
+        }
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.stats_counters)
+            stats['outstanding'] = sum(len(pending) for pending in self._outstanding.values())
+            stats['offline_devices'] = len(self._offline)
+        return stats
+
+    # --- Background thread ---
+    def start(self, interval=0.5):
+        """Start the retry/expiry thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, args=(interval,),
+                                            name="command-dispatcher", daemon=True)
+            self._thread.start()
+
+    def close(self, timeout=5):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def _run(self, interval):
+        while not self._stopped.wait(interval):
+            try:
+                self.tick()
+            except Exception as e:
+                log.exception("Répartiteur de commandes: erreur (%s)", e)
@@ -0,0 +1,97 @@
+import sqlite3
+import threading
+
+from app_logging import get_logger
+from telemetry_store import DB_PATH, connect
+from ttl_cache import MISSING, TTLCache
+
+log = get_logger('device_registry')
+
+# Unknown tokens remembered at most: random tokens evict each other
+# instead of growing memory
+MISS_CACHE_SIZE = 10000
+
+
+class DeviceRegistry:
+    """In-memory view of the `devices` table used to resolve MQTT topic tokens.
+
+    The whole table is loaded once; unknown tokens are looked up again at most
+    every `negative_ttl` seconds so a flood of messages from an unregistered
+    device never turns into a flood of SQLite queries. At most
+    `miss_cache_size` unknown tokens are remembered, and lookups share one
+    connection.
+    """
+
+    def __init__(self, db_path=DB_PATH, legacy_tokens=None, negative_ttl=60, miss_cache_size=MISS_CACHE_SIZE):
+        self.db_path = db_path
+        self.negative_ttl = negative_ttl
+        # Tokens accepted without a `devices` row (e.g. the original "esp32" topic)
+        self.legacy_tokens = dict(legacy_tokens or {})
+        self._by_token = {}
+        self._misses = TTLCache(maxsize=miss_cache_size, ttl=negative_ttl)
+        self._lock = threading.Lock()
+        # Lookup connection, shared by the ingest threads
+        self._conn = None
+        self._conn_lock = threading.Lock()
+
+    def load(self):
+        """(Re)load every registered device"""
+        conn = connect(self.db_path)
+        try:
+            rows = conn.execute("SELECT id, user_id, token, plant_name FROM devices").fetchall()
+        except sqlite3.OperationalError as e:
+            log.error("Impossible de charger la table devices: %s", e)
+            rows = []
+        finally:
+            conn.close()
+        by_token = {row[2]: self._to_device(row) for row in rows}
+        with self._lock:
+            self._by_token = by_token
+            self._misses.clear()
+        return len(by_token)
+
+    def resolve(self, token):
+        """Return the device registered for `token`, or None"""
+        device = self._by_token.get(token)
+        if device is not None:
+            return device
+        if token in self.legacy_tokens:
+            return self.legacy_tokens[token]
+
+        if self._misses.get(token) is not MISSING:
+            return None
+
+        with self._conn_lock:
+            if self._conn is None:
+                self._conn = connect(self.db_path)
+            try:
+                row = self._conn.execute(
+                    "SELECT id, user_id, token, plant_name FROM devices WHERE token = ?",
+                    (token,)).fetchone()
+            except sqlite3.OperationalError:
+                row = None
+
+        if row is None:
+            self._misses.set(token, True)
+            return None
+        with self._lock:
+            device = self._by_token[token] = self._to_device(row)
+        return device
+
+    def devices(self):
+        """Every registered device, legacy tokens included"""
+        return list(self._by_token.values()) + list(self.legacy_tokens.values())
+
+    def devices_for_user(self, user_id):
+        """Devices owned by `user_id`"""
+        return [d for d in self.devices() if str(d['user_id']) == str(user_id)]
+
+    @staticmethod
+    def _to_device(row):
+        device_id, user_id, token, plant_name = row
+        return {
+            'device_id': str(device_id),
+            'user_id': user_id,
+            'token': token,
+            'plant_name': plant_name,
+        }
@@ -3,6 +3,8 @@ import time
 import json
 import requests
 import threading
+from sensor_codec import encode_frame
+from sensor_reading import SensorReading
 
 # --- Configuration ---
 MQTT_BROKER_URL = "broker.hivemq.com"
@@ -13,6 +15,10 @@ FLASK_APP_URL = "http://127.0.0.1:5000" # Change if your Flask app runs elsewher
 MQTT_TOPIC_DATA = "irrigateq/esp32/data"
 MQTT_TOPIC_STATUS = "irrigateq/esp32/status"
 MQTT_TOPIC_COMMAND = "irrigateq/flask/command"
+MQTT_TOPIC_ACK = "irrigateq/esp32/ack"
+
+# Send compact binary frames (sensor_codec) instead of JSON
+BINARY_PAYLOADS = False
 
 # Test image to upload
 TEST_IMAGE_PATH = "static/img/image.png" # Make sure this path is correct
@@ -21,7 +27,7 @@ TEST_IMAGE_PATH = "static/img/image.png" # Make sure this path is correct
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
         print("ESP32 Simulator: Connecté au broker MQTT!")
-        client.subscribe(MQTT_TOPIC_COMMAND)
+        client.subscribe(MQTT_TOPIC_COMMAND, qos=1)
         # Publish online status upon connection
         client.publish(MQTT_TOPIC_STATUS, "online", retain=True)
     else:
@@ -29,11 +35,23 @@ def on_connect(client, userdata, flags, rc):
 
 def on_message(client, userdata, msg):
     command = msg.payload.decode()
+    command_id = None
+    # Registered devices get {"id": ..., "command": ...}; the legacy topic sends plain text
+    if command.startswith('{'):
+        message = json.loads(command)
+        command, command_id = message.get('command'), message.get('id')
     print(f"ESP32 Simulator: Commande reçue du backend: '{command}'")
     if command == "START":
         print("--- ACTION: Démarrage de la pompe ---")
     elif command == "STOP":
         print("--- ACTION: Arrêt de la pompe ---")
+    else:
+        return
+    # Acknowledge so the backend can stop retrying and measure the round trip
+    ack = {'command': command, 'status': 'ok'}
+    if command_id:
+        ack['id'] = command_id
+    client.publish(MQTT_TOPIC_ACK, json.dumps(ack), qos=1)
 
 def mqtt_publisher_thread():
     """Publishes sensor data periodically."""
@@ -53,7 +71,11 @@ def mqtt_publisher_thread():
         }
         
         # Publish data
-        client.publish(MQTT_TOPIC_DATA, json.dumps(data))
+        if BINARY_PAYLOADS:
+            reading = SensorReading.from_payload(data, int(time.time()))
+            client.publish(MQTT_TOPIC_DATA, encode_frame([reading]))
+        else:
+            client.publish(MQTT_TOPIC_DATA, json.dumps(data))
         print(f"ESP32 Simulator: Données envoyées: {data}")
         
         # Update moisture for next cycle to test thresholds
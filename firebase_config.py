@@ -1,51 +1,76 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
 import os
 from datetime import datetime
+import base64
+import hmac
 import uuid
+from ttl_cache import TTLCache, MISSING
+from storage import get_backend, set_backend, UserExistsError
+from metrics import timed_storage_call
+from passwords import hash_password, verify_password, needs_rehash
+import request_scope
+
+# Read-through cache for user documents and credential records
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1024))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 60))
+_user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
 
 # Initialize Firebase Admin SDK
 def initialize_firebase():
-    """Initialize Firebase Admin SDK with service account credentials"""
-    try:
-        # Check if Firebase app is already initialized
-        firebase_admin.get_app()
-        print("Firebase already initialized")
-    except ValueError:
-        # Initialize Firebase with service account key
-        # You need to place your serviceAccountKey.json in the project root
-        cred_path = "serviceAccountKey.json"
-        
-        if os.path.exists(cred_path):
-            cred = credentials.Certificate(cred_path)
-            firebase_admin.initialize_app(cred)
-            print("Firebase initialized successfully")
-        else:
-            print(f"Warning: {cred_path} not found. Please add your Firebase service account key.")
-            # For development, you can use default credentials
-            firebase_admin.initialize_app()
-            print("Firebase initialized with default credentials")
+    """Initialize Firebase Admin SDK (only needed by the Firestore backend)"""
+    from storage.firestore_backend import initialize_firebase as _initialize_firebase
+    _initialize_firebase()
 
 # Get Firestore client
 def get_db():
-    """Get Firestore database client"""
-    return firestore.client()
+    """Get Firestore database client (Firestore backend only)"""
+    backend = get_backend()
+    if backend.name != 'firestore':
+        raise RuntimeError(f"get_db() needs the Firestore backend, not '{backend.name}'")
+    return backend.db
+
+def configure_storage(backend):
+    """Switch the storage backend ('firestore', 'memory', 'sqlite' or an instance)"""
+    _user_cache.clear()
+    return set_backend(backend)
+
+def _user_key(user_id):
+    return ('user', user_id)
+
+def _credentials_key(email_or_phone):
+    return ('credentials', email_or_phone)
+
+def invalidate_user_cache(user_id):
+    """Drop a cached user document (and what this request read of the user) after a write"""
+    _user_cache.invalidate(_user_key(user_id))
+    request_scope.forget(lambda key: key[0] != 'credentials' and key[1] == user_id)
+
+def fetch_concurrently(*calls):
+    """Run independent reads of one request, e.g.
+    fetch_concurrently((get_user_by_id, uid), (get_user_notifications, uid, 10));
+    in parallel when the backend does network round trips"""
+    return request_scope.fetch_concurrently(calls, parallel=get_backend().parallel_reads)
+
+def get_user_cache_stats():
+    """Hit/miss counters of the user document cache"""
+    return _user_cache.stats()
 
 # User Management Functions
 def create_user(user_data):
-    """Create a new user in Firestore"""
-    db = get_db()
-    
+    """Create a new user; raises UserExistsError if the email/phone is taken"""
+    # Hashed on the password pool, outside the timed storage call
+    return _store_new_user(user_data, hash_password(user_data['password']))
+
+@timed_storage_call
+def _store_new_user(user_data, password_hash):
     # Generate a unique user ID
     user_id = str(uuid.uuid4())
     
-    # Prepare user document
+    # Prepare user document (the password is only kept, hashed, in the credentials)
     user_doc = {
         'user_id': user_id,
         'nom': user_data['nom'],
         'prenom': user_data['prenom'],
         'email_or_phone': user_data['email_or_phone'],
-        'password': user_data['password'],  # In production, hash this password
         'superficie': user_data['superficie'],
         'plante': user_data['plante'],
         'created_at': datetime.now(),
@@ -55,58 +80,102 @@ def create_user(user_data):
             'min_moisture': 30,
             'max_moisture': 60
         },
-        'notifications': [],
-        'irrigation_events': []
+        'unread_notifications': 0
     }
     
-    # Save to Firestore
-    db.collection('users').document(user_id).set(user_doc)
-    
-    # Also save with email/phone as key for easy login lookup
-    db.collection('user_credentials').document(user_data['email_or_phone']).set({
+    # Save the user and, keyed by email/phone, its login record: everything
+    # a login needs, so it never reads the user document
+    get_backend().create_user(user_doc, {
         'user_id': user_id,
-        'password': user_data['password']
+        'password_hash': password_hash
     })
+    _user_cache.invalidate(_credentials_key(user_data['email_or_phone']))
+    request_scope.forget(lambda key: key == ('credentials', user_data['email_or_phone']))
     
     return user_id
 
-def get_user_by_credentials(email_or_phone, password):
-    """Get user by email/phone and password"""
-    db = get_db()
-    
-    # First, check credentials
-    cred_doc = db.collection('user_credentials').document(email_or_phone).get()
-    
-    if not cred_doc.exists:
+@timed_storage_call
+def get_credentials(email_or_phone):
+    """Login record of an email/phone (served from the user cache when possible)"""
+    cred_data = _user_cache.get(_credentials_key(email_or_phone))
+    if cred_data is MISSING:
+        cred_data = request_scope.memoized(('credentials', email_or_phone),
+                                           lambda: _read('credentials', get_backend().get_credentials, email_or_phone))
+        
+        if cred_data is None:
+            return None
+        
+        _user_cache.set(_credentials_key(email_or_phone), cred_data)
+    return cred_data
+
+def _read(kind, fetch, *args, **kwargs):
+    """One backend read, counted against the current request"""
+    request_scope.count_read(kind)
+    return fetch(*args, **kwargs)
+
+def authenticate(email_or_phone, password):
+    """Session fields ({'user_id': ...}) for a valid login, else None.
+
+    One credential read and one hash check on the password pool; raises
+    PasswordHasherBusy when too many checks are already waiting.
+    """
+    cred_data = get_credentials(email_or_phone)
+    if cred_data is None:
+        # Same cost as a wrong password: response time does not reveal the login exists
+        verify_password(password, None)
         return None
     
-    cred_data = cred_doc.to_dict()
+    if 'password_hash' in cred_data:
+        if not verify_password(password, cred_data['password_hash']):
+            return None
+        if needs_rehash(cred_data['password_hash']):
+            _set_password_hash(email_or_phone, cred_data, password)
+    else:
+        # Plaintext record from before passwords were hashed: hash it now
+        if not hmac.compare_digest(str(cred_data.get('password', '')).encode(), password.encode()):
+            return None
+        _set_password_hash(email_or_phone, cred_data, password)
     
-    if cred_data['password'] != password:
+    return {'user_id': cred_data['user_id']}
+
+def _set_password_hash(email_or_phone, cred_data, password):
+    credentials = {'user_id': cred_data['user_id'], 'password_hash': hash_password(password)}
+    get_backend().set_credentials(email_or_phone, credentials)
+    _user_cache.invalidate(_credentials_key(email_or_phone))
+    request_scope.forget(lambda key: key == ('credentials', email_or_phone))
+    if 'password' in cred_data:
+        # Old user documents carry a plaintext copy too
+        get_backend().update_user(cred_data['user_id'], {'password': None})
+        invalidate_user_cache(cred_data['user_id'])
+
+def get_user_by_credentials(email_or_phone, password):
+    """Get user by email/phone and password"""
+    session_fields = authenticate(email_or_phone, password)
+    if session_fields is None:
         return None
     
     # Get user data
-    user_doc = db.collection('users').document(cred_data['user_id']).get()
-    
-    if not user_doc.exists:
-        return None
-    
-    return user_doc.to_dict()
+    return get_user_by_id(session_fields['user_id'])
 
+@timed_storage_call
 def get_user_by_id(user_id):
-    """Get user by user ID"""
-    db = get_db()
-    user_doc = db.collection('users').document(user_id).get()
-    
-    if not user_doc.exists:
-        return None
+    """Get user by user ID (served from the user cache when possible)"""
+    user = _user_cache.get(_user_key(user_id))
+    if user is MISSING:
+        # Read at most once per request, even if the cache is cold or just invalidated
+        user = request_scope.memoized(('user', user_id), lambda: _read('user', get_backend().get_user, user_id))
+        
+        if user is None:
+            return None
+        
+        _user_cache.set(_user_key(user_id), user)
     
-    return user_doc.to_dict()
+    # Shallow copy so callers cannot alter the cached document
+    return dict(user)
 
+@timed_storage_call
 def update_user_profile(user_id, profile_data):
     """Update user profile"""
-    db = get_db()
-    
     update_data = {
         'nom': profile_data['nom'],
         'prenom': profile_data['prenom'],
@@ -115,99 +184,174 @@ def update_user_profile(user_id, profile_data):
         'updated_at': datetime.now()
     }
     
-    db.collection('users').document(user_id).update(update_data)
+    get_backend().update_user(user_id, update_data)
+    invalidate_user_cache(user_id)
 
+@timed_storage_call
 def update_user_thresholds(user_id, thresholds_data):
     """Update user irrigation thresholds"""
-    db = get_db()
-    
     update_data = {
         'thresholds': thresholds_data,
         'updated_at': datetime.now()
     }
     
-    db.collection('users').document(user_id).update(update_data)
+    get_backend().update_user(user_id, update_data)
+    invalidate_user_cache(user_id)
 
-def add_notification(user_id, notification_text):
-    """Add a notification to user's notification history"""
-    db = get_db()
-    
-    notification = {
-        'id': str(uuid.uuid4()),
+def _new_notification(notification_text, notification_id=None, timestamp=None):
+    return {
+        'id': notification_id or str(uuid.uuid4()),
         'text': notification_text,
-        'timestamp': datetime.now(),
+        'timestamp': timestamp or datetime.now(),
         'read': False
     }
+
+@timed_storage_call
+def add_notification(user_id, notification_text):
+    """Add a notification to the user's notifications"""
+    # Stored together with the unread counter increment
+    get_backend().add_notification(user_id, _new_notification(notification_text))
+    invalidate_user_cache(user_id)
+
+def _encode_cursor(document):
+    """Opaque pagination cursor after a document: its timestamp and ID, so
+    documents sharing the timestamp are not skipped"""
+    return base64.urlsafe_b64encode(f"{document['timestamp'].isoformat()}|{document['id']}".encode()).decode()
+
+def _decode_cursor(cursor):
+    """(timestamp, id) bound of a cursor, or None if it is malformed"""
+    try:
+        timestamp, _, doc_id = base64.urlsafe_b64decode(cursor.encode()).decode().partition('|')
+        # Cursors from before the ID was added: every document of that timestamp is after ''
+        return datetime.fromisoformat(timestamp), doc_id
+    except ValueError:
+        return None
+
+@timed_storage_call
+def get_notifications_page(user_id, limit=50, cursor=None):
+    """Get one page of notifications (newest first) and the cursor of the next page"""
+    before = _decode_cursor(cursor) if cursor else None
     
-    # Add to user's notifications array
-    user_ref = db.collection('users').document(user_id)
-    user_ref.update({
-        'notifications': firestore.ArrayUnion([notification])
-    })
+    # Fetch one extra document to know whether another page exists
+    docs = request_scope.memoized(
+        ('notifications', user_id, limit, cursor),
+        lambda: _read('notifications', get_backend().notifications_page, user_id, limit + 1, before=before))
+    notifications = docs[:limit]
+    next_cursor = None
+    if len(docs) > limit:
+        next_cursor = _encode_cursor(notifications[-1])
+    return notifications, next_cursor
 
 def get_user_notifications(user_id, limit=50):
-    """Get user's notifications"""
-    db = get_db()
-    user_doc = db.collection('users').document(user_id).get()
-    
-    if not user_doc.exists:
-        return []
-    
-    user_data = user_doc.to_dict()
-    notifications = user_data.get('notifications', [])
-    
-    # Sort by timestamp (newest first) and limit
-    notifications.sort(key=lambda x: x['timestamp'], reverse=True)
-    return notifications[:limit]
+    """Get user's latest notifications"""
+    notifications, _ = get_notifications_page(user_id, limit=limit)
+    return notifications
 
-def add_irrigation_event(user_id, event_type, details=None):
-    """Add an irrigation event to user's history"""
-    db = get_db()
-    
-    event = {
-        'id': str(uuid.uuid4()),
+def get_unread_notification_count(user_id):
+    """Number of unread notifications, kept as a counter on the user document"""
+    user = get_user_by_id(user_id)
+    if not user:
+        return 0
+    return max(user.get('unread_notifications', 0), 0)
+
+@timed_storage_call
+def mark_all_notifications_read(user_id):
+    """Mark every unread notification as read and reset the unread counter"""
+    get_backend().mark_all_notifications_read(user_id)
+    invalidate_user_cache(user_id)
+
+@timed_storage_call
+def list_user_ids():
+    """IDs of every stored user"""
+    return _read('user_ids', get_backend().list_user_ids)
+
+@timed_storage_call
+def migrate_notifications_to_subcollection(user_id):
+    """Move a legacy `notifications` array into the subcollection"""
+    legacy = get_backend().migrate_legacy_array(user_id, 'notifications', unread_counter=True)
+    invalidate_user_cache(user_id)
+    return len(legacy)
+
+# Event types accepted by the irrigation event log
+IRRIGATION_EVENT_TYPES = ('start', 'stop', 'auto_start', 'auto_stop')
+
+def _new_irrigation_event(event_type, details=None, event_id=None, timestamp=None):
+    return {
+        'id': event_id or str(uuid.uuid4()),
         'type': event_type,  # 'start', 'stop', 'auto_start', 'auto_stop'
-        'timestamp': datetime.now(),
+        'timestamp': timestamp or datetime.now(),
         'details': details or {}
     }
-    
-    # Add to user's irrigation events array
-    user_ref = db.collection('users').document(user_id)
-    user_ref.update({
-        'irrigation_events': firestore.ArrayUnion([event])
-    })
 
-def get_irrigation_events(user_id, limit=100):
-    """Get user's irrigation events history"""
-    db = get_db()
-    user_doc = db.collection('users').document(user_id).get()
-    
-    if not user_doc.exists:
-        return []
+@timed_storage_call
+def add_irrigation_event(user_id, event_type, details=None):
+    """Append an irrigation event to the user's `irrigation_events` log"""
+    event = _new_irrigation_event(event_type, details)
+    get_backend().add_irrigation_event(user_id, event)
+    return event['id']
+
+@timed_storage_call
+def get_irrigation_events_page(user_id, limit=100, cursor=None, start=None, end=None, event_types=None):
+    """Get one page of irrigation events (newest first) and the cursor of the next page.
+    `start`/`end` bound the timestamp range and `event_types` filters on `type`."""
+    before = _decode_cursor(cursor) if cursor else None
+    docs = request_scope.memoized(
+        ('irrigation_events', user_id, limit, cursor, start, end, tuple(event_types or ())),
+        lambda: _read('irrigation_events', get_backend().irrigation_events_page,
+                      user_id, limit + 1, before=before, start=start, end=end, event_types=event_types))
+    events = docs[:limit]
+    next_cursor = None
+    if len(docs) > limit:
+        next_cursor = _encode_cursor(events[-1])
+    return events, next_cursor
+
+def get_irrigation_events(user_id, limit=100, start=None, end=None, event_types=None):
+    """Get user's latest irrigation events"""
+    events, _ = get_irrigation_events_page(
+        user_id, limit=limit, start=start, end=end, event_types=event_types)
+    return events
+
+@timed_storage_call
+def migrate_irrigation_events_to_subcollection(user_id):
+    """Move a legacy `irrigation_events` array into the subcollection"""
+    legacy = get_backend().migrate_legacy_array(user_id, 'irrigation_events')
+    invalidate_user_cache(user_id)
+    return len(legacy)
+
+@timed_storage_call
+def apply_writes(writes):
+    """Apply writes queued by write_behind.WriteBehindQueue as one batch.
+    Document IDs come from the write IDs, so replaying a batch is idempotent."""
+    batch = []
+    touched_users = set()
     
-    user_data = user_doc.to_dict()
-    events = user_data.get('irrigation_events', [])
+    for write in writes:
+        args = write['args']
+        timestamp = datetime.fromisoformat(args['timestamp']) if args.get('timestamp') else None
+        if write['op'] == 'add_notification':
+            notification = _new_notification(args['text'], write['id'], timestamp)
+            batch.append(('add_notification', args['user_id'], notification))
+            touched_users.add(args['user_id'])
+        elif write['op'] == 'add_irrigation_event':
+            event = _new_irrigation_event(args['event_type'], args.get('details'), write['id'], timestamp)
+            batch.append(('add_irrigation_event', args['user_id'], event))
+        else:
+            raise ValueError(f"Unknown write operation: {write['op']}")
     
-    # Sort by timestamp (newest first) and limit
-    events.sort(key=lambda x: x['timestamp'], reverse=True)
-    return events[:limit]
+    get_backend().apply_writes(batch)
+    for user_id in touched_users:
+        invalidate_user_cache(user_id)
 
+def is_permanent_write_error(error):
+    """Whether a queued write failed in a way retrying cannot fix"""
+    return isinstance(error, get_backend().permanent_errors)
+
+@timed_storage_call
 def check_user_exists(email_or_phone):
     """Check if a user with given email/phone already exists"""
-    db = get_db()
-    doc = db.collection('user_credentials').document(email_or_phone).get()
-    return doc.exists
+    return _read('credentials', get_backend().credentials_exist, email_or_phone)
 
+@timed_storage_call
 def test_connection():
-    """Test Firebase connection by attempting to access Firestore"""
-    try:
-        db = get_db()
-        # Try to access a collection to test connection
-        db.collection('test').limit(1).get()
-        return True
-    except Exception as e:
-        print(f"Connection test failed: {e}")
-        return False
-
-# Initialize Firebase when module is imported
-initialize_firebase() 
\ No newline at end of file
+    """Test the storage connection"""
+    return get_backend().test_connection()
@@ -0,0 +1,198 @@
+"""HTTP validators, Cache-Control and compression for the app's responses.
+
+`HTTPCache.finalize()` runs after every request. It compresses text
+responses (JSON, HTML, CSS, JS) above `min_size` with brotli when the
+package is installed and the client accepts it, otherwise with gzip. It
+also sets the route's Cache-Control when the view did not set one.
+Bodies that carry an ETag identify their own content, so their
+compressed form is kept and reused; for static files it is compressed
+once.
+
+Views use `conditional()` to answer a matching If-None-Match or
+If-Modified-Since with a 304 before building the body, and
+`send_static()` to send files with an ETag hashed from their content
+(the same bytes give the same ETag on every worker and after a deploy).
+"""
+import gzip
+import hashlib
+import os
+import threading
+
+from flask import Response, abort, make_response, request, send_file
+from werkzeug.http import is_resource_modified
+from werkzeug.security import safe_join
+
+from ttl_cache import MISSING, TTLCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Smaller bodies are sent as they are: compressing them saves less than a packet
+COMPRESS_MIN_SIZE = 1024
+
+# Files above this size are streamed uncompressed rather than read into memory
+COMPRESS_MAX_FILE_SIZE = 4 * 1024 * 1024
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Mimetypes worth compressing (images are already compressed)
+COMPRESSIBLE_MIMETYPES = {
+    'application/javascript', 'application/json', 'application/manifest+json',
+    'image/svg+xml', 'text/css', 'text/html', 'text/javascript', 'text/plain',
+}
+
+# Cache-Control per route class. Pages and APIs are per user and change at
+# any time: browsers keep them but revalidate (a 304 when unchanged).
+# Static URLs carry no version, so they are only trusted for a while;
+# the service worker is always revalidated so a new version installs at once.
+CACHE_CONTROL = {
+    'page': 'private, no-cache',
+    'api': 'private, no-cache',
+    'static': 'public, max-age=3600',
+    'manifest': 'public, max-age=86400',
+    'icon': 'public, max-age=604800',
+    'service_worker': 'no-cache',
+}
+
+
+def etag_for(*parts):
+    """Short ETag value identifying `parts` (compared by their repr)"""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:20]
+
+
+def _compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class HTTPCache:
+    """Conditional responses, content ETags for files and response compression"""
+
+    def __init__(self, min_size=COMPRESS_MIN_SIZE, max_file_size=COMPRESS_MAX_FILE_SIZE):
+        self.min_size = min_size
+        self.max_file_size = max_file_size
+        self.encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+        # (path, mtime, size) -> content hash
+        self._file_etags = TTLCache(maxsize=256, ttl=3600)
+        # (path, etag, encoding) -> compressed body
+        self._compressed = TTLCache(maxsize=256, ttl=3600)
+        self._lock = threading.Lock()
+        self.stats_counters = {'not_modified': 0, 'compressed': 0, 'compressed_reused': 0,
+                               'bytes_in': 0, 'bytes_out': 0}
+
+    def _count(self, **counts):
+        with self._lock:
+            for name, n in counts.items():
+                self.stats_counters[name] += n
+
+    # --- Validators ---
+    def conditional(self, etag, build, last_modified=None, cache_class='api'):
+        """A 304 if the client's copy matches `etag` (or `last_modified`),
+        else build()'s response with these validators"""
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            response = Response(status=304)
+        else:
+            response = make_response(build())
+        response.set_etag(etag)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        response.headers['Cache-Control'] = CACHE_CONTROL[cache_class]
+        return response
+
+    def file_etag(self, path):
+        """SHA-256 of a file's content, recomputed only when it changes on disk"""
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        etag = self._file_etags.get(key)
+        if etag is MISSING:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(65536), b''):
+                    digest.update(chunk)
+            etag = digest.hexdigest()[:32]
+            self._file_etags.set(key, etag)
+        return etag
+
+    def send_static(self, directory, filename, cache_class='static'):
+        """Send a file below `directory` with a content ETag, or 404"""
+        path = safe_join(directory, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        response = send_file(path, etag=self.file_etag(path), conditional=True)
+        response.headers['Cache-Control'] = CACHE_CONTROL[cache_class]
+        return response
+
+    # --- After every request ---
+    def finalize(self, response):
+        """Set the default Cache-Control and compress the body if worth it"""
+        if response.status_code == 304:
+            self._count(not_modified=1)
+        if response.status_code not in (200, 304):
+            return response
+        if 'Cache-Control' not in response.headers:
+            # Views sending files or using conditional() set their own
+            if response.mimetype == 'text/html':
+                response.headers['Cache-Control'] = CACHE_CONTROL['page']
+            elif response.mimetype == 'application/json':
+                response.headers['Cache-Control'] = CACHE_CONTROL['api']
+
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES or 'Content-Encoding' in response.headers:
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(self.encodings)
+        if encoding is None:
+            return response
+        # Weak whether or not this body ends up compressed, so a 304 and the
+        # 200 it confirms carry the same validator
+        self._weaken_etag(response)
+        if response.status_code == 304 or request.method == 'HEAD':
+            return response
+        if response.direct_passthrough:
+            # A file from send_file(): only read it into memory when small
+            if response.content_length is None or response.content_length > self.max_file_size:
+                return response
+        elif response.is_streamed:
+            return response
+
+        etag, _ = response.get_etag()
+        key = (request.path, etag, encoding) if etag else None
+        body = self._compressed.get(key) if key else MISSING
+        if body is not MISSING:
+            self._count(compressed_reused=1)
+            size = response.content_length
+            response.close()
+        else:
+            response.direct_passthrough = False
+            data = response.get_data()
+            size = len(data)
+            if size < self.min_size:
+                return response
+            body = _compress(data, encoding)
+            if key:
+                self._compressed.set(key, body)
+        response.direct_passthrough = False
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        # Byte ranges would refer to the identity body
+        response.headers.pop('Accept-Ranges', None)
+        self._count(compressed=1, bytes_in=size or 0, bytes_out=len(body))
+        return response
+
+    @staticmethod
+    def _weaken_etag(response):
+        # The encoded bytes differ from the identity ones: a strong ETag
+        # would promise byte equality between the two
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.stats_counters)
+        stats['file_etags'] = self._file_etags.stats()['size']
+        stats['compressed_bodies'] = self._compressed.stats()['size']
+        return stats
@@ -0,0 +1,328 @@
+import contextlib
+import os
+import threading
+import time
+from collections import deque
+
+from image_store import split_blob_name
+from telemetry_store import DB_PATH, connect
+
+# Same folder as app.UPLOAD_FOLDER
+UPLOAD_FOLDER = 'static/uploads'
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+
+# Images remembered per user/device for "last N images" lookups
+RECENT_IMAGES = 100
+
+# One row per upload; `blob` is the content-addressed file (NULL for files
+# saved under their upload name before blobs existed)
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    filename TEXT PRIMARY KEY,
+    user_id TEXT,
+    device_id TEXT,
+    uploaded_at REAL NOT NULL,
+    blob TEXT,
+    size INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_images_uploaded_at ON images (uploaded_at);
+CREATE TABLE IF NOT EXISTS image_deletions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    filename TEXT NOT NULL,
+    deleted_at REAL NOT NULL
+);
+"""
+
+# Seconds removed filenames stay in `image_deletions` for the other
+# processes to drop; one that falls further behind reloads the index
+DELETION_RETENTION = 86400
+
+# Created after the migrations, since `blob` may not exist before them
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_images_blob ON images (blob);
+"""
+
+# Columns added after the table was first created
+MIGRATIONS = {
+    'blob': "ALTER TABLE images ADD COLUMN blob TEXT",
+    'size': "ALTER TABLE images ADD COLUMN size INTEGER",
+}
+
+COLUMNS = "filename, user_id, device_id, uploaded_at, blob, size"
+
+# Index key of the images nobody owns (anonymous device uploads)
+UNOWNED = None
+
+
+def _user_key(user_id):
+    return ('user', str(user_id) if user_id is not None else UNOWNED)
+
+
+def _device_key(device_id):
+    return ('device', str(device_id))
+
+
+class ImageIndex:
+    """Newest uploaded images per user and per device, kept in memory.
+
+    The `images` table is read once on first use (and the upload folder is
+    scanned once if the table is still empty); after that, `add()` keeps both
+    the table and the index current, so lookups never touch the filesystem.
+    When other processes write the table too, set `refresh_interval`: lookups
+    then catch up at most that often, reading only the rows added since
+    (rowid) and the filenames `remove()` logged in `image_deletions`.
+    """
+
+    def __init__(self, db_path=DB_PATH, upload_folder=UPLOAD_FOLDER, recent_images=RECENT_IMAGES,
+                 refresh_interval=None):
+        self.db_path = db_path
+        self.upload_folder = upload_folder
+        self.recent_images = recent_images
+        self.refresh_interval = refresh_interval
+        self._windows = {}
+        self._by_filename = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        # Last images rowid and image_deletions id applied to the index
+        self._last_rowid = 0
+        self._last_deletion = 0
+        self._checked_at = 0.0
+
+    # --- Loading ---
+    def load(self):
+        """(Re)build the index from the `images` table"""
+        conn = connect(self.db_path)
+        try:
+            conn.executescript(SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(images)")}
+            for column, statement in MIGRATIONS.items():
+                if column not in columns:
+                    conn.execute(statement)
+            conn.executescript(INDEXES)
+            rows = conn.execute(f"SELECT {COLUMNS} FROM images ORDER BY uploaded_at").fetchall()
+            if not rows:
+                rows = self._backfill(conn)
+            last_rowid, last_deletion = self._positions(conn)
+        finally:
+            conn.close()
+
+        windows, by_filename = {}, {}
+        for row in rows:
+            image = self._to_image(row)
+            by_filename[image['filename']] = image
+            self._index(windows, image)
+        with self._lock:
+            self._windows = windows
+            self._by_filename = by_filename
+            self._loaded = True
+            self._last_rowid = last_rowid
+            self._last_deletion = last_deletion
+            self._checked_at = time.monotonic()
+        return len(rows)
+
+    @staticmethod
+    def _positions(conn):
+        """Last images rowid and last image_deletions id ever assigned"""
+        last_rowid = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM images").fetchone()[0]
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'image_deletions'").fetchone()
+        return last_rowid, row[0] if row else 0
+
+    def _backfill(self, conn):
+        """Register files uploaded before the table existed, as unowned images"""
+        if not os.path.isdir(self.upload_folder):
+            return []
+        rows = []
+        for entry in os.scandir(self.upload_folder):
+            extension = entry.name.rsplit('.', 1)[-1].lower()
+            # Blobs are always recorded by add(); dot files are uploads in progress
+            if entry.name.startswith('.') or split_blob_name(entry.name) is not None:
+                continue
+            if entry.is_file() and '.' in entry.name and extension in IMAGE_EXTENSIONS:
+                stat = entry.stat()
+                rows.append((entry.name, None, None, stat.st_mtime, None, stat.st_size))
+        rows.sort(key=lambda row: row[3])
+        with conn:
+            conn.executemany(f"INSERT OR IGNORE INTO images ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)", rows)
+        return rows
+
+    def ensure_loaded(self):
+        """Load the index (and create the table) unless already done"""
+        if not self._loaded:
+            self.load()
+        elif self.refresh_interval is not None and time.monotonic() - self._checked_at >= self.refresh_interval:
+            self.refresh()
+
+    def refresh(self):
+        """Apply the rows added and removed by other processes since the last
+        load or refresh"""
+        self._checked_at = time.monotonic()
+        conn = connect(self.db_path)
+        try:
+            # One snapshot for the three reads
+            conn.execute("BEGIN")
+            rows = conn.execute(f"SELECT rowid, {COLUMNS} FROM images WHERE rowid > ? ORDER BY rowid",
+                                (self._last_rowid,)).fetchall()
+            deletions = conn.execute("SELECT id, filename FROM image_deletions WHERE id > ? ORDER BY id",
+                                     (self._last_deletion,)).fetchall()
+            _, last_deletion = self._positions(conn)
+        finally:
+            conn.close()
+        if len(deletions) != last_deletion - self._last_deletion:
+            # Deletions were pruned before this process saw them
+            self.load()
+            return
+
+        with self._lock:
+            for row in rows:
+                image = self._to_image(row[1:])
+                # Rows added by this process are already indexed
+                if image['filename'] not in self._by_filename:
+                    self._by_filename[image['filename']] = image
+                    self._index(self._windows, image)
+            for _, filename in deletions:
+                image = self._by_filename.pop(filename, None)
+                if image is not None:
+                    self._unindex(image)
+            if rows:
+                self._last_rowid = max(self._last_rowid, rows[-1][0])
+            self._last_deletion = max(self._last_deletion, last_deletion)
+
+    # --- Writes ---
+    @contextlib.contextmanager
+    def write_transaction(self):
+        """Connection holding the database write lock (BEGIN IMMEDIATE) until
+        the block ends; committed unless the block raises. Serializes checks
+        on blobs with the other processes using the same database."""
+        self.ensure_loaded()
+        conn = connect(self.db_path)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+        finally:
+            conn.close()
+
+    def add(self, filename, user_id=None, device_id=None, uploaded_at=None, blob=None, size=None, conn=None):
+        """Record a stored upload and return its index entry; raises
+        sqlite3.IntegrityError if `filename` is already recorded. With `conn`
+        (from write_transaction()) the row is written in that transaction."""
+        self.ensure_loaded()
+        image = self._to_image((filename, user_id, device_id,
+                                uploaded_at if uploaded_at is not None else time.time(), blob, size))
+        row = (image['filename'], image['user_id'], image['device_id'], image['uploaded_at'],
+               image['blob'], image['size'])
+        if conn is not None:
+            conn.execute(f"INSERT INTO images ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)", row)
+        else:
+            conn = connect(self.db_path)
+            try:
+                with conn:
+                    conn.execute(f"INSERT INTO images ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)", row)
+            finally:
+                conn.close()
+        with self._lock:
+            self._by_filename[filename] = image
+            self._index(self._windows, image)
+        return image
+
+    def remove(self, filenames):
+        """Delete upload records; returns the stored files no record refers to anymore"""
+        self.ensure_loaded()
+        filenames = list(filenames)
+        if not filenames:
+            return []
+        conn = connect(self.db_path)
+        try:
+            with conn:
+                placeholders = ', '.join('?' for _ in filenames)
+                stored = {row[0] for row in conn.execute(
+                    f"SELECT COALESCE(blob, filename) FROM images WHERE filename IN ({placeholders})", filenames)}
+                conn.execute(f"DELETE FROM images WHERE filename IN ({placeholders})", filenames)
+                # Logged for the other processes' refresh()
+                now = time.time()
+                conn.executemany("INSERT INTO image_deletions (filename, deleted_at) VALUES (?, ?)",
+                                 [(filename, now) for filename in filenames])
+                conn.execute("DELETE FROM image_deletions WHERE deleted_at < ?", (now - DELETION_RETENTION,))
+            orphans = [name for name in stored if self._refcount(conn, name) == 0]
+        finally:
+            conn.close()
+        with self._lock:
+            for filename in filenames:
+                image = self._by_filename.pop(filename, None)
+                if image is not None:
+                    self._unindex(image)
+        return orphans
+
+    def refcount(self, stored_name, conn=None):
+        """Number of upload records using a stored file"""
+        if conn is not None:
+            return self._refcount(conn, stored_name)
+        conn = connect(self.db_path)
+        try:
+            return self._refcount(conn, stored_name)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _refcount(conn, stored_name):
+        return conn.execute(
+            "SELECT COUNT(*) FROM images WHERE blob = ? OR (blob IS NULL AND filename = ?)",
+            (stored_name, stored_name)).fetchone()[0]
+
+    @staticmethod
+    def _keys(image):
+        keys = [('all',), _user_key(image['user_id'])]
+        if image['device_id'] is not None:
+            keys.append(_device_key(image['device_id']))
+        return keys
+
+    def _unindex(self, image):
+        for key in self._keys(image):
+            window = self._windows.get(key)
+            if window is not None and image in window:
+                window.remove(image)
+
+    def _index(self, windows, image):
+        for key in self._keys(image):
+            window = windows.get(key)
+            if window is None:
+                window = windows[key] = deque(maxlen=self.recent_images)
+            window.append(image)
+
+    # --- Reads ---
+    def recent(self, user_id=None, device_id=None, limit=10, unowned=False):
+        """Newest images first, for a device, a user, the unowned uploads or everyone"""
+        self.ensure_loaded()
+        if device_id is not None:
+            key = _device_key(device_id)
+        elif user_id is not None or unowned:
+            key = _user_key(user_id)
+        else:
+            key = ('all',)
+        with self._lock:
+            window = self._windows.get(key)
+            if not window:
+                return []
+            count = min(limit, len(window))
+            return [window[-i] for i in range(1, count + 1)]
+
+    def latest(self, user_id=None, device_id=None, unowned=False):
+        """Newest image for the same scopes as `recent()`, or None"""
+        images = self.recent(user_id=user_id, device_id=device_id, limit=1, unowned=unowned)
+        return images[0] if images else None
+
+    @staticmethod
+    def _to_image(row):
+        filename, user_id, device_id, uploaded_at, blob, size = row
+        return {
+            'filename': filename,
+            'user_id': str(user_id) if user_id is not None else None,
+            'device_id': str(device_id) if device_id is not None else None,
+            'uploaded_at': uploaded_at,
+            'blob': blob,
+            'size': size,
+        }
@@ -0,0 +1,200 @@
+import os
+import threading
+import time
+
+from app_logging import get_logger
+from telemetry_store import connect
+
+log = get_logger('image_retention')
+
+DAY = 86400
+
+# Default limits applied to every user and every device (0 disables a limit)
+MAX_IMAGES = int(os.environ.get('RETENTION_MAX_IMAGES', 5000))
+MAX_BYTES = int(os.environ.get('RETENTION_MAX_BYTES', 2 * 1024 ** 3))
+MAX_AGE = float(os.environ.get('RETENTION_MAX_AGE_DAYS', 365)) * DAY
+
+# Past this age only the newest frame of each day is kept
+DOWNSAMPLE_AFTER = float(os.environ.get('RETENTION_DOWNSAMPLE_AFTER_DAYS', 30)) * DAY
+DOWNSAMPLE_BUCKET = DAY
+
+# Evictions per pass; a pass that hits the limit runs again after a short pause
+EVICTION_BATCH = 100
+RETENTION_INTERVAL = 300
+BACKLOG_PAUSE = 1.0
+
+# Each upload is ranked within its user and its device, newest first
+CANDIDATES_SQL = """
+SELECT filename, scope, uploaded_at,
+    ROW_NUMBER() OVER (PARTITION BY scope ORDER BY uploaded_at DESC) AS rank,
+    SUM(COALESCE(size, 0)) OVER (
+        PARTITION BY scope ORDER BY uploaded_at DESC ROWS UNBOUNDED PRECEDING) AS running_bytes,
+    ROW_NUMBER() OVER (
+        PARTITION BY scope, CAST(uploaded_at / ? AS INTEGER) ORDER BY uploaded_at DESC) AS bucket_rank
+FROM (SELECT filename, uploaded_at, size, {column} AS scope FROM images {where})
+ORDER BY uploaded_at
+"""
+
+SCOPES = {
+    'user': ('user_id', ''),
+    'device': ('device_id', 'WHERE device_id IS NOT NULL'),
+}
+
+
+class RetentionPolicy:
+    """Limits for one user or device; None or 0 disables a limit"""
+
+    __slots__ = ('max_images', 'max_bytes', 'max_age', 'downsample_after')
+
+    def __init__(self, max_images=MAX_IMAGES, max_bytes=MAX_BYTES, max_age=MAX_AGE,
+                 downsample_after=DOWNSAMPLE_AFTER):
+        self.max_images = max_images
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.downsample_after = downsample_after
+
+    def reason(self, now, uploaded_at, rank, running_bytes, bucket_rank):
+        """Why an upload must go, or None to keep it"""
+        age = now - uploaded_at
+        if self.max_age and age > self.max_age:
+            return 'age'
+        if self.max_images and rank > self.max_images:
+            return 'count'
+        if self.max_bytes and running_bytes > self.max_bytes:
+            return 'bytes'
+        if self.downsample_after and age > self.downsample_after and bucket_rank > 1:
+            return 'downsample'
+        return None
+
+
+class RetentionManager:
+    """Background eviction of uploaded images over their user/device quotas.
+
+    Candidates are ranked in SQL from the `images` table, never by scanning
+    the upload folder. Each pass deletes at most `batch_size` uploads, then
+    deletes the blobs (and thumbnails) no remaining upload refers to.
+    """
+
+    def __init__(self, image_index, image_store, policy=None, interval=RETENTION_INTERVAL,
+                 batch_size=EVICTION_BATCH, clock=time.time):
+        self.image_index = image_index
+        self.image_store = image_store
+        self.policy = policy or RetentionPolicy()
+        self.interval = interval
+        self.batch_size = batch_size
+        self.clock = clock
+
+        # (scope kind, id) -> RetentionPolicy overriding the default
+        self._overrides = {}
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.stats_counters = {
+            'runs': 0, 'evicted': 0, 'evicted_age': 0, 'evicted_count': 0,
+            'evicted_bytes': 0, 'evicted_downsample': 0, 'blobs_deleted': 0,
+            'bytes_freed': 0, 'backlog': 0, 'last_run_seconds': 0.0, 'errors': 0,
+        }
+
+    # --- Policies ---
+    def set_policy(self, kind, scope_id, policy):
+        """Override the default policy for one user ('user') or device ('device')"""
+        if kind not in SCOPES:
+            raise ValueError(f"Unknown retention scope: {kind}")
+        with self._lock:
+            if policy is None:
+                self._overrides.pop((kind, str(scope_id)), None)
+            else:
+                self._overrides[(kind, str(scope_id))] = policy
+
+    def policy_for(self, kind, scope_id):
+        with self._lock:
+            return self._overrides.get((kind, str(scope_id) if scope_id is not None else None), self.policy)
+
+    # --- Eviction ---
+    def plan(self, now=None, limit=None):
+        """Uploads to evict, oldest first, as {filename: reason}"""
+        now = now if now is not None else self.clock()
+        limit = limit or self.batch_size
+        evictions = {}
+        self.image_index.ensure_loaded()
+        conn = connect(self.image_index.db_path)
+        try:
+            for kind, (column, where) in SCOPES.items():
+                rows = conn.execute(CANDIDATES_SQL.format(column=column, where=where), (DOWNSAMPLE_BUCKET,))
+                for filename, scope_id, uploaded_at, rank, running_bytes, bucket_rank in rows:
+                    if filename in evictions:
+                        continue
+                    reason = self.policy_for(kind, scope_id).reason(
+                        now, uploaded_at, rank, running_bytes, bucket_rank)
+                    if reason is not None:
+                        evictions[filename] = reason
+                        if len(evictions) > limit:
+                            return evictions
+        finally:
+            conn.close()
+        return evictions
+
+    def run_once(self, now=None):
+        """Run one eviction pass; returns the number of uploads evicted"""
+        with self._run_lock:
+            started = time.perf_counter()
+            evictions = self.plan(now, limit=self.batch_size)
+            # plan() looks one past the batch to know whether work is left
+            backlog = len(evictions) > self.batch_size
+            batch = dict(list(evictions.items())[:self.batch_size])
+
+            freed = deleted = 0
+            with self.image_store.lock:
+                orphans = self.image_index.remove(batch)
+                for name in orphans:
+                    # An upload, maybe in another worker, may have reused the blob since the
+                    # records were removed; uploads record it in the same kind of transaction
+                    with self.image_index.write_transaction() as conn:
+                        if self.image_index.refcount(name, conn) == 0:
+                            freed += self.image_store.delete(name)
+                            deleted += 1
+
+            with self._lock:
+                stats = self.stats_counters
+                stats['runs'] += 1
+                stats['evicted'] += len(batch)
+                for reason in batch.values():
+                    stats['evicted_' + reason] += 1
+                stats['blobs_deleted'] += deleted
+                stats['bytes_freed'] += freed
+                stats['backlog'] = int(backlog)
+                stats['last_run_seconds'] = round(time.perf_counter() - started, 4)
+            if batch:
+                log.info("Rétention: %d images supprimées, %d octets libérés", len(batch), freed)
+            return len(batch)
+
+    # --- Background thread ---
+    def start(self):
+        """Start the background retention thread"""
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="image-retention", daemon=True)
+            self._thread.start()
+
+    def close(self, timeout=5):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                log.exception("Rétention: échec du passage (%s)", e)
+                with self._lock:
+                    self.stats_counters['errors'] += 1
+            # Work through a backlog in small steps instead of one long pass
+            pause = BACKLOG_PAUSE if self.stats_counters['backlog'] else self.interval
+            self._stopped.wait(pause)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.stats_counters)
@@ -0,0 +1,184 @@
+import hashlib
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app_logging import get_logger
+
+log = get_logger('image_store')
+
+# Same folder as app.UPLOAD_FOLDER; blobs are named <sha256>.<ext>
+UPLOAD_FOLDER = 'static/uploads'
+THUMBNAIL_DIR = 'thumbs'
+
+# Uploads are hashed and written in chunks of this size
+CHUNK_SIZE = 64 * 1024
+
+# Dashboard-sized WebP thumbnails
+THUMBNAIL_SIZE = (480, 480)
+THUMBNAIL_QUALITY = 75
+THUMBNAIL_WORKERS = 2
+
+
+def blob_name(sha256, extension):
+    return f"{sha256}.{extension.lower()}"
+
+
+def split_blob_name(name):
+    """Return (sha256, extension) for a blob name, or None if it is not one"""
+    sha256, _, extension = name.partition('.')
+    if len(sha256) != 64 or not extension or any(c not in '0123456789abcdef' for c in sha256):
+        return None
+    return sha256, extension
+
+
+class ImageStore:
+    """Content-addressed image blobs with thumbnails made in a worker pool.
+
+    A blob's name is the SHA-256 of its bytes, so identical frames are stored
+    once and a blob never changes, which lets it be cached forever.
+    """
+
+    def __init__(self, root=UPLOAD_FOLDER, thumbnail_size=THUMBNAIL_SIZE,
+                 thumbnail_quality=THUMBNAIL_QUALITY, workers=THUMBNAIL_WORKERS):
+        self.root = root
+        self.thumbnail_size = thumbnail_size
+        self.thumbnail_quality = thumbnail_quality
+        self.workers = workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        # Held while a blob is created or reused and recorded, or checked and
+        # deleted, so retention never removes a blob an upload just reused.
+        # Only within this process: across workers, both sides also run in an
+        # ImageIndex.write_transaction()
+        self.lock = threading.RLock()
+        self.stats_counters = {'stored': 0, 'deduplicated': 0, 'deleted': 0, 'thumbnails': 0, 'thumbnail_errors': 0}
+
+    @property
+    def thumbnail_root(self):
+        return os.path.join(self.root, THUMBNAIL_DIR)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def thumbnail_path(self, sha256):
+        return os.path.join(self.thumbnail_root, f"{sha256}.webp")
+
+    # --- Writes ---
+    def save_stream(self, stream, extension):
+        """Copy an upload to disk in chunks while hashing it.
+        Returns (blob name, size in bytes, True if the blob is new)."""
+        staged = self.stage(stream, extension)
+        with self.lock:
+            return self.commit(staged)
+
+    def stage(self, stream, extension):
+        """Copy an upload to a temporary file in chunks while hashing it;
+        commit() then turns it into a blob. Returns (tmp path, blob name, size)."""
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    tmp.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return tmp_path, blob_name(digest.hexdigest(), extension), size
+
+    def commit(self, staged):
+        """Store a staged upload, or drop it if the blob already exists.
+        Returns (blob name, size in bytes, True if the blob is new)."""
+        tmp_path, name, size = staged
+        try:
+            if os.path.exists(self.path(name)):
+                os.remove(tmp_path)
+                self._count('deduplicated')
+                return name, size, False
+            os.replace(tmp_path, self.path(name))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._count('stored')
+        return name, size, True
+
+    def delete(self, name):
+        """Remove a stored file and its thumbnail; returns the bytes freed"""
+        freed = 0
+        paths = [self.path(name)]
+        parts = split_blob_name(name)
+        if parts is not None:
+            paths.append(self.thumbnail_path(parts[0]))
+        for path in paths:
+            try:
+                freed += os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._count('deleted')
+        return freed
+
+    # --- Thumbnails ---
+    def make_thumbnail_async(self, name):
+        """Queue thumbnail generation for a blob; returns a Future"""
+        return self._pool().submit(self.make_thumbnail, name)
+
+    def make_thumbnail(self, name):
+        """Write the WebP thumbnail of a blob; returns its path, or None if it cannot be made"""
+        sha256, _ = split_blob_name(name)
+        target = self.thumbnail_path(sha256)
+        if os.path.exists(target):
+            return target
+        tmp_path = None
+        try:
+            # Pillow is only needed once an image is actually uploaded
+            from PIL import Image
+            os.makedirs(self.thumbnail_root, exist_ok=True)
+            with Image.open(self.path(name)) as image:
+                image.thumbnail(self.thumbnail_size)
+                if image.mode not in ('RGB', 'RGBA'):
+                    image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+                fd, tmp_path = tempfile.mkstemp(dir=self.thumbnail_root, prefix='.thumb-')
+                with os.fdopen(fd, 'wb') as tmp:
+                    image.save(tmp, 'WEBP', quality=self.thumbnail_quality)
+            os.replace(tmp_path, target)
+        except Exception as e:
+            log.warning("Miniature impossible pour %s: %s", name, e)
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            self._count('thumbnail_errors')
+            return None
+        self._count('thumbnails')
+        return target
+
+    def _pool(self):
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                        thread_name_prefix='thumbnail')
+        return self._executor
+
+    def close(self):
+        """Wait for queued thumbnails and stop the pool"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self.stats_counters)
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self.stats_counters[key] += amount
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Migration script: move each user's `notifications` and `irrigation_events`
+arrays into the `users/{user_id}/notifications` and
+`users/{user_id}/irrigation_events` subcollections.
+Safe to run several times; already migrated users are skipped.
+"""
+
+import os
+import sys
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from firebase_config import (
+    list_user_ids, migrate_notifications_to_subcollection, migrate_irrigation_events_to_subcollection
+)
+
+MIGRATIONS = [
+    ('notifications', migrate_notifications_to_subcollection),
+    ('irrigation events', migrate_irrigation_events_to_subcollection),
+]
+
+def main():
+    print("🚚 Migrating user history to subcollections")
+    print("=" * 50)
+
+    users = 0
+    moved = {label: 0 for label, _ in MIGRATIONS}
+
+    for user_id in list_user_ids():
+        users += 1
+        for label, migrate in MIGRATIONS:
+            try:
+                count = migrate(user_id)
+            except Exception as e:
+                print(f"❌ {user_id} ({label}): {e}")
+                continue
+            moved[label] += count
+            if count:
+                print(f"✅ {user_id}: {count} {label} migrated")
+
+    print("=" * 50)
+    for label, count in moved.items():
+        print(f"🎉 {count} {label} migrated across {users} users")
+
+if __name__ == "__main__":
+    main()
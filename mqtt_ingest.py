@@ -0,0 +1,122 @@
+import json
+import queue
+import threading
+import zlib
+
+from app_logging import get_logger
+
+log = get_logger('mqtt_ingest')
+
+# Wildcard subscriptions: irrigateq/<device_token>/data, .../status and .../ack
+TOPIC_PREFIX = "irrigateq"
+TOPIC_DATA_WILDCARD = f"{TOPIC_PREFIX}/+/data"
+TOPIC_STATUS_WILDCARD = f"{TOPIC_PREFIX}/+/status"
+TOPIC_ACK_WILDCARD = f"{TOPIC_PREFIX}/+/ack"
+
+# Default per-worker queue capacity before messages are dropped
+WORKER_QUEUE_SIZE = 10000
+
+# Default number of worker threads. Parsing holds the GIL, so more threads
+# than this only help while handlers wait on storage or the network.
+NUM_WORKERS = 4
+
+
+def parse_topic(topic):
+    """Split `irrigateq/<token>/<kind>` into (token, kind), or (None, None)"""
+    parts = topic.split('/')
+    if len(parts) != 3 or parts[0] != TOPIC_PREFIX or not parts[1]:
+        return None, None
+    return parts[1], parts[2]
+
+
+def parse_status(raw_payload):
+    """(status, pump_on) of a status message: a bare "online"/"offline", or
+    JSON such as {"status": "online", "pump": "on"}; pump_on is None when
+    the device does not report it"""
+    text = bytes(raw_payload).decode(errors='replace').strip()
+    try:
+        message = json.loads(text)
+    except ValueError:
+        message = None
+    if not isinstance(message, dict):
+        return text, None
+    pump = message.get('pump')
+    if isinstance(pump, str):
+        pump = {'on': True, 'off': False}.get(pump.lower())
+    return str(message.get('status', 'online')), pump if isinstance(pump, bool) else None
+
+
+class ShardedWorkerPool:
+    """Pool of worker threads, each with its own queue.
+
+    Work is routed by a stable hash of the shard key (the device token), so
+    messages from one device are always processed in order by the same worker.
+    `submit` never blocks: paho's network thread only enqueues and returns.
+
+    This is not CPU parallelism. Under the GIL, parsing runs on one core
+    whatever the number of workers, so throughput does not grow with cores.
+    The pool keeps parsing, storage and emits off the network thread, and
+    lets one device's handler wait on I/O while other devices' messages are
+    handled.
+    """
+
+    def __init__(self, handler, num_workers=None, queue_size=WORKER_QUEUE_SIZE, name="mqtt-ingest"):
+        self.handler = handler
+        self.num_workers = num_workers or NUM_WORKERS
+        self.name = name
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(self.num_workers)]
+        self._threads = []
+        self._stats_lock = threading.Lock()
+        self.stats = {'submitted': 0, 'processed': 0, 'failed': 0, 'dropped': 0}
+
+    def start(self):
+        """Start the worker threads"""
+        if self._threads:
+            return
+        for index, work_queue in enumerate(self._queues):
+            thread = threading.Thread(
+                target=self._run, args=(work_queue,), name=f"{self.name}-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        """Drain the queues and stop the workers"""
+        for work_queue in self._queues:
+            work_queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+
+    def shard_for(self, key):
+        """Index of the worker responsible for `key`"""
+        return zlib.crc32(key.encode()) % self.num_workers
+
+    def submit(self, key, *args):
+        """Queue `handler(*args)` on the worker owning `key`; False if that queue is full"""
+        try:
+            self._queues[self.shard_for(key)].put_nowait(args)
+        except queue.Full:
+            self._count('dropped')
+            return False
+        self._count('submitted')
+        return True
+
+    def depth(self):
+        """Number of messages waiting across all workers"""
+        return sum(q.qsize() for q in self._queues)
+
+    def _run(self, work_queue):
+        while True:
+            args = work_queue.get()
+            if args is None:
+                break
+            try:
+                self.handler(*args)
+                self._count('processed')
+            except Exception as e:
+                self._count('failed')
+                log.exception("Erreur lors du traitement du message MQTT: %s", e, extra={'rate_key': 'ingest_error'})
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
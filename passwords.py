@@ -0,0 +1,129 @@
+"""Password hashing with scrypt, on a small bounded pool of threads.
+
+Hashes are stored as `scrypt$<n>$<r>$<p>$<salt>$<key>` (base64 salt and
+key), so the cost can be raised later without breaking existing records.
+hashlib.scrypt releases the GIL: request threads keep running while a
+worker hashes, and since only HASH_WORKERS hashes run at once a burst of
+logins cannot take every core. Beyond HASH_QUEUE_LIMIT waiting requests,
+`PasswordHasherBusy` is raised instead of queueing without end.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# scrypt cost: 128 * n * r bytes of memory (16 MiB) and ~50 ms of CPU per hash
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+# Hashes computed at the same time
+HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+
+# Requests allowed to wait for a free worker before new ones are turned away
+HASH_QUEUE_LIMIT = int(os.environ.get('PASSWORD_HASH_QUEUE', 64))
+
+PREFIX = 'scrypt'
+
+
+class PasswordHasherBusy(RuntimeError):
+    """Too many password checks waiting; answer 503 and let the client retry"""
+
+
+def _b64encode(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def _derive(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                          maxmem=2 * 128 * n * r * p, dklen=KEY_BYTES)
+
+
+def _hash(password):
+    salt = secrets.token_bytes(SALT_BYTES)
+    key = _derive(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"{PREFIX}${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64encode(salt)}${_b64encode(key)}"
+
+
+def _verify(password, encoded):
+    try:
+        prefix, n, r, p, salt, key = encoded.split('$')
+        if prefix != PREFIX:
+            return False
+        expected = base64.b64decode(key)
+        derived = _derive(password, base64.b64decode(salt), int(n), int(r), int(p))
+    except (ValueError, TypeError):
+        return False
+    return hmac.compare_digest(derived, expected)
+
+
+class PasswordHasher:
+    """Runs hashes on at most `workers` threads, with a bounded wait list"""
+
+    def __init__(self, workers=HASH_WORKERS, queue_limit=HASH_QUEUE_LIMIT):
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+        # Threads are created on first use, not at import
+        self._executor = None
+        self._lock = threading.Lock()
+        # Checked against when the login does not exist, so that costs the same
+        self._dummy_hash = None
+        self.stats_counters = {'hashed': 0, 'verified': 0, 'rejected': 0, 'busy': 0}
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.stats_counters['busy'] += 1
+            raise PasswordHasherBusy("Trop de vérifications de mot de passe en attente")
+        try:
+            if self._executor is None:
+                with self._lock:
+                    if self._executor is None:
+                        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="password-hash")
+            return self._executor.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def _count(self, name):
+        with self._lock:
+            self.stats_counters[name] += 1
+
+    def hash(self, password):
+        """Encoded scrypt hash of a new password"""
+        encoded = self._run(_hash, password)
+        self._count('hashed')
+        return encoded
+
+    def verify(self, password, encoded):
+        """Whether `password` matches an encoded hash; pass None for an
+        unknown login to spend the same time and still get False"""
+        if encoded is None:
+            if self._dummy_hash is None:
+                self._dummy_hash = self.hash(secrets.token_hex(16))
+            self._run(_verify, password, self._dummy_hash)
+            self._count('rejected')
+            return False
+        ok = self._run(_verify, password, encoded)
+        self._count('verified' if ok else 'rejected')
+        return ok
+
+    def needs_rehash(self, encoded):
+        """Whether a hash was made with other parameters than the current ones"""
+        return not encoded.startswith(f"{PREFIX}${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
+
+    def stats(self):
+        with self._lock:
+            return dict(self.stats_counters)
+
+
+_hasher = PasswordHasher()
+
+hash_password = _hasher.hash
+verify_password = _hasher.verify
+needs_rehash = _hasher.needs_rehash
+password_stats = _hasher.stats
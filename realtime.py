@@ -0,0 +1,84 @@
+import threading
+import time
+
+from app_logging import get_logger
+
+log = get_logger('realtime')
+
+# Default cap on sensor updates pushed to one room per second
+MAX_UPDATES_PER_SECOND = 2
+
+# Readings kept per device between two flushes (oldest are dropped first)
+MAX_READINGS_PER_DEVICE = 20
+
+
+def user_room(user_id):
+    """Socket.IO room for everything addressed to one user"""
+    return f"user:{user_id}"
+
+
+def device_room(device_id):
+    """Socket.IO room for live data of one device"""
+    return f"device:{device_id}"
+
+
+class SensorBroadcaster:
+    """Coalesces sensor readings and emits them as `sensor_batch` events.
+
+    Ingest workers call `publish()` for every reading; a single background
+    task flushes at `max_rate` Hz, so each room receives at most `max_rate`
+    emits per second no matter how fast its devices publish. Payload:
+
+        {"readings": [{"device_id": ..., "ts": ..., "temperature": ..., ...}, ...]}
+
+    with readings ordered oldest first.
+    """
+
+    def __init__(self, socketio, max_rate=MAX_UPDATES_PER_SECOND,
+                 max_readings_per_device=MAX_READINGS_PER_DEVICE, event='sensor_batch'):
+        self.socketio = socketio
+        self.interval = 1.0 / max_rate
+        self.max_readings_per_device = max_readings_per_device
+        self.event = event
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._started = False
+        self.stats = {'published': 0, 'emitted': 0, 'coalesced': 0}
+
+    def publish(self, room, reading):
+        """Queue `reading` for `room`; never blocks on the network"""
+        device_id = reading.get('device_id')
+        with self._lock:
+            per_device = self._pending.setdefault(room, {}).setdefault(device_id, [])
+            per_device.append(reading)
+            if len(per_device) > self.max_readings_per_device:
+                del per_device[0]
+            self.stats['published'] += 1
+
+    def start(self):
+        """Start the flush loop as a Socket.IO background task"""
+        if not self._started:
+            self._started = True
+            self.socketio.start_background_task(self._run)
+
+    def flush(self):
+        """Emit one batch per room with pending readings"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for room, per_device in pending.items():
+            readings = [r for device_readings in per_device.values() for r in device_readings]
+            readings.sort(key=lambda r: r.get('ts') or 0)
+            self.socketio.emit(self.event, {'readings': readings}, to=room)
+            with self._lock:
+                self.stats['emitted'] += 1
+                self.stats['coalesced'] += len(readings) - 1
+        return len(pending)
+
+    def _run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                self.flush()
+            except Exception as e:
+                log.exception("Erreur lors de la diffusion des données capteurs: %s", e)
+            self.socketio.sleep(max(0.0, self.interval - (time.monotonic() - started)))
@@ -0,0 +1,115 @@
+"""Per-request unit of work for storage reads.
+
+While a scope is active (one per HTTP request, opened by the app), reads
+made through `memoized()` are done at most once per key, even when two
+threads of the same request ask at the same time, and every read that
+reaches the backend is counted with `count_read()`. Writes call
+`forget()` so the rest of the request sees them. Outside a scope both
+are pass-through, so background threads behave as before.
+
+`fetch_concurrently()` runs independent reads of one request in parallel
+(when the backend does network round trips) within the same scope.
+"""
+import contextvars
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Threads shared by all requests for concurrent reads
+READ_WORKERS = int(os.environ.get('STORAGE_READ_WORKERS', 8))
+
+_current = contextvars.ContextVar('storage_request_scope', default=None)
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class RequestScope:
+    """Memoized reads and read counts of one request"""
+
+    def __init__(self):
+        self.reads = {}
+        self._memo = {}
+        self._lock = threading.Lock()
+
+    @property
+    def total_reads(self):
+        return sum(self.reads.values())
+
+
+def begin():
+    """Open a scope for the current request and return it"""
+    scope = RequestScope()
+    _current.set(scope)
+    return scope
+
+
+def end():
+    """Close the current request's scope"""
+    _current.set(None)
+
+
+def current():
+    """The active scope, or None outside a request"""
+    return _current.get()
+
+
+def count_read(kind):
+    """Record one backend read of `kind` ('user', 'notifications', ...)"""
+    scope = _current.get()
+    if scope is not None:
+        with scope._lock:
+            scope.reads[kind] = scope.reads.get(kind, 0) + 1
+
+
+def memoized(key, fetch):
+    """fetch() once per key and request; concurrent callers wait for the first"""
+    scope = _current.get()
+    if scope is None:
+        return fetch()
+    with scope._lock:
+        future = scope._memo.get(key)
+        owner = future is None
+        if owner:
+            future = scope._memo[key] = Future()
+    if owner:
+        try:
+            future.set_result(fetch())
+        except BaseException as e:
+            # Not cached: a later call in the request may retry
+            with scope._lock:
+                scope._memo.pop(key, None)
+            future.set_exception(e)
+    return future.result()
+
+
+def forget(match):
+    """Drop memoized reads whose key satisfies match(key), after a write"""
+    scope = _current.get()
+    if scope is not None:
+        with scope._lock:
+            for key in [key for key in scope._memo if match(key)]:
+                del scope._memo[key]
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(READ_WORKERS, thread_name_prefix="storage-read")
+    return _executor
+
+
+def fetch_concurrently(calls, parallel=True):
+    """Results of independent calls [(fn, *args), ...], in order.
+
+    With `parallel`, all but the first run on the read pool while the first
+    runs here, sharing the request's scope; otherwise they run one by one.
+    """
+    if not parallel or len(calls) < 2:
+        return [fn(*args) for fn, *args in calls]
+    executor = _get_executor()
+    futures = [executor.submit(contextvars.copy_context().run, fn, *args) for fn, *args in calls[1:]]
+    first_fn, *first_args = calls[0]
+    results = [first_fn(*first_args)]
+    return results + [future.result() for future in futures]
@@ -0,0 +1,108 @@
+import json
+import struct
+import time
+
+from sensor_reading import SensorReading, parse_number
+
+# First byte of a binary frame; JSON payloads start with '{', '[' or whitespace
+MAGIC = 0xB5
+VERSION = 1
+
+# Header: magic, version, sample count, base timestamp (epoch seconds, 0 = device has no clock)
+HEADER = struct.Struct('<BBBI')
+
+# Sample: offset from the base timestamp (s), temperature (0.01 °C),
+# air humidity (0.01 %), soil moisture (0.01 %), soil state
+SAMPLE = struct.Struct('<HhHHB')
+
+MAX_SAMPLES = 255
+
+# Sentinels for missing values
+NO_TEMPERATURE = -0x8000
+NO_PERCENT = 0xFFFF
+
+# Soil state codes (0 = none)
+SOIL_STATE_CODES = {'sec': 1, 'normal': 2, 'humide': 3}
+SOIL_STATES = {code: state for state, code in SOIL_STATE_CODES.items()}
+
+
+class PayloadError(ValueError):
+    """Malformed sensor payload"""
+
+
+def _scaled(value, missing):
+    if value is None:
+        return missing
+    scaled = int(round(value * 100))
+    if scaled == missing:
+        # Would decode as a missing value
+        raise ValueError(f"Sample value {value} out of range")
+    return scaled
+
+
+def encode_frame(readings, base_ts=None):
+    """Encode up to 255 SensorReadings as one binary frame.
+    With `base_ts=0` the receiver timestamps the frame on arrival. Raises
+    ValueError for values the frame cannot hold (e.g. more than 18 hours
+    between the first and last sample)."""
+    if not 0 < len(readings) <= MAX_SAMPLES:
+        raise ValueError(f"A frame holds 1 to {MAX_SAMPLES} samples")
+    if base_ts is None:
+        base_ts = int(min(r.ts for r in readings))
+    parts = [HEADER.pack(MAGIC, VERSION, len(readings), base_ts)]
+    for reading in readings:
+        offset = int(reading.ts - base_ts) if base_ts else 0
+        try:
+            parts.append(SAMPLE.pack(
+                offset,
+                _scaled(reading.temperature, NO_TEMPERATURE),
+                _scaled(reading.humidite, NO_PERCENT),
+                _scaled(reading.sol, NO_PERCENT),
+                SOIL_STATE_CODES.get(reading.sol_state, 0),
+            ))
+        except struct.error as e:
+            raise ValueError(f"Sample out of range: {e}") from None
+    return b''.join(parts)
+
+
+def decode_frame(data, now=None):
+    """Decode a binary frame into SensorReadings"""
+    if len(data) < HEADER.size:
+        raise PayloadError("Truncated frame header")
+    magic, version, count, base_ts = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise PayloadError("Not a binary sensor frame")
+    if version != VERSION:
+        raise PayloadError(f"Unsupported frame version {version}")
+    if len(data) != HEADER.size + count * SAMPLE.size:
+        raise PayloadError(f"Frame length {len(data)} does not match {count} samples")
+
+    if not base_ts:
+        base_ts = now if now is not None else time.time()
+    readings = []
+    for offset, temperature, humidite, sol, state in SAMPLE.iter_unpack(memoryview(data)[HEADER.size:]):
+        readings.append(SensorReading(
+            base_ts + offset,
+            None if temperature == NO_TEMPERATURE else temperature / 100,
+            None if humidite == NO_PERCENT else humidite / 100,
+            None if sol == NO_PERCENT else sol / 100,
+            SOIL_STATES.get(state),
+        ))
+    return readings
+
+
+def decode_payload(data, now=None):
+    """Decode a data message in either format: a binary frame, a JSON object
+    or a JSON array of objects. Returns a list of SensorReadings."""
+    if data[:1] == bytes((MAGIC,)):
+        return decode_frame(data, now)
+    try:
+        decoded = json.loads(data)
+    except ValueError as e:
+        raise PayloadError(f"Invalid JSON payload: {e}") from None
+    now = now if now is not None else time.time()
+    if isinstance(decoded, dict):
+        return [SensorReading.from_payload(decoded, now)]
+    if isinstance(decoded, list) and all(isinstance(item, dict) for item in decoded):
+        return [SensorReading.from_payload(item, parse_number(item.get('ts')) or now) for item in decoded]
+    raise PayloadError("JSON payload must be an object or a list of objects")
@@ -0,0 +1,81 @@
+import math
+import time
+
+# Soil labels sent by firmwares that report a state instead of a percentage
+SOIL_STATES = {
+    'sec': 'sec',
+    'dry': 'sec',
+    'normal': 'normal',
+    'ok': 'normal',
+    'humide': 'humide',
+    'wet': 'humide',
+}
+
+# Unit suffixes stripped from numeric strings such as "22°C" or "55.0%"
+UNIT_SUFFIXES = ('°c', '°', 'c', '%')
+
+
+def parse_number(value):
+    """Convert 55, 55.0, "55.0%", "22,5 °C" to a finite float, or None"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        number = float(value)
+    else:
+        text = str(value).strip().lower()
+        for suffix in UNIT_SUFFIXES:
+            if text.endswith(suffix):
+                text = text[:-len(suffix)].rstrip()
+                break
+        try:
+            number = float(text.replace(',', '.'))
+        except ValueError:
+            return None
+    return number if math.isfinite(number) else None
+
+
+class SensorReading:
+    """One normalized sensor sample.
+
+    `temperature` is in °C, `humidite` (air) and `sol` (soil moisture) in %.
+    `sol_state` holds the soil label ('sec', 'normal', 'humide') when the
+    device reports one instead of a percentage. Missing values are None.
+    """
+
+    __slots__ = ('ts', 'temperature', 'humidite', 'sol', 'sol_state')
+
+    def __init__(self, ts, temperature=None, humidite=None, sol=None, sol_state=None):
+        self.ts = ts
+        self.temperature = temperature
+        self.humidite = humidite
+        self.sol = sol
+        self.sol_state = sol_state
+
+    @classmethod
+    def from_payload(cls, data, ts=None):
+        """Build a reading from a decoded device payload (a dict)"""
+        sol = data.get('sol')
+        moisture = parse_number(sol)
+        sol_state = None
+        if moisture is None and isinstance(sol, str):
+            sol_state = SOIL_STATES.get(sol.strip().lower())
+        return cls(
+            ts if ts is not None else time.time(),
+            parse_number(data.get('temperature')),
+            parse_number(data.get('humidite')),
+            moisture,
+            sol_state,
+        )
+
+    def as_dict(self):
+        return {
+            'ts': self.ts,
+            'temperature': self.temperature,
+            'humidite': self.humidite,
+            'sol': self.sol,
+            'sol_state': self.sol_state,
+        }
+
+    def __repr__(self):
+        return (f"SensorReading(ts={self.ts!r}, temperature={self.temperature!r}, "
+                f"humidite={self.humidite!r}, sol={self.sol!r}, sol_state={self.sol_state!r})")
@@ -37,14 +37,20 @@ function initializeDashboard(flaskData) {
     showNotification(flaskData.translations.disconnected || 'تم قطع الاتصال بالخادم', true);
   });
 
-  socket.on('sensor_update', (data) => {
-    console.log('Received sensor update:', data);
-    updateSensorDisplay(data);
-    updateChart(data);
+  // Readings arrive coalesced: {readings: [...]} oldest first, at most a few batches per second.
+  // The user's other devices share the batch: only the displayed one is shown
+  const isDisplayedDevice = (data) => data.device_id === undefined || String(data.device_id) === String(flaskData.deviceId);
+
+  socket.on('sensor_batch', (batch) => {
+    const readings = (batch.readings || []).filter(isDisplayedDevice);
+    if (!readings.length) return;
+    updateSensorDisplay(readings[readings.length - 1]);
+    updateChart(readings);
   });
 
   socket.on('esp32_status', (data) => {
     console.log('Received ESP32 status:', data);
+    if (!isDisplayedDevice(data)) return;
     updateESP32Status(data.status);
   });
   
@@ -53,6 +59,12 @@ function initializeDashboard(flaskData) {
     showNotification(data.message);
   });
 
+  // Device confirmation (or not) of a pump command
+  socket.on('command_status', (data) => {
+    console.log('Command status:', data);
+    showNotification(data.message);
+  });
+
   socket.on('new_image', (data) => {
     console.log('New image uploaded:', data);
     showNotification(flaskData.translations.new_image_notification || 'تم استلام صورة جديدة');
@@ -61,15 +73,19 @@ function initializeDashboard(flaskData) {
   
   socket.on('current_data', (data) => {
     console.log('Received current data:', data);
+    if (!isDisplayedDevice(data)) return;
     updateSensorDisplay(data);
   });
 
   // --- Functions ---
   function updateSensorDisplay(data) {
-    if (data.temperature !== undefined) esp32Temp.textContent = data.temperature || '-';
-    if (data.humidite !== undefined) esp32Hum.textContent = data.humidite || '-';
-    if (data.sol !== undefined) esp32Sol.textContent = data.sol || '-';
-    if (data.last_update) esp32LastUpdate.textContent = data.last_update;
+    // Readings arrive as numbers (°C and %) or null; the soil may only have a state label
+    if (data.temperature !== undefined) esp32Temp.textContent = data.temperature ?? '-';
+    if (data.humidite !== undefined) esp32Hum.textContent = data.humidite ?? '-';
+    if (data.sol !== undefined) {
+      esp32Sol.textContent = data.sol !== null ? `${data.sol} %` : (data.sol_state || '-');
+    }
+    if (data.last_update || data.timestamp) esp32LastUpdate.textContent = data.last_update || data.timestamp;
   }
 
   function updateESP32Status(status) {
@@ -83,14 +99,22 @@ function initializeDashboard(flaskData) {
   }
 
   // --- Chart.js ---
+  // Seed the chart with the readings stored server-side so it survives reloads
+  const recentReadings = (flaskData.recentReadings || [])
+    .filter(r => r.humidite !== null && !isNaN(parseFloat(r.humidite)));
+  const initialLabels = recentReadings.length
+    ? recentReadings.map(r => new Date(r.ts * 1000).toLocaleTimeString())
+    : flaskData.chartLabels;
+  const initialData = recentReadings.map(r => parseFloat(r.humidite));
+
   const ctx = document.getElementById('chartHum').getContext('2d');
   const chart = new Chart(ctx, {
     type: 'line',
     data: {
-      labels: flaskData.chartLabels,
+      labels: initialLabels,
       datasets: [{
         label: flaskData.humidityLabel,
-        data: [], // Start with empty data
+        data: initialData,
         fill: true,
         borderColor: '#43a047',
         backgroundColor: 'rgba(76,175,80,0.10)',
@@ -106,19 +130,26 @@ function initializeDashboard(flaskData) {
     }
   });
 
-  function updateChart(data) {
-    if (data.humidite && chart) {
+  function updateChart(readings) {
+    if (!chart) return;
+    let changed = false;
+    readings.forEach(data => {
       const newHumidity = parseFloat(data.humidite);
       if (!isNaN(newHumidity)) {
-        chart.data.labels.push(new Date().toLocaleTimeString());
+        const when = data.ts ? new Date(data.ts * 1000) : new Date();
+        chart.data.labels.push(when.toLocaleTimeString());
         chart.data.datasets[0].data.push(newHumidity);
-        if (chart.data.labels.length > 15) {
-          chart.data.labels.shift();
-          chart.data.datasets[0].data.shift();
-        }
-        chart.update('none');
+        changed = true;
       }
+    });
+    if (!changed) return;
+    const overflow = chart.data.labels.length - 15;
+    if (overflow > 0) {
+      chart.data.labels.splice(0, overflow);
+      chart.data.datasets[0].data.splice(0, overflow);
     }
+    // Apply the whole batch with a single redraw
+    chart.update('none');
   }
 
   // --- Image Handling ---
@@ -143,7 +174,7 @@ function initializeDashboard(flaskData) {
       fetch('/voice-command', {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ command: command })
+          body: JSON.stringify({ command: command, device_id: flaskData.deviceId })
       })
       .then(res => res.json())
       .then(data => showNotification(data.message))
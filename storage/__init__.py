@@ -0,0 +1,54 @@
+"""
+Storage backends behind firebase_config.
+
+The backend is chosen with the STORAGE_BACKEND environment variable:
+    firestore  Cloud Firestore (default)
+    memory     process-local dicts, for development and benchmarks
+    sqlite     a local SQLite file (STORAGE_SQLITE_PATH, default database.db)
+"""
+
+import os
+import threading
+
+from storage.base import StorageBackend, UserExistsError
+
+BACKENDS = ('firestore', 'memory', 'sqlite')
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def create_backend(name=None, **options):
+    """Instantiate a backend by name; Firebase is only imported for 'firestore'"""
+    name = (name or os.environ.get('STORAGE_BACKEND', 'firestore')).lower()
+    if name == 'firestore':
+        from storage.firestore_backend import FirestoreBackend
+        return FirestoreBackend(**options)
+    if name == 'memory':
+        from storage.memory_backend import MemoryBackend
+        return MemoryBackend(**options)
+    if name == 'sqlite':
+        from storage.sqlite_backend import SQLiteBackend
+        options.setdefault('db_path', os.environ.get('STORAGE_SQLITE_PATH', 'database.db'))
+        return SQLiteBackend(**options)
+    raise ValueError(f"Unknown storage backend: {name} (expected one of {', '.join(BACKENDS)})")
+
+
+def get_backend():
+    """The configured backend, created on first use"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend()
+    return _backend
+
+
+def set_backend(backend):
+    """Replace the active backend (a StorageBackend instance or a backend name)"""
+    global _backend
+    if not isinstance(backend, StorageBackend):
+        backend = create_backend(backend)
+    with _backend_lock:
+        _backend = backend
+    return backend
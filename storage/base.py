@@ -0,0 +1,93 @@
+class UserExistsError(ValueError):
+    """A user with this email/phone is already registered"""
+
+
+class StorageBackend:
+    """Interface implemented by every storage backend.
+
+    Documents are plain dicts shaped like the Firestore documents described in
+    FIREBASE_SETUP.md. Pages are returned newest first, ordered by
+    (timestamp, id); `before` is an exclusive upper bound on that pair used
+    for keyset pagination, so documents sharing a timestamp are never skipped.
+    """
+
+    name = None
+
+    # Whether a request's independent reads are worth running in parallel
+    # (network round trips), see firebase_config.fetch_concurrently
+    parallel_reads = False
+
+    # Errors a retry cannot fix (missing user, invalid document): a queued
+    # write failing with one is dead-lettered at once
+    permanent_errors = (LookupError, TypeError, ValueError)
+
+    # --- Users ---
+    def create_user(self, user_doc, credentials):
+        """Store a user document and its `user_credentials` record, or raise
+        UserExistsError (writing nothing) if the login is already taken"""
+        raise NotImplementedError
+
+    def get_user(self, user_id):
+        """User document, or None"""
+        raise NotImplementedError
+
+    def update_user(self, user_id, fields):
+        """Merge `fields` into an existing user document"""
+        raise NotImplementedError
+
+    def get_credentials(self, email_or_phone):
+        """Credential record for a login, or None"""
+        raise NotImplementedError
+
+    def set_credentials(self, email_or_phone, credentials):
+        """Replace the credential record of an existing login"""
+        raise NotImplementedError
+
+    def credentials_exist(self, email_or_phone):
+        """Whether a login is already taken"""
+        return self.get_credentials(email_or_phone) is not None
+
+    def list_user_ids(self):
+        """IDs of every stored user"""
+        raise NotImplementedError
+
+    # --- Notifications ---
+    def add_notification(self, user_id, notification):
+        """Store a notification and increment the user's unread counter"""
+        self.apply_writes([('add_notification', user_id, notification)])
+
+    def notifications_page(self, user_id, limit, before=None):
+        """Up to `limit` notifications after the (timestamp, id) `before`, newest first"""
+        raise NotImplementedError
+
+    def mark_all_notifications_read(self, user_id):
+        """Mark every notification read and reset the unread counter"""
+        raise NotImplementedError
+
+    # --- Irrigation events ---
+    def add_irrigation_event(self, user_id, event):
+        """Append an event; fails if an event with the same ID exists"""
+        raise NotImplementedError
+
+    def irrigation_events_page(self, user_id, limit, before=None, start=None, end=None, event_types=None):
+        """Up to `limit` events older than `before`, within [start, end) and
+        of one of `event_types`, newest first"""
+        raise NotImplementedError
+
+    # --- Batches ---
+    def apply_writes(self, writes):
+        """Apply `(op, user_id, document)` writes atomically. Supported ops are
+        'add_notification' and 'add_irrigation_event'; both are idempotent on
+        the document ID, and a replayed notification does not increment the
+        unread counter again."""
+        raise NotImplementedError
+
+    # --- Maintenance ---
+    def migrate_legacy_array(self, user_id, field, unread_counter=False):
+        """Move a legacy array field into its own collection; only Firestore
+        documents created by older versions have such arrays"""
+        return []
+
+    def test_connection(self):
+        """Whether the backend is reachable"""
+        return True
@@ -0,0 +1,201 @@
+import os
+import uuid
+
+import firebase_admin
+from firebase_admin import credentials, firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+from google.api_core.exceptions import AlreadyExists, InvalidArgument, NotFound
+
+from app_logging import get_logger
+from storage.base import StorageBackend, UserExistsError
+
+log = get_logger('storage.firestore')
+
+# Firestore allows at most 500 writes per batch
+MAX_BATCH_WRITES = 499
+
+
+def initialize_firebase(cred_path="serviceAccountKey.json"):
+    """Initialize Firebase Admin SDK with service account credentials"""
+    try:
+        # Check if Firebase app is already initialized
+        firebase_admin.get_app()
+        log.debug("Firebase déjà initialisé")
+    except ValueError:
+        # Initialize Firebase with service account key
+        # You need to place your serviceAccountKey.json in the project root
+        if os.path.exists(cred_path):
+            cred = credentials.Certificate(cred_path)
+            firebase_admin.initialize_app(cred)
+            log.info("Firebase initialisé avec %s", cred_path)
+        else:
+            log.warning("%s introuvable: ajoutez la clé du compte de service Firebase", cred_path)
+            # For development, you can use default credentials
+            firebase_admin.initialize_app()
+            log.info("Firebase initialisé avec les identifiants par défaut")
+
+
+class FirestoreBackend(StorageBackend):
+    """Cloud Firestore: `users`, `user_credentials` and per-user
+    `notifications`/`irrigation_events` subcollections"""
+
+    name = 'firestore'
+    parallel_reads = True
+    # Deleted user document, or a document over Firestore's limits
+    permanent_errors = StorageBackend.permanent_errors + (InvalidArgument, NotFound)
+
+    def __init__(self, cred_path="serviceAccountKey.json"):
+        initialize_firebase(cred_path)
+        self.db = firestore.client()
+
+    def _user_ref(self, user_id):
+        return self.db.collection('users').document(user_id)
+
+    # --- Users ---
+    def create_user(self, user_doc, credentials):
+        # One commit; create() fails it if the login (the credentials document ID) exists
+        batch = self.db.batch()
+        batch.create(self.db.collection('user_credentials').document(user_doc['email_or_phone']), credentials)
+        batch.set(self._user_ref(user_doc['user_id']), user_doc)
+        try:
+            batch.commit()
+        except AlreadyExists:
+            raise UserExistsError(user_doc['email_or_phone'])
+
+    def get_user(self, user_id):
+        user_doc = self._user_ref(user_id).get()
+        return user_doc.to_dict() if user_doc.exists else None
+
+    def update_user(self, user_id, fields):
+        self._user_ref(user_id).update(fields)
+
+    def get_credentials(self, email_or_phone):
+        cred_doc = self.db.collection('user_credentials').document(email_or_phone).get()
+        return cred_doc.to_dict() if cred_doc.exists else None
+
+    def set_credentials(self, email_or_phone, credentials):
+        self.db.collection('user_credentials').document(email_or_phone).set(credentials)
+
+    def list_user_ids(self):
+        # Only document IDs are needed
+        return [doc.id for doc in self.db.collection('users').select([]).stream()]
+
+    # --- Notifications ---
+    @staticmethod
+    def _newest_first(query, before):
+        """Order by (timestamp, document ID) descending and resume after `before`"""
+        query = (query.order_by('timestamp', direction=firestore.Query.DESCENDING)
+                 .order_by(FieldPath.document_id(), direction=firestore.Query.DESCENDING))
+        if before is not None:
+            timestamp, doc_id = before
+            query = query.start_after({'timestamp': timestamp, FieldPath.document_id(): doc_id})
+        return query
+
+    def notifications_page(self, user_id, limit, before=None):
+        query = self._newest_first(self._user_ref(user_id).collection('notifications'), before)
+        return [doc.to_dict() for doc in query.limit(limit).stream()]
+
+    def mark_all_notifications_read(self, user_id):
+        user_ref = self._user_ref(user_id)
+        unread = user_ref.collection('notifications').where('read', '==', False).stream()
+
+        batch = self.db.batch()
+        pending = 0
+        for doc in unread:
+            batch.update(doc.reference, {'read': True})
+            pending += 1
+            if pending == MAX_BATCH_WRITES:
+                batch.commit()
+                batch = self.db.batch()
+                pending = 0
+        batch.update(user_ref, {'unread_notifications': 0})
+        batch.commit()
+
+    # --- Irrigation events ---
+    def add_irrigation_event(self, user_id, event):
+        # Append-only: create() refuses to overwrite an existing event
+        self._user_ref(user_id).collection('irrigation_events').document(event['id']).create(event)
+
+    def irrigation_events_page(self, user_id, limit, before=None, start=None, end=None, event_types=None):
+        query = self._user_ref(user_id).collection('irrigation_events')
+        if event_types:
+            query = query.where('type', 'in', list(event_types))
+        if start is not None:
+            query = query.where('timestamp', '>=', start)
+        if end is not None:
+            query = query.where('timestamp', '<', end)
+        query = self._newest_first(query, before)
+        return [doc.to_dict() for doc in query.limit(limit).stream()]
+
+    # --- Batches ---
+    def apply_writes(self, writes):
+        documents = []
+        for op, user_id, document in writes:
+            if op not in ('add_notification', 'add_irrigation_event'):
+                raise ValueError(f"Unknown write operation: {op}")
+            collection = 'notifications' if op == 'add_notification' else 'irrigation_events'
+            documents.append((op, user_id, document,
+                              self._user_ref(user_id).collection(collection).document(document['id'])))
+        notification_refs = [ref for op, _, _, ref in documents if op == 'add_notification']
+
+        @firestore.transactional
+        def apply(transaction):
+            # Reads come first in a transaction: the notifications a replay already stored
+            stored = set()
+            if notification_refs:
+                stored = {snapshot.reference.path for snapshot in
+                          self.db.get_all(notification_refs, transaction=transaction) if snapshot.exists}
+            unread = {}
+            for op, user_id, document, ref in documents:
+                if op == 'add_notification':
+                    if ref.path in stored:
+                        continue
+                    stored.add(ref.path)
+                    unread[user_id] = unread.get(user_id, 0) + 1
+                # set() rather than create() so a replayed batch does not fail
+                transaction.set(ref, document)
+            for user_id, count in unread.items():
+                transaction.update(self._user_ref(user_id), {'unread_notifications': firestore.Increment(count)})
+
+        apply(self.db.transaction())
+
+    # --- Maintenance ---
+    def migrate_legacy_array(self, user_id, field, unread_counter=False):
+        user_ref = self._user_ref(user_id)
+        user_doc = user_ref.get()
+        if not user_doc.exists:
+            return []
+
+        legacy = user_doc.to_dict().get(field)
+        if legacy is None:
+            return []
+
+        subcollection = user_ref.collection(field)
+        batch = self.db.batch()
+        pending = 0
+        for item in legacy:
+            item_id = item.get('id') or str(uuid.uuid4())
+            batch.set(subcollection.document(item_id), dict(item, id=item_id))
+            pending += 1
+            if pending == MAX_BATCH_WRITES:
+                batch.commit()
+                batch = self.db.batch()
+                pending = 0
+
+        # The array is removed in the last batch, so a crash before it means a clean retry
+        update = {field: firestore.DELETE_FIELD}
+        if unread_counter:
+            update['unread_notifications'] = firestore.Increment(
+                sum(1 for item in legacy if not item.get('read')))
+        batch.update(user_ref, update)
+        batch.commit()
+        return legacy
+
+    def test_connection(self):
+        try:
+            # Try to access a collection to test connection
+            self.db.collection('test').limit(1).get()
+            return True
+        except Exception as e:
+            log.error("Test de connexion Firestore échoué: %s", e)
+            return False
@@ -0,0 +1,158 @@
+import copy
+import heapq
+import threading
+from bisect import bisect_left, insort
+from itertools import islice
+
+from storage.base import StorageBackend, UserExistsError
+
+
+class SortedLog:
+    """Documents kept sorted by (timestamp, id) for O(log n + page) reads"""
+
+    def __init__(self):
+        self._keys = []
+        self._docs = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._docs
+
+    def add(self, document):
+        """Insert or replace a document"""
+        doc_id = document['id']
+        previous = self._docs.get(doc_id)
+        if previous is not None:
+            self._keys.pop(bisect_left(self._keys, (previous['timestamp'], doc_id)))
+        insort(self._keys, (document['timestamp'], doc_id))
+        self._docs[doc_id] = document
+
+    def newest_first(self, before=None, start=None, end=None):
+        """Iterate documents with (timestamp, id) < before, start <= timestamp
+        and timestamp < end, newest first"""
+        index = len(self._keys)
+        if before is not None:
+            index = bisect_left(self._keys, before)
+        if end is not None:
+            index = min(index, bisect_left(self._keys, (end,)))
+        while index > 0:
+            index -= 1
+            timestamp, doc_id = self._keys[index]
+            if start is not None and timestamp < start:
+                return
+            yield self._docs[doc_id]
+
+    def values(self):
+        return self._docs.values()
+
+
+class MemoryBackend(StorageBackend):
+    """Process-local backend for development, tests and benchmarks.
+    Nothing survives a restart."""
+
+    name = 'memory'
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._users = {}
+        self._credentials = {}
+        self._notifications = {}
+        # user_id -> {'*': SortedLog, event_type: SortedLog}
+        self._events = {}
+
+    # --- Users ---
+    def create_user(self, user_doc, credentials):
+        with self._lock:
+            if user_doc['email_or_phone'] in self._credentials:
+                raise UserExistsError(user_doc['email_or_phone'])
+            self._users[user_doc['user_id']] = copy.deepcopy(user_doc)
+            self._credentials[user_doc['email_or_phone']] = dict(credentials)
+
+    def get_user(self, user_id):
+        with self._lock:
+            user = self._users.get(user_id)
+            return copy.deepcopy(user) if user is not None else None
+
+    def update_user(self, user_id, fields):
+        with self._lock:
+            if user_id not in self._users:
+                raise KeyError(f"No user document {user_id}")
+            self._users[user_id].update(copy.deepcopy(fields))
+
+    def get_credentials(self, email_or_phone):
+        with self._lock:
+            cred = self._credentials.get(email_or_phone)
+            return dict(cred) if cred is not None else None
+
+    def set_credentials(self, email_or_phone, credentials):
+        with self._lock:
+            if email_or_phone not in self._credentials:
+                raise KeyError(f"No credentials for {email_or_phone}")
+            self._credentials[email_or_phone] = dict(credentials)
+
+    def list_user_ids(self):
+        with self._lock:
+            return list(self._users)
+
+    # --- Notifications ---
+    def notifications_page(self, user_id, limit, before=None):
+        with self._lock:
+            log = self._notifications.get(user_id)
+            if log is None:
+                return []
+            return [dict(n) for n in islice(log.newest_first(before=before), limit)]
+
+    def mark_all_notifications_read(self, user_id):
+        with self._lock:
+            for notification in self._notifications.get(user_id, SortedLog()).values():
+                notification['read'] = True
+            if user_id in self._users:
+                self._users[user_id]['unread_notifications'] = 0
+
+    # --- Irrigation events ---
+    def add_irrigation_event(self, user_id, event):
+        with self._lock:
+            logs = self._events.get(user_id)
+            if logs is not None and event['id'] in logs['*']:
+                raise ValueError(f"Irrigation event {event['id']} already exists")
+            self._store_event(user_id, copy.deepcopy(event))
+
+    def irrigation_events_page(self, user_id, limit, before=None, start=None, end=None, event_types=None):
+        with self._lock:
+            logs = self._events.get(user_id)
+            if logs is None:
+                return []
+            if event_types:
+                # Merge the per-type logs instead of filtering the full log
+                iterators = [logs[t].newest_first(before, start, end) for t in set(event_types) if t in logs]
+                merged = heapq.merge(*iterators, key=lambda e: (e['timestamp'], e['id']), reverse=True)
+            else:
+                merged = logs['*'].newest_first(before, start, end)
+            return [copy.deepcopy(e) for e in islice(merged, limit)]
+
+    # --- Batches ---
+    def apply_writes(self, writes):
+        with self._lock:
+            for op, user_id, _ in writes:
+                if op not in ('add_notification', 'add_irrigation_event'):
+                    raise ValueError(f"Unknown write operation: {op}")
+                if op == 'add_notification' and user_id not in self._users:
+                    raise KeyError(f"No user document {user_id}")
+            for op, user_id, document in writes:
+                document = copy.deepcopy(document)
+                if op == 'add_notification':
+                    log = self._notifications.setdefault(user_id, SortedLog())
+                    # A replayed notification is not counted twice
+                    if document['id'] not in log:
+                        user = self._users[user_id]
+                        user['unread_notifications'] = user.get('unread_notifications', 0) + 1
+                    log.add(document)
+                else:
+                    self._store_event(user_id, document)
+
+    def _store_event(self, user_id, event):
+        logs = self._events.setdefault(user_id, {'*': SortedLog()})
+        logs['*'].add(event)
+        logs.setdefault(event['type'], SortedLog()).add(event)
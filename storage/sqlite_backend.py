@@ -0,0 +1,230 @@
+import contextlib
+import datetime
+import json
+import sqlite3
+import threading
+
+from app_logging import get_logger
+from storage.base import StorageBackend, UserExistsError
+
+log = get_logger('storage.sqlite')
+
+# Same file as the `devices` table and the sensor telemetry
+DB_PATH = "database.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS app_users (
+    user_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS app_credentials (
+    email_or_phone TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS app_notifications (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    ts REAL NOT NULL,
+    read INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+-- Pages are keyed on (ts, id), so ties on ts are ordered by the index too
+DROP INDEX IF EXISTS idx_app_notifications_user_ts;
+CREATE INDEX IF NOT EXISTS idx_app_notifications_user_ts_id
+    ON app_notifications (user_id, ts, id);
+CREATE TABLE IF NOT EXISTS app_irrigation_events (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    type TEXT NOT NULL,
+    ts REAL NOT NULL,
+    data TEXT NOT NULL
+);
+DROP INDEX IF EXISTS idx_app_irrigation_events_user_ts;
+DROP INDEX IF EXISTS idx_app_irrigation_events_user_type_ts;
+CREATE INDEX IF NOT EXISTS idx_app_irrigation_events_user_ts_id
+    ON app_irrigation_events (user_id, ts, id);
+CREATE INDEX IF NOT EXISTS idx_app_irrigation_events_user_type_ts_id
+    ON app_irrigation_events (user_id, type, ts, id);
+"""
+
+
+def _encode_default(value):
+    if isinstance(value, datetime.datetime):
+        return {'$datetime': value.isoformat()}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _decode_hook(obj):
+    if len(obj) == 1 and '$datetime' in obj:
+        return datetime.datetime.fromisoformat(obj['$datetime'])
+    return obj
+
+
+def _dumps(document):
+    return json.dumps(document, default=_encode_default, ensure_ascii=False)
+
+
+def _loads(data):
+    return json.loads(data, object_hook=_decode_hook)
+
+
+def _ts(value):
+    return value.timestamp()
+
+
+class SQLiteBackend(StorageBackend):
+    """Single-file backend for air-gapped gateways: documents are stored as
+    JSON, with timestamp/type columns indexed for paging"""
+
+    name = 'sqlite'
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        """One connection per thread; WAL lets readers run beside the writer"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextlib.contextmanager
+    def _write_transaction(self):
+        """This thread's connection holding the write lock (BEGIN IMMEDIATE)
+        until the block ends, so a read-modify-write of a user document does
+        not lose a concurrent update; committed unless the block raises"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+    # --- Users ---
+    def create_user(self, user_doc, credentials):
+        try:
+            with self._conn() as conn:
+                # The primary key rejects a taken login and rolls the user back
+                conn.execute("INSERT INTO app_credentials (email_or_phone, data) VALUES (?, ?)",
+                             (user_doc['email_or_phone'], _dumps(credentials)))
+                conn.execute("INSERT INTO app_users (user_id, data) VALUES (?, ?)",
+                             (user_doc['user_id'], _dumps(user_doc)))
+        except sqlite3.IntegrityError:
+            raise UserExistsError(user_doc['email_or_phone'])
+
+    def get_user(self, user_id):
+        row = self._conn().execute("SELECT data FROM app_users WHERE user_id = ?", (user_id,)).fetchone()
+        return _loads(row[0]) if row else None
+
+    def update_user(self, user_id, fields):
+        with self._write_transaction() as conn:
+            self._update_user(conn, user_id, lambda user: user.update(fields))
+
+    def _update_user(self, conn, user_id, mutate):
+        # Inside _write_transaction(): the SELECT alone would not start one
+        row = conn.execute("SELECT data FROM app_users WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"No user document {user_id}")
+        user = _loads(row[0])
+        mutate(user)
+        conn.execute("UPDATE app_users SET data = ? WHERE user_id = ?", (_dumps(user), user_id))
+
+    def get_credentials(self, email_or_phone):
+        row = self._conn().execute(
+            "SELECT data FROM app_credentials WHERE email_or_phone = ?", (email_or_phone,)).fetchone()
+        return _loads(row[0]) if row else None
+
+    def set_credentials(self, email_or_phone, credentials):
+        with self._conn() as conn:
+            updated = conn.execute("UPDATE app_credentials SET data = ? WHERE email_or_phone = ?",
+                                   (_dumps(credentials), email_or_phone)).rowcount
+        if not updated:
+            raise KeyError(f"No credentials for {email_or_phone}")
+
+    def list_user_ids(self):
+        return [row[0] for row in self._conn().execute("SELECT user_id FROM app_users")]
+
+    # --- Notifications ---
+    def notifications_page(self, user_id, limit, before=None):
+        sql = "SELECT data FROM app_notifications WHERE user_id = ?"
+        params = [user_id]
+        if before is not None:
+            sql += " AND (ts, id) < (?, ?)"
+            params.extend((_ts(before[0]), before[1]))
+        sql += " ORDER BY ts DESC, id DESC LIMIT ?"
+        params.append(limit)
+        return [_loads(row[0]) for row in self._conn().execute(sql, params)]
+
+    def mark_all_notifications_read(self, user_id):
+        with self._write_transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, data FROM app_notifications WHERE user_id = ? AND read = 0", (user_id,)).fetchall()
+            for notification_id, data in rows:
+                notification = _loads(data)
+                notification['read'] = True
+                conn.execute("UPDATE app_notifications SET read = 1, data = ? WHERE id = ?",
+                             (_dumps(notification), notification_id))
+            self._update_user(conn, user_id, lambda user: user.update(unread_notifications=0))
+
+    # --- Irrigation events ---
+    def add_irrigation_event(self, user_id, event):
+        with self._conn() as conn:
+            # Plain INSERT: the primary key keeps the log append-only
+            conn.execute(
+                "INSERT INTO app_irrigation_events (id, user_id, type, ts, data) VALUES (?, ?, ?, ?, ?)",
+                (event['id'], user_id, event['type'], _ts(event['timestamp']), _dumps(event)))
+
+    def irrigation_events_page(self, user_id, limit, before=None, start=None, end=None, event_types=None):
+        sql = "SELECT data FROM app_irrigation_events WHERE user_id = ?"
+        params = [user_id]
+        if event_types:
+            sql += f" AND type IN ({', '.join('?' for _ in event_types)})"
+            params.extend(event_types)
+        if before is not None:
+            sql += " AND (ts, id) < (?, ?)"
+            params.extend((_ts(before[0]), before[1]))
+        for op, bound in (('>=', start), ('<', end)):
+            if bound is not None:
+                sql += f" AND ts {op} ?"
+                params.append(_ts(bound))
+        sql += " ORDER BY ts DESC, id DESC LIMIT ?"
+        params.append(limit)
+        return [_loads(row[0]) for row in self._conn().execute(sql, params)]
+
+    # --- Batches ---
+    def apply_writes(self, writes):
+        with self._write_transaction() as conn:
+            for op, user_id, document in writes:
+                if op == 'add_notification':
+                    inserted = conn.execute(
+                        "INSERT OR IGNORE INTO app_notifications (id, user_id, ts, read, data) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (document['id'], user_id, _ts(document['timestamp']),
+                         int(document.get('read', False)), _dumps(document))).rowcount
+                    # A replayed notification is not counted twice
+                    if inserted:
+                        self._update_user(conn, user_id, lambda user: user.update(
+                            unread_notifications=user.get('unread_notifications', 0) + 1))
+                elif op == 'add_irrigation_event':
+                    conn.execute(
+                        "INSERT OR REPLACE INTO app_irrigation_events (id, user_id, type, ts, data) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (document['id'], user_id, document['type'], _ts(document['timestamp']),
+                         _dumps(document)))
+                else:
+                    raise ValueError(f"Unknown write operation: {op}")
+
+    def test_connection(self):
+        try:
+            self._conn().execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error as e:
+            log.error("Test de connexion SQLite échoué: %s", e)
+            return False
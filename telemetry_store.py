@@ -0,0 +1,284 @@
+import sqlite3
+import threading
+from collections import deque
+
+from app_logging import get_logger
+from sensor_reading import SensorReading
+
+log = get_logger('telemetry_store')
+
+# Sensor telemetry lives in the same SQLite file as the `devices` table
+DB_PATH = "database.db"
+
+# Numeric metrics persisted for every reading
+METRICS = ('temperature', 'humidite', 'sol')
+
+# Rollup resolutions (name -> bucket width in seconds)
+ROLLUP_RESOLUTIONS = {
+    '1m': 60,
+    '1h': 3600,
+    '1d': 86400,
+}
+
+# Readings kept in memory per device for the live chart
+RECENT_WINDOW = 500
+
+# Batched writes: flush when this many readings are pending or after this delay
+FLUSH_BATCH_SIZE = 200
+FLUSH_INTERVAL = 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sensor_readings (
+    device_id TEXT NOT NULL,
+    ts REAL NOT NULL,
+    temperature REAL,
+    humidite REAL,
+    sol REAL
+);
+CREATE INDEX IF NOT EXISTS idx_sensor_readings_device_ts
+    ON sensor_readings (device_id, ts);
+CREATE TABLE IF NOT EXISTS sensor_rollups (
+    device_id TEXT NOT NULL,
+    resolution TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    sum REAL NOT NULL,
+    min REAL NOT NULL,
+    max REAL NOT NULL,
+    PRIMARY KEY (device_id, resolution, metric, bucket)
+) WITHOUT ROWID;
+"""
+
+UPSERT_ROLLUP = """
+INSERT INTO sensor_rollups (device_id, resolution, metric, bucket, count, sum, min, max)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (device_id, resolution, metric, bucket) DO UPDATE SET
+    count = count + excluded.count,
+    sum = sum + excluded.sum,
+    min = MIN(min, excluded.min),
+    max = MAX(max, excluded.max)
+"""
+
+
+def connect(db_path=DB_PATH):
+    """Open a SQLite connection tuned for concurrent readers and one writer"""
+    conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class TelemetryStore:
+    """Per-device sensor history with batched inserts, an in-memory recent
+    window and precomputed 1m/1h/1d rollups."""
+
+    def __init__(self, db_path=DB_PATH, recent_window=RECENT_WINDOW,
+                 flush_batch_size=FLUSH_BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.recent_window = recent_window
+        self.flush_batch_size = flush_batch_size
+        self.flush_interval = flush_interval
+
+        self._recent = {}
+        # Set when another process ingests the readings (cluster follower):
+        # recent() then reads the database instead of the in-memory window
+        self.read_through = False
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        # Opened on first use so constructing the store does no I/O
+        self._conn = None
+        self._conn_lock = threading.Lock()
+
+    def _writer_conn(self):
+        """Writer connection, creating the schema on first use"""
+        if self._conn is None:
+            with self._conn_lock:
+                if self._conn is None:
+                    conn = connect(self.db_path)
+                    conn.executescript(SCHEMA)
+                    conn.commit()
+                    self._conn = conn
+        return self._conn
+
+    # --- Writes ---
+    def add(self, device_id, reading):
+        """Record one SensorReading; it is visible in `recent()` immediately
+        and persisted on the next flush"""
+        with self._lock:
+            hydrate = device_id not in self._recent and not self.read_through
+        if hydrate:
+            # First reading of the device since start: load its stored history
+            # first, or recent() would only ever see what arrived since
+            self._load_recent(device_id)
+        with self._lock:
+            self._recent_for(device_id).append(reading)
+            self._pending.append((device_id, reading.ts, [getattr(reading, m) for m in METRICS]))
+            should_flush = len(self._pending) >= self.flush_batch_size
+        if should_flush:
+            self._wakeup.set()
+        return reading
+
+    def flush(self):
+        """Write pending readings and their rollups in one transaction. If the
+        write fails the batch goes back in front of the pending readings, to be
+        written on the next flush, and the error is raised"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+
+            rows = [(device_id, ts, *values) for device_id, ts, values in batch]
+            rollups = {}
+            for device_id, ts, values in batch:
+                for metric, value in zip(METRICS, values):
+                    if value is None:
+                        continue
+                    for resolution, width in ROLLUP_RESOLUTIONS.items():
+                        key = (device_id, resolution, metric, int(ts // width) * width)
+                        agg = rollups.get(key)
+                        if agg is None:
+                            rollups[key] = [1, value, value, value]
+                        else:
+                            agg[0] += 1
+                            agg[1] += value
+                            agg[2] = min(agg[2], value)
+                            agg[3] = max(agg[3], value)
+
+            try:
+                conn = self._writer_conn()
+                with conn:
+                    conn.executemany(
+                        "INSERT INTO sensor_readings (device_id, ts, temperature, humidite, sol) "
+                        "VALUES (?, ?, ?, ?, ?)", rows)
+                    conn.executemany(
+                        UPSERT_ROLLUP, [key + tuple(agg) for key, agg in rollups.items()])
+            except BaseException:
+                # Rolled back: keep the readings, older ones first
+                with self._lock:
+                    self._pending[:0] = batch
+                raise
+            return len(rows)
+
+    # --- Reads ---
+    def recent(self, device_id, limit=None):
+        """Latest readings for a device as dicts, oldest first, served from memory
+        (from the database when `read_through` is set)"""
+        if self.read_through:
+            return [reading.as_dict() for reading in self._query_recent(device_id, limit or self.recent_window)]
+        with self._lock:
+            window = self._recent.get(device_id)
+        if window is None:
+            window = self._load_recent(device_id)
+        items = list(window)
+        return [reading.as_dict() for reading in (items[-limit:] if limit else items)]
+
+    def latest(self, device_id):
+        """Most recent reading for a device, or None"""
+        items = self.recent(device_id, limit=1)
+        return items[0] if items else None
+
+    def query_range(self, device_id, metric, start, end, resolution=None):
+        """Return (ts, avg, min, max) points for `metric` between `start` and
+        `end` (epoch seconds). `resolution` is 'raw' or a rollup name; when
+        omitted the coarsest one keeping enough detail for the span is used."""
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric: {metric}")
+        resolution = resolution or self.pick_resolution(end - start)
+        self._writer_conn()
+        conn = connect(self.db_path)
+        try:
+            if resolution == 'raw':
+                rows = conn.execute(
+                    f"SELECT ts, {metric}, {metric}, {metric} FROM sensor_readings "
+                    f"WHERE device_id = ? AND ts >= ? AND ts < ? AND {metric} IS NOT NULL "
+                    "ORDER BY ts", (device_id, start, end)).fetchall()
+            else:
+                width = ROLLUP_RESOLUTIONS[resolution]
+                rows = conn.execute(
+                    "SELECT bucket, sum / count, min, max FROM sensor_rollups "
+                    "WHERE device_id = ? AND resolution = ? AND metric = ? "
+                    "AND bucket >= ? AND bucket < ? ORDER BY bucket",
+                    (device_id, resolution, metric,
+                     int(start // width) * width, end)).fetchall()
+        finally:
+            conn.close()
+        return rows
+
+    @staticmethod
+    def pick_resolution(span_seconds, max_points=2000):
+        """Coarsest resolution that still yields about `max_points` buckets"""
+        if span_seconds <= 6 * 3600:
+            return 'raw'
+        for resolution, width in sorted(ROLLUP_RESOLUTIONS.items(), key=lambda r: r[1]):
+            if span_seconds / width <= max_points:
+                return resolution
+        return '1d'
+
+    def set_read_through(self, enabled):
+        """Switch recent() between the database and the in-memory windows"""
+        with self._lock:
+            self.read_through = enabled
+            # Windows filled before the switch miss what another process wrote
+            self._recent.clear()
+
+    # --- Background writer ---
+    def start(self):
+        """Start the background flush thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="telemetry-writer", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """Stop the flush thread and write whatever is still pending"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                log.exception("Telemetry flush failed, retried on the next tick: %s", e)
+
+    # --- Helpers ---
+    def _recent_for(self, device_id):
+        window = self._recent.get(device_id)
+        if window is None:
+            window = self._recent[device_id] = deque(maxlen=self.recent_window)
+        return window
+
+    def _query_recent(self, device_id, limit):
+        """Latest `limit` stored readings of a device, oldest first"""
+        self._writer_conn()
+        conn = connect(self.db_path)
+        try:
+            rows = conn.execute(
+                "SELECT ts, temperature, humidite, sol FROM sensor_readings "
+                "WHERE device_id = ? ORDER BY ts DESC LIMIT ?",
+                (device_id, limit)).fetchall()
+        finally:
+            conn.close()
+        return [SensorReading(*row) for row in reversed(rows)]
+
+    def _load_recent(self, device_id):
+        """Hydrate the in-memory window for a device from the database"""
+        window = deque(self._query_recent(device_id, self.recent_window), maxlen=self.recent_window)
+        with self._lock:
+            # A concurrent add() may have created the window in the meantime
+            existing = self._recent.get(device_id)
+            if existing is not None:
+                return existing
+            self._recent[device_id] = window
+        return window
@@ -0,0 +1,43 @@
+"""Queued application logging.
+
+    python -m pytest test_app_logging.py
+"""
+import io
+import json
+
+import pytest
+
+from app_logging import configure_logging, get_logger, shutdown_logging
+
+
+@pytest.fixture
+def output():
+    stream = io.StringIO()
+    configure_logging('DEBUG', 'json', stream=stream, rate_limit=False)
+    yield stream
+    shutdown_logging()
+
+
+def entries(stream):
+    shutdown_logging()
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_exception_traceback_reaches_the_json_formatter(output):
+    try:
+        {}['missing']
+    except KeyError:
+        get_logger('test').exception("Echec de %s", 'lecture', extra={'device_id': 'dev'})
+    entry, = entries(output)
+    assert entry['msg'] == "Echec de lecture"
+    assert entry['device_id'] == 'dev'
+    assert entry['exc'].startswith('Traceback') and "KeyError: 'missing'" in entry['exc']
+
+
+def test_arguments_are_merged_when_logging(output):
+    values = ['before']
+    get_logger('test').info("Valeurs: %s", values)
+    values.append('after')
+    entry, = entries(output)
+    assert entry['msg'] == "Valeurs: ['before']"
+    assert 'exc' not in entry
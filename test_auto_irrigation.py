@@ -0,0 +1,58 @@
+"""Automatic irrigation rules and the pump state they assume.
+
+    python -m pytest test_auto_irrigation.py
+"""
+import pytest
+
+from auto_irrigation import START, STOP, AutoIrrigationEngine
+
+DEVICE = {'device_id': 'dev', 'user_id': 'u1'}
+
+
+@pytest.fixture
+def engine():
+    clock = [1000.0]
+    sent = []
+    engine = AutoIrrigationEngine(lambda rule, command, moisture: sent.append(command),
+                                  min_on_time=60, min_off_time=300, clock=lambda: clock[0])
+    engine.set_thresholds(DEVICE, {'enabled': True, 'min_moisture': 30, 'max_moisture': 60})
+    engine.sent, engine.now = sent, clock
+    return engine
+
+
+def test_unknown_state_stops_a_pump_left_running(engine):
+    assert engine.evaluate('dev', 45) is None
+    assert engine.evaluate('dev', 70) == STOP
+
+
+def test_reported_state_is_used(engine):
+    engine.note_reported_state('dev', False)
+    assert engine.evaluate('dev', 70) is None
+    assert engine.evaluate('dev', 20) == START
+
+
+def test_rejected_command_is_rolled_back_and_resent(engine):
+    engine.note_reported_state('dev', False)
+    assert engine.evaluate('dev', 20) == START
+    engine.note_command_outcome('dev', START, False)
+    assert engine.rules()[0].pump_on is False
+    assert engine.evaluate('dev', 20) is None
+    engine.now[0] += 300
+    assert engine.evaluate('dev', 20) == START
+
+
+def test_unanswered_command_makes_the_state_unknown(engine):
+    engine.note_reported_state('dev', True)
+    assert engine.evaluate('dev', 70) == STOP
+    engine.note_command_outcome('dev', STOP, None)
+    assert engine.rules()[0].pump_on is None
+    engine.now[0] += 60
+    assert engine.evaluate('dev', 70) == STOP
+
+
+def test_outcome_of_a_replaced_command_is_ignored(engine):
+    engine.note_reported_state('dev', False)
+    assert engine.evaluate('dev', 20) == START
+    engine.note_pump_state('dev', False)
+    engine.note_command_outcome('dev', START, None)
+    assert engine.rules()[0].pump_on is False
@@ -0,0 +1,147 @@
+"""Acks, retries, expiry and the offline queue of CommandDispatcher.
+
+    python -m pytest test_command_dispatcher.py
+"""
+import json
+
+import pytest
+
+from command_dispatcher import (ACKED, EXPIRED, FAILED, QUEUED, REJECTED, SENT, UNCONFIRMED,
+                                CommandDispatcher)
+
+
+class Broker:
+    """Records publishes; refuses them while `up` is False"""
+
+    def __init__(self):
+        self.up = True
+        self.published = []
+
+    def __call__(self, topic, payload, qos):
+        if self.up:
+            self.published.append((topic, payload))
+        return self.up
+
+
+@pytest.fixture
+def broker():
+    return Broker()
+
+
+@pytest.fixture
+def clock():
+    return [1000.0]
+
+
+@pytest.fixture
+def dispatcher(broker, clock):
+    results = []
+    dispatcher = CommandDispatcher(broker, on_result=results.append, ack_timeout=5, max_attempts=3,
+                                   queue_ttl=60, clock=lambda: clock[0])
+    dispatcher.results = results
+    return dispatcher
+
+
+def ack(cmd, **fields):
+    return json.dumps(dict({'id': cmd.id}, **fields)).encode()
+
+
+def acking(dispatcher, device_id):
+    """Make a device known to send acks"""
+    dispatcher.handle_ack(device_id, b'STOP')
+
+
+def test_ack_by_id_settles_the_command(dispatcher, broker, clock):
+    cmd = dispatcher.send('dev', 'irrigateq/t/commands', 'START')
+    assert cmd.status == SENT
+    assert json.loads(broker.published[0][1]) == {'id': cmd.id, 'command': 'START'}
+    clock[0] += 0.25
+    assert dispatcher.handle_ack('dev', ack(cmd)) is cmd
+    assert (cmd.status, cmd.latency, cmd.done.is_set()) == (ACKED, 0.25, True)
+    assert dispatcher.results == [cmd]
+    assert dispatcher.stats()['outstanding'] == 0
+    assert dispatcher.latency_stats()['dev']['p50_ms'] == 250.0
+
+
+def test_bare_ack_settles_the_oldest_matching_command(dispatcher, broker):
+    start = dispatcher.send('dev', 't', 'START', legacy=True)
+    stop = dispatcher.send('dev', 't', 'STOP', legacy=True)
+    assert [payload for _, payload in broker.published] == ['START', 'STOP']
+    assert dispatcher.handle_ack('dev', b'STOP\n') is stop
+    assert (start.status, stop.status) == (SENT, ACKED)
+    assert dispatcher.handle_ack('dev', b'STOP') is None
+    assert dispatcher.stats()['unmatched_acks'] == 1
+
+
+def test_rejected_ack(dispatcher):
+    cmd = dispatcher.send('dev', 't', 'START')
+    dispatcher.handle_ack('dev', ack(cmd, status='error', error='tank empty'))
+    assert (cmd.status, cmd.error) == (REJECTED, 'tank empty')
+    assert dispatcher.results == [cmd]
+
+
+def test_acking_device_is_retried_then_failed(dispatcher, broker, clock):
+    acking(dispatcher, 'dev')
+    cmd = dispatcher.send('dev', 't', 'START')
+    for attempts in (2, 3):
+        clock[0] += 5
+        assert dispatcher.tick() == []
+        assert cmd.attempts == attempts
+    clock[0] += 5
+    assert dispatcher.tick() == [cmd]
+    assert (cmd.status, cmd.attempts, len(broker.published)) == (FAILED, 3, 3)
+    assert dispatcher.stats()['retries'] == 2
+
+
+def test_device_without_acks_is_sent_once_and_unconfirmed(dispatcher, broker, clock):
+    cmd = dispatcher.send('dev', 't', 'START', legacy=True)
+    clock[0] += 4.9
+    assert dispatcher.tick() == []
+    clock[0] += 0.1
+    assert dispatcher.tick() == [cmd]
+    assert (cmd.status, cmd.attempts, len(broker.published)) == (UNCONFIRMED, 1, 1)
+    assert dispatcher.results == [cmd]
+
+
+def test_offline_device_gets_its_queue_in_order_when_back(dispatcher, broker, clock):
+    dispatcher.set_online('dev', False)
+    first = dispatcher.send('dev', 't', 'START')
+    second = dispatcher.send('dev', 't', 'STOP')
+    clock[0] += 30
+    dispatcher.tick()
+    assert broker.published == [] and first.status == QUEUED
+    dispatcher.set_online('dev', True)
+    assert [json.loads(payload)['id'] for _, payload in broker.published] == [first.id, second.id]
+    assert dispatcher.stats()['queued_offline'] == 2
+
+
+def test_queued_command_expires(dispatcher, broker, clock):
+    dispatcher.set_online('dev', False)
+    cmd = dispatcher.send('dev', 't', 'START')
+    clock[0] += 60
+    assert dispatcher.tick() == [cmd]
+    dispatcher.set_online('dev', True)
+    assert (cmd.status, broker.published) == (EXPIRED, [])
+
+
+def test_sent_command_is_held_while_the_device_is_offline(dispatcher, broker, clock):
+    acking(dispatcher, 'dev')
+    cmd = dispatcher.send('dev', 't', 'START')
+    dispatcher.set_online('dev', False)
+    clock[0] += 5
+    dispatcher.tick()
+    assert (cmd.status, len(broker.published)) == (QUEUED, 1)
+    dispatcher.set_online('dev', True)
+    assert (cmd.status, cmd.attempts, len(broker.published)) == (SENT, 2, 2)
+
+
+def test_unreachable_broker_is_not_an_attempt(dispatcher, broker, clock):
+    acking(dispatcher, 'dev')
+    broker.up = False
+    cmd = dispatcher.send('dev', 't', 'START')
+    clock[0] += 5
+    dispatcher.tick()
+    assert (cmd.status, cmd.attempts) == (QUEUED, 0)
+    broker.up = True
+    dispatcher.tick()
+    assert (cmd.status, cmd.attempts, len(broker.published)) == (SENT, 1, 1)
@@ -0,0 +1,40 @@
+"""Argument checks of /api/history.
+
+    python -m pytest test_history_api.py
+"""
+import pytest
+
+
+@pytest.fixture(scope='module')
+def client(tmp_path_factory):
+    # The app's SQLite files and uploads are relative to the working directory,
+    # and its stores keep their connections: one directory for the whole module
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(tmp_path_factory.mktemp('app'))
+        import app as app_module
+        app = app_module.create_app({'STORAGE_BACKEND': 'memory', 'START_SERVICES': False,
+                                     'LOG_LEVEL': 'CRITICAL', 'TESTING': True})
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = 'history-user'
+        yield client
+
+
+@pytest.mark.parametrize('args', [
+    {'from': 'nan'},
+    {'from': 'inf'},
+    {'from': '-inf', 'to': 'inf'},
+    {'to': 'NaN'},
+    {'from': 'yesterday'},
+    {'points': 'many'},
+])
+def test_invalid_time_arguments_are_rejected(client, args):
+    response = client.get('/api/history', query_string=args)
+    assert response.status_code == 400
+    assert response.get_json() == {"status": "error", "message": "Invalid from, to or points"}
+
+
+def test_valid_range_is_accepted(client):
+    response = client.get('/api/history', query_string={'from': '0', 'to': '3600'})
+    assert response.status_code == 200
+    assert response.get_json()['points'] == []
@@ -0,0 +1,103 @@
+"""Validators, 304s and compression of HTTPCache.
+
+    python -m pytest test_http_cache.py
+"""
+import gzip
+
+import pytest
+from flask import Flask, jsonify
+
+import http_cache
+from http_cache import CACHE_CONTROL, HTTPCache, etag_for
+
+BODY = {'values': list(range(500))}
+
+
+@pytest.fixture
+def cache():
+    return HTTPCache()
+
+
+@pytest.fixture
+def client(cache, tmp_path):
+    (tmp_path / 'style.css').write_text('body { color: green; }\n' * 200)
+    app = Flask(__name__, static_folder=None)
+    app.after_request(cache.finalize)
+    built = []
+
+    @app.route('/data')
+    def data():
+        def build():
+            built.append(1)
+            return jsonify(BODY)
+        return cache.conditional(etag_for('data', 1), build)
+
+    @app.route('/small')
+    def small():
+        return jsonify(ok=True)
+
+    @app.route('/static/<path:filename>')
+    def static_file(filename):
+        return cache.send_static(str(tmp_path), filename)
+
+    client = app.test_client()
+    client.built = built
+    return client
+
+
+def test_matching_etag_gets_a_304_without_building_the_body(client):
+    first = client.get('/data')
+    assert first.status_code == 200 and client.built == [1]
+    assert first.headers['Cache-Control'] == CACHE_CONTROL['api']
+    etag = first.headers['ETag']
+
+    again = client.get('/data', headers={'If-None-Match': etag})
+    assert again.status_code == 304 and again.data == b''
+    assert again.headers['ETag'] == etag
+    assert client.built == [1]
+
+
+def test_gzip_when_accepted(client, monkeypatch):
+    monkeypatch.setattr(http_cache, 'brotli', None)
+    response = client.get('/data', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert response.headers['ETag'].startswith('W/')
+    assert gzip.decompress(response.data) == client.get('/data').data
+
+
+def test_identity_when_not_accepted_or_small(client):
+    assert 'Content-Encoding' not in client.get('/data').headers
+    assert 'Content-Encoding' not in client.get('/small', headers={'Accept-Encoding': 'gzip'}).headers
+
+
+def test_brotli_preferred_when_installed(client, cache):
+    if http_cache.brotli is None:
+        pytest.skip("brotli is not installed")
+    response = client.get('/data', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert http_cache.brotli.decompress(response.data) == client.get('/data').data
+
+
+def test_weak_etag_of_a_compressed_body_still_validates(client):
+    compressed = client.get('/data', headers={'Accept-Encoding': 'gzip'})
+    again = client.get('/data', headers={'Accept-Encoding': 'gzip', 'If-None-Match': compressed.headers['ETag']})
+    assert again.status_code == 304
+
+
+def test_static_file_has_a_content_etag_and_is_compressed_once(client, cache):
+    first = client.get('/static/style.css', headers={'Accept-Encoding': 'gzip'})
+    assert first.status_code == 200 and first.headers['Content-Encoding'] == 'gzip'
+    assert first.headers['Cache-Control'] == CACHE_CONTROL['static']
+    second = client.get('/static/style.css', headers={'Accept-Encoding': 'gzip'})
+    assert second.data == first.data
+    assert cache.stats()['compressed_reused'] == 1
+
+    revalidated = client.get('/static/style.css', headers={'Accept-Encoding': 'gzip',
+                                                           'If-None-Match': first.headers['ETag']})
+    assert revalidated.status_code == 304
+
+
+def test_static_file_outside_the_folder_is_404(client):
+    assert client.get('/static/..%2Fsecret.txt').status_code == 404
+    assert client.get('/static/missing.css').status_code == 404
@@ -0,0 +1,90 @@
+"""Retention ranking and eviction of uploaded images.
+
+    python -m pytest test_image_retention.py
+"""
+import pytest
+
+from image_index import ImageIndex
+from image_retention import DAY, RetentionManager, RetentionPolicy
+from image_store import ImageStore
+
+NOW = 100 * DAY
+OFF = RetentionPolicy(max_images=0, max_bytes=0, max_age=0, downsample_after=0)
+
+
+@pytest.fixture
+def index(tmp_path):
+    (tmp_path / 'uploads').mkdir()
+    return ImageIndex(db_path=str(tmp_path / 'images.db'), upload_folder=str(tmp_path / 'uploads'))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ImageStore(root=str(tmp_path / 'uploads'))
+
+
+def manager(index, store, policy=OFF, **options):
+    return RetentionManager(index, store, policy=policy, clock=lambda: NOW, **options)
+
+
+def test_count_keeps_the_newest_per_user(index, store):
+    for i in range(5):
+        index.add(f'a{i}.jpg', user_id='u1', uploaded_at=NOW - 10 * (5 - i))
+        index.add(f'b{i}.jpg', user_id='u2', uploaded_at=NOW - 10 * (5 - i))
+    retention = manager(index, store)
+    retention.set_policy('user', 'u1', RetentionPolicy(max_images=3, max_bytes=0, max_age=0, downsample_after=0))
+    assert retention.plan() == {'a0.jpg': 'count', 'a1.jpg': 'count'}
+
+
+def test_bytes_are_counted_from_the_newest(index, store):
+    for i, size in enumerate([400, 300, 200, 100]):
+        index.add(f'{i}.jpg', user_id='u1', uploaded_at=NOW - 100 + i, size=size)
+    retention = manager(index, store, RetentionPolicy(max_images=0, max_bytes=600, max_age=0, downsample_after=0))
+    # Newest first: 100, 300, 600 fit; the oldest takes the total to 1000
+    assert retention.plan() == {'0.jpg': 'bytes'}
+
+
+def test_age_and_downsampling(index, store):
+    index.add('ancient.jpg', user_id='u1', uploaded_at=NOW - 50 * DAY)
+    old_day = (NOW - 20 * DAY) // DAY * DAY
+    for hour in (1, 5, 9):
+        index.add(f'old-{hour}.jpg', user_id='u1', uploaded_at=old_day + hour * 3600)
+    for hour in (1, 5):
+        index.add(f'new-{hour}.jpg', user_id='u1', uploaded_at=NOW - hour * 3600)
+    retention = manager(index, store, RetentionPolicy(max_images=0, max_bytes=0, max_age=40 * DAY,
+                                                      downsample_after=10 * DAY))
+    assert retention.plan() == {'ancient.jpg': 'age', 'old-1.jpg': 'downsample', 'old-5.jpg': 'downsample'}
+
+
+def test_device_policy_ranks_only_that_device(index, store):
+    for i in range(3):
+        index.add(f'cam{i}.jpg', user_id='u1', device_id='cam', uploaded_at=NOW - 10 + i)
+        index.add(f'other{i}.jpg', user_id='u1', device_id='other', uploaded_at=NOW - 10 + i)
+    retention = manager(index, store)
+    retention.set_policy('device', 'cam', RetentionPolicy(max_images=1, max_bytes=0, max_age=0, downsample_after=0))
+    assert retention.plan() == {'cam0.jpg': 'count', 'cam1.jpg': 'count'}
+    with pytest.raises(ValueError):
+        retention.set_policy('farm', 'x', OFF)
+
+
+def test_run_once_deletes_only_unshared_blobs_and_reports_the_backlog(index, store, tmp_path):
+    uploads = tmp_path / 'uploads'
+    shared, single = 'a' * 64 + '.jpg', 'b' * 64 + '.jpg'
+    (uploads / shared).write_bytes(b'x' * 10)
+    (uploads / single).write_bytes(b'y' * 20)
+    index.add('1.jpg', user_id='u1', uploaded_at=NOW - 4, blob=single, size=20)
+    index.add('2.jpg', user_id='u1', uploaded_at=NOW - 3, blob=shared, size=10)
+    index.add('3.jpg', user_id='u1', uploaded_at=NOW - 2, blob=shared, size=10)
+    index.add('4.jpg', user_id='u1', uploaded_at=NOW - 1, blob=shared, size=10)
+    retention = manager(index, store, RetentionPolicy(max_images=1, max_bytes=0, max_age=0, downsample_after=0),
+                        batch_size=2)
+
+    assert retention.run_once() == 2
+    assert not (uploads / single).exists() and (uploads / shared).exists()
+    stats = retention.stats()
+    assert (stats['evicted_count'], stats['blobs_deleted'], stats['bytes_freed'], stats['backlog']) == (2, 1, 20, 1)
+
+    assert retention.run_once() == 1
+    assert (uploads / shared).exists()
+    assert retention.stats()['backlog'] == 0
+    assert [image['filename'] for image in index.recent(user_id='u1')] == ['4.jpg']
@@ -0,0 +1,41 @@
+"""Access to /metrics.
+
+    python -m pytest test_metrics_api.py
+"""
+import pytest
+
+REMOTE = {'REMOTE_ADDR': '203.0.113.7'}
+
+
+@pytest.fixture(scope='module')
+def client(tmp_path_factory):
+    # The app's SQLite files and uploads are relative to the working directory,
+    # and its stores keep their connections: one directory for the whole module
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(tmp_path_factory.mktemp('app'))
+        import app as app_module
+        app = app_module.create_app({'STORAGE_BACKEND': 'memory', 'START_SERVICES': False,
+                                     'LOG_LEVEL': 'CRITICAL', 'TESTING': True})
+        yield app.test_client()
+
+
+@pytest.fixture
+def token(client, monkeypatch):
+    def set_token(value):
+        monkeypatch.setitem(client.application.config, 'METRICS_TOKEN', value)
+    return set_token
+
+
+def test_without_a_token_only_local_clients_are_served(client, token):
+    token(None)
+    assert client.get('/metrics').status_code == 200
+    assert client.get('/metrics', environ_base=REMOTE).status_code == 403
+
+
+def test_token_is_required_from_every_client(client, token):
+    token('s3cret')
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', environ_base=REMOTE, headers={'Authorization': 'Bearer nope'}).status_code == 401
+    response = client.get('/metrics', environ_base=REMOTE, headers={'Authorization': 'Bearer s3cret'})
+    assert response.status_code == 200
+    assert b'mqtt_messages_received_total' in response.data
@@ -0,0 +1,53 @@
+"""Keyset pagination of notifications and irrigation events.
+
+    python -m pytest test_pagination.py
+"""
+from datetime import datetime
+
+import pytest
+
+import firebase_config
+from storage.memory_backend import MemoryBackend
+from storage.sqlite_backend import SQLiteBackend
+
+TIMESTAMP = datetime(2026, 1, 1, 12, 0, 0)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def user_id(request, tmp_path):
+    backend = MemoryBackend() if request.param == 'memory' else SQLiteBackend(str(tmp_path / 'pages.db'))
+    firebase_config.configure_storage(backend)
+    backend.create_user({'user_id': 'pager', 'email_or_phone': 'pager@example.com'},
+                        {'user_id': 'pager', 'password': ''})
+    yield 'pager'
+    firebase_config.configure_storage('memory')
+
+
+def all_pages(get_page, limit):
+    items, cursor = [], None
+    while True:
+        page, cursor = get_page(limit=limit, cursor=cursor)
+        items.extend(page)
+        if cursor is None:
+            return items
+
+
+def test_notifications_sharing_a_timestamp_span_pages(user_id):
+    backend = firebase_config.get_backend()
+    for i in range(5):
+        backend.add_notification(user_id, firebase_config._new_notification(f"n{i}", timestamp=TIMESTAMP))
+
+    items = all_pages(lambda **page: firebase_config.get_notifications_page(user_id, **page), limit=2)
+    assert sorted(n['text'] for n in items) == [f"n{i}" for i in range(5)]
+
+
+@pytest.mark.parametrize('event_types', [None, ['start', 'stop']])
+def test_irrigation_events_sharing_a_timestamp_span_pages(user_id, event_types):
+    backend = firebase_config.get_backend()
+    for i in range(6):
+        event = firebase_config._new_irrigation_event(('start', 'stop')[i % 2], {'n': i}, timestamp=TIMESTAMP)
+        backend.add_irrigation_event(user_id, event)
+
+    items = all_pages(lambda **page: firebase_config.get_irrigation_events_page(
+        user_id, event_types=event_types, **page), limit=4)
+    assert sorted(e['details']['n'] for e in items) == list(range(6))
@@ -0,0 +1,80 @@
+"""Binary and JSON sensor payloads.
+
+    python -m pytest test_sensor_codec.py
+"""
+import pytest
+
+from sensor_codec import (HEADER, MAX_SAMPLES, SAMPLE, PayloadError, decode_frame, decode_payload,
+                          encode_frame)
+from sensor_reading import SensorReading
+
+
+def fields(reading):
+    return (reading.ts, reading.temperature, reading.humidite, reading.sol, reading.sol_state)
+
+
+def test_frame_round_trip():
+    readings = [
+        SensorReading(1_700_000_000, temperature=22.5, humidite=48.25, sol=51.0),
+        SensorReading(1_700_000_030, temperature=-4.75, humidite=None, sol=None, sol_state='sec'),
+        SensorReading(1_700_000_060, temperature=None, humidite=100.0, sol=0.0, sol_state='humide'),
+    ]
+    frame = encode_frame(readings)
+    assert len(frame) == HEADER.size + 3 * SAMPLE.size
+    assert [fields(r) for r in decode_frame(frame)] == [fields(r) for r in readings]
+    assert [fields(r) for r in decode_payload(frame)] == [fields(r) for r in readings]
+
+
+def test_values_are_rounded_to_hundredths():
+    reading, = decode_frame(encode_frame([SensorReading(1_700_000_000, temperature=21.456, sol=33.333)]))
+    assert (reading.temperature, reading.sol) == (21.46, 33.33)
+
+
+def test_frame_without_clock_is_stamped_on_arrival():
+    frame = encode_frame([SensorReading(5, sol=40)], base_ts=0)
+    reading, = decode_frame(frame, now=1_700_000_123)
+    assert reading.ts == 1_700_000_123
+
+
+@pytest.mark.parametrize('readings', [
+    [],
+    [SensorReading(1_700_000_000, sol=40)] * (MAX_SAMPLES + 1),
+    [SensorReading(1_700_000_000, temperature=400)],
+    [SensorReading(1_700_000_000, temperature=-327.68)],
+    [SensorReading(1_700_000_000, sol=655.35)],
+    [SensorReading(1_700_000_000, sol=-1)],
+    [SensorReading(1_700_000_000, sol=40), SensorReading(1_700_100_000, sol=40)],
+])
+def test_values_outside_the_frame_are_refused(readings):
+    with pytest.raises(ValueError):
+        encode_frame(readings)
+
+
+def test_largest_frame_decodes():
+    readings = [SensorReading(1_700_000_000 + i, sol=i % 100) for i in range(MAX_SAMPLES)]
+    assert len(decode_frame(encode_frame(readings))) == MAX_SAMPLES
+
+
+@pytest.mark.parametrize('mutate', [
+    lambda frame: frame[:HEADER.size - 1],
+    lambda frame: frame[:-1],
+    lambda frame: frame + b'\0',
+    lambda frame: bytes([frame[0], 2]) + frame[2:],
+])
+def test_malformed_frames_are_rejected(mutate):
+    frame = encode_frame([SensorReading(1_700_000_000, sol=40)] * 2)
+    with pytest.raises(PayloadError):
+        decode_payload(mutate(frame))
+
+
+def test_json_object_and_array():
+    reading, = decode_payload(b'{"temperature": "22,5 \xc2\xb0C", "humidite": 48, "sol": "Sec"}', now=100)
+    assert fields(reading) == (100, 22.5, 48.0, None, 'sec')
+    readings = decode_payload(b'[{"ts": 50, "sol": 10}, {"sol": 20}]', now=100)
+    assert [(r.ts, r.sol) for r in readings] == [(50, 10.0), (100, 20.0)]
+
+
+@pytest.mark.parametrize('payload', [b'{"sol": ', b'42', b'[{"sol": 1}, 2]', b'"text"'])
+def test_invalid_json_is_rejected(payload):
+    with pytest.raises(PayloadError):
+        decode_payload(payload)
@@ -0,0 +1,42 @@
+"""Batched writes of the telemetry store.
+
+    python -m pytest test_telemetry_store.py
+"""
+import sqlite3
+
+import pytest
+
+from sensor_reading import SensorReading
+from telemetry_store import TelemetryStore, connect
+
+
+def stored_count(db_path):
+    conn = connect(db_path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM sensor_readings").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_readings_survive_a_locked_database(tmp_path):
+    db_path = str(tmp_path / 'telemetry.db')
+    store = TelemetryStore(db_path)
+    # Fail at once instead of waiting for the lock
+    store._writer_conn().execute("PRAGMA busy_timeout = 0")
+    store.add('dev', SensorReading(1000.0, temperature=20, sol=40))
+    store.add('dev', SensorReading(1001.0, temperature=21, sol=41))
+
+    other = connect(db_path)
+    other.execute("BEGIN IMMEDIATE")
+    with pytest.raises(sqlite3.OperationalError):
+        store.flush()
+    store.add('dev', SensorReading(1002.0, temperature=22, sol=42))
+    other.rollback()
+    other.close()
+
+    assert store.flush() == 3
+    assert stored_count(db_path) == 3
+    assert [p[0] for p in store.query_range('dev', 'sol', 0, 2000, resolution='raw')] == [1000.0, 1001.0, 1002.0]
+    # Rollups were written once, with the retried batch
+    assert store.query_range('dev', 'sol', 0, 2000, resolution='1h') == [(0, 41.0, 40.0, 42.0)]
+    assert store.flush() == 0
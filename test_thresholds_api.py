@@ -0,0 +1,41 @@
+"""Validation of /api/thresholds.
+
+    python -m pytest test_thresholds_api.py
+"""
+import pytest
+
+
+@pytest.fixture(scope='module')
+def client(tmp_path_factory):
+    # The app's SQLite files and uploads are relative to the working directory,
+    # and its stores keep their connections: one directory for the whole module
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(tmp_path_factory.mktemp('app'))
+        import app as app_module
+        app = app_module.create_app({'STORAGE_BACKEND': 'memory', 'START_SERVICES': False,
+                                     'LOG_LEVEL': 'CRITICAL', 'TESTING': True})
+        user_id = app_module.create_user({'nom': 'Seuils', 'prenom': 'Test', 'superficie': '1', 'plante': 'Tomate',
+                                          'email_or_phone': 'thresholds@example.com', 'password': 'test'})
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = user_id
+        yield client
+
+
+@pytest.mark.parametrize('band', [
+    {'min_moisture': 40, 'max_moisture': 42},
+    {'min_moisture': 40, 'max_moisture': 40},
+    {'min_moisture': 50, 'max_moisture': 40},
+    {'min_moisture': 'nan', 'max_moisture': 60},
+    {'min_moisture': 30},
+])
+def test_band_narrower_than_the_hysteresis_is_rejected(client, band):
+    response = client.post('/api/thresholds', json=dict(band, enabled=True))
+    assert response.status_code == 400
+    assert response.get_json()['status'] == 'error'
+
+
+def test_saved_band_is_the_one_returned(client):
+    response = client.post('/api/thresholds', json={'enabled': True, 'min_moisture': 30, 'max_moisture': 35})
+    assert response.status_code == 200
+    assert response.get_json()['thresholds'] == {'enabled': True, 'min_moisture': 30.0, 'max_moisture': 35.0}
@@ -0,0 +1,86 @@
+"""Write-behind queue: retries, dead letters and spool replay.
+
+    python -m pytest test_write_behind.py
+"""
+import json
+
+import pytest
+
+import firebase_config
+from storage.memory_backend import MemoryBackend
+from write_behind import WriteBehindQueue
+
+USER = {'user_id': 'u1', 'email_or_phone': 'wb@example.com'}
+
+
+@pytest.fixture
+def backend():
+    backend = MemoryBackend()
+    firebase_config.configure_storage(backend)
+    backend.create_user(dict(USER), {'user_id': USER['user_id'], 'password': ''})
+    yield backend
+    firebase_config.configure_storage('memory')
+
+
+def new_queue(tmp_path, apply_batch=firebase_config.apply_writes, **options):
+    options.setdefault('max_attempts', 2)
+    return WriteBehindQueue(apply_batch, spool_path=str(tmp_path / 'writes.spool'), base_backoff=0,
+                            is_permanent=firebase_config.is_permanent_write_error, **options)
+
+
+def spooled(path):
+    if not path.exists():
+        return []
+    return [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+
+
+def unread(backend):
+    return backend.get_user(USER['user_id']).get('unread_notifications', 0)
+
+
+def test_poisoned_write_is_dead_lettered_and_the_rest_stored(tmp_path, backend):
+    queue = new_queue(tmp_path)
+    queue.enqueue('add_notification', user_id='u1', text='one')
+    poison = queue.enqueue('add_notification', user_id='nobody', text='lost')
+    queue.enqueue('add_irrigation_event', user_id='u1', event_type='start', details={})
+
+    assert queue.flush() is True
+    assert unread(backend) == 1
+    assert len(backend.irrigation_events_page('u1', 10)) == 1
+    dead, = spooled(tmp_path / 'writes.spool.dead')
+    assert dead['id'] == poison and 'nobody' in dead['error']
+    assert spooled(tmp_path / 'writes.spool') == []
+    assert queue.stats()['dead_lettered'] == 1
+
+
+def test_unreachable_storage_keeps_writes_until_the_failure_limit(tmp_path, backend):
+    def storage_down(writes):
+        raise ConnectionError("unreachable")
+
+    queue = new_queue(tmp_path, storage_down, max_write_failures=3)
+    ids = [queue.enqueue('add_notification', user_id='u1', text=str(i)) for i in range(3)]
+    for _ in range(2):
+        assert queue.flush() is False
+        assert [w['id'] for w in spooled(tmp_path / 'writes.spool')] == ids
+        assert not (tmp_path / 'writes.spool.dead').exists()
+
+    # Third failed round: transient or not, the writes stop blocking the queue
+    queue.flush()
+    assert [w['id'] for w in spooled(tmp_path / 'writes.spool.dead')] == ids
+    assert queue.depth() == 0
+
+
+def test_spool_replay_after_a_crash_is_idempotent(tmp_path, backend):
+    queue = new_queue(tmp_path)
+    for i in range(3):
+        queue.enqueue('add_notification', user_id='u1', text=str(i))
+    # Stored, then the process died before compacting the spool
+    firebase_config.apply_writes(spooled(tmp_path / 'writes.spool'))
+    queue.close()
+
+    restarted = new_queue(tmp_path)
+    assert restarted.flush() is True
+    assert restarted.stats()['replayed'] == 3
+    assert unread(backend) == 3
+    assert len(backend.notifications_page('u1', 10)) == 3
+    assert spooled(tmp_path / 'writes.spool') == []
@@ -0,0 +1,256 @@
+import datetime
+import json
+import os
+import random
+import threading
+import uuid
+from collections import deque
+from itertools import islice
+
+from app_logging import get_logger
+
+log = get_logger('write_behind')
+
+# Local spool so queued writes survive a restart
+SPOOL_PATH = "write_behind.spool"
+
+# Flush when this many writes are queued or the oldest has waited this long
+MAX_BATCH_SIZE = 200
+MAX_DELAY = 1.0
+
+# Retries of a failing batch before its writes are tried one by one
+MAX_ATTEMPTS = 5
+# Rounds of one-by-one tries a write may fail (with errors that might be
+# transient) before it is dead-lettered, even when every other write fails too
+MAX_WRITE_FAILURES = 20
+BASE_BACKOFF = 0.5
+MAX_BACKOFF = 30.0
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def is_permanent_error(error):
+    """Errors a retry cannot fix (missing document, malformed write)"""
+    return isinstance(error, (LookupError, TypeError, ValueError))
+
+
+class WriteBehindQueue:
+    """Queue of storage writes flushed in batches by a background thread.
+
+    Each write is a JSON-serializable `{'id', 'op', 'args'}` record handed to
+    `apply_batch(writes)`, which must apply a list of them atomically. Writes
+    are appended to a spool file before `enqueue` returns and the spool is
+    compacted after every successful flush, so a restart replays whatever was
+    not yet stored. A write that keeps failing on its own is moved to
+    `<spool>.dead` instead of blocking the queue: at once when its error is
+    permanent (`is_permanent(error)`) or other writes succeed, else after
+    `max_write_failures` rounds.
+    """
+
+    def __init__(self, apply_batch, spool_path=SPOOL_PATH, max_batch_size=MAX_BATCH_SIZE,
+                 max_delay=MAX_DELAY, max_attempts=MAX_ATTEMPTS, max_write_failures=MAX_WRITE_FAILURES,
+                 base_backoff=BASE_BACKOFF, max_backoff=MAX_BACKOFF, is_permanent=is_permanent_error):
+        self.apply_batch = apply_batch
+        self.spool_path = spool_path
+        self.dead_letter_path = spool_path + ".dead"
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.max_write_failures = max_write_failures
+        self.is_permanent = is_permanent
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self._queue = deque()
+        # Write ID -> failed one-by-one rounds, for writes still queued
+        self._failures = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        # The spool is replayed and opened on first use, not at construction
+        self._spool = None
+        self.stats_counters = {
+            'enqueued': 0, 'flushed': 0, 'batches': 0, 'retries': 0,
+            'dead_lettered': 0, 'replayed': 0,
+        }
+
+    def set_spool_path(self, spool_path):
+        """Use another spool file (one per process when several share a folder);
+        only before the first write"""
+        with self._lock:
+            if self._spool is not None:
+                raise RuntimeError("Write-behind spool already open")
+            self.spool_path = spool_path
+            self.dead_letter_path = spool_path + ".dead"
+
+    def _open(self):
+        """Replay the spool left by a previous run and open it for appending
+        (caller holds the lock)"""
+        if self._spool is None:
+            replayed = self._load_spool()
+            self._queue.extendleft(reversed(replayed))
+            self.stats_counters['replayed'] += len(replayed)
+            self._spool = open(self.spool_path, 'a', encoding='utf-8')
+
+    # --- Producer side ---
+    def enqueue(self, op, **args):
+        """Queue a write and return its ID; never waits on storage"""
+        line = json.dumps({'id': uuid.uuid4().hex, 'op': op, 'args': args},
+                          default=_json_default, ensure_ascii=False)
+        write = json.loads(line)
+        with self._lock:
+            self._open()
+            self._spool.write(line + '\n')
+            self._spool.flush()
+            self._queue.append(write)
+            self.stats_counters['enqueued'] += 1
+            full = len(self._queue) >= self.max_batch_size
+        if full:
+            self._wakeup.set()
+        return write['id']
+
+    def depth(self):
+        """Number of writes not yet stored"""
+        return len(self._queue)
+
+    def stats(self):
+        """Queue depth and flush counters"""
+        with self._lock:
+            stats = dict(self.stats_counters)
+            stats['depth'] = len(self._queue)
+        return stats
+
+    # --- Flushing ---
+    def start(self):
+        """Start the background flush thread"""
+        with self._lock:
+            self._open()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def close(self, timeout=10):
+        """Flush what can be flushed and stop; anything left stays in the spool"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+        with self._lock:
+            if self._spool is not None:
+                self._spool.close()
+                self._spool = None
+
+    def flush(self):
+        """Store every queued write now; False if storage is unavailable"""
+        with self._flush_lock:
+            with self._lock:
+                self._open()
+            while True:
+                with self._lock:
+                    batch = list(islice(self._queue, self.max_batch_size))
+                if not batch:
+                    return True
+                pending = self._commit(batch)
+                if len(pending) == len(batch):
+                    return False
+                with self._lock:
+                    for _ in batch:
+                        self._queue.popleft()
+                    # Still failing: kept at the head, in order, for the next round
+                    self._queue.extendleft(reversed(pending))
+                    self._rewrite_spool()
+                if pending:
+                    return False
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.max_delay)
+            self._wakeup.clear()
+            self.flush()
+        self.flush()
+
+    def _commit(self, batch):
+        """Store a batch; return the writes still to retry (all of them if
+        storage looks unavailable)"""
+        for attempt in range(self.max_attempts):
+            try:
+                self.apply_batch(batch)
+                self._count('flushed', len(batch))
+                self._count('batches')
+                for write in batch:
+                    self._failures.pop(write['id'], None)
+                return []
+            except Exception as e:
+                self._count('retries')
+                log.warning("Write-behind: échec du lot de %d écritures (%s), tentative %d", len(batch), e, attempt + 1)
+                if self._stopped.wait(self._backoff(attempt)):
+                    return batch
+
+        # Tell poisoned writes apart from storage being unreachable
+        failed = []
+        for write in batch:
+            try:
+                self.apply_batch([write])
+                self._count('flushed')
+                self._failures.pop(write['id'], None)
+            except Exception as e:
+                failed.append((write, e))
+        # Others went through: what failed is bad on its own
+        storage_up = len(failed) < len(batch)
+        pending = []
+        for write, error in failed:
+            failures = self._failures[write['id']] = self._failures.get(write['id'], 0) + 1
+            if storage_up or self.is_permanent(error) or failures >= self.max_write_failures:
+                self._failures.pop(write['id'])
+                self._dead_letter(write, error)
+            else:
+                pending.append(write)
+        return pending
+
+    def _backoff(self, attempt):
+        delay = min(self.max_backoff, self.base_backoff * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+    # --- Spool ---
+    def _load_spool(self):
+        if not os.path.exists(self.spool_path):
+            return []
+        writes = []
+        with open(self.spool_path, encoding='utf-8') as spool:
+            for line in spool:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    writes.append(json.loads(line))
+                except ValueError:
+                    # A torn last line from a crash mid-write
+                    log.warning("Write-behind: ligne de spool ignorée: %s", line[:80])
+        return writes
+
+    def _rewrite_spool(self):
+        """Replace the spool with the writes still queued (caller holds the lock)"""
+        tmp_path = self.spool_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as tmp:
+            for write in self._queue:
+                tmp.write(json.dumps(write, ensure_ascii=False) + '\n')
+        self._spool.close()
+        os.replace(tmp_path, self.spool_path)
+        self._spool = open(self.spool_path, 'a', encoding='utf-8')
+
+    def _dead_letter(self, write, error):
+        log.error("Write-behind: écriture %s (%s) abandonnée: %s", write['id'], write['op'], error)
+        with open(self.dead_letter_path, 'a', encoding='utf-8') as dead:
+            dead.write(json.dumps(dict(write, error=str(error)), ensure_ascii=False) + '\n')
+        self._count('dead_lettered')
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats_counters[key] += amount